@@ -1,10 +1,10 @@
 # app.py
-import os, uuid, datetime, sys
-from flask import Flask, request, jsonify, g
+import os, uuid, datetime, sys, json
+from decimal import Decimal
+from flask import Flask, request, jsonify, g, Response
 from flask_cors import CORS
-from flask_socketio import SocketIO, emit, join_room, leave_room
-from sqlalchemy import create_engine, text
-import hashlib
+from flask_socketio import SocketIO, emit, join_room, leave_room, disconnect
+from sqlalchemy import text
 from dotenv import load_dotenv
 import secrets
 import base64
@@ -20,9 +20,20 @@ from security_utils import (
     validate_json_input, log_security_event,
     generate_jwt_token, generate_refresh_token, verify_jwt_token,
     jwt_required, jwt_optional, get_token_from_request,
-    create_session, validate_session, destroy_session, cleanup_expired_sessions,
+    record_login_attempt, validate_session, destroy_session, cleanup_expired_sessions,
     get_security_metrics, log_api_request, get_active_sessions_count,
-    set_db_engine
+    set_db_engine, get_event_pipeline_stats, start_metrics_rollup,
+    start_partition_maintenance, get_security_events, get_jwt_cache_stats,
+    start_revocation_sync, revoke_token, is_token_revoked,
+    hash_password, verify_password, PasswordHasherBusy,
+    get_current_user_claims, get_conversation_members, get_conversation_members_stats
+)
+from messaging_utils import next_message_timestamp, create_message_writer, create_fanout_manager, MessageIdConflict
+from directory_utils import create_provider_directory
+from metrics_utils import create_request_metrics, metrics_access_allowed
+from db_utils import (
+    create_database, create_db_engine, start_pool_liveness, render_pool_metrics, db_timeouts,
+    DB_POOL_PRE_PING, DATABASE_REPLICA_URL
 )
 
 print(">> Loading .env", flush=True)
@@ -36,32 +47,54 @@ if not DATABASE_URL:
     sys.exit(1)
 
 print(f">> Connecting to DB: {DATABASE_URL}", flush=True)
-engine = create_engine(DATABASE_URL, future=True, pool_pre_ping=True)
+engine = create_db_engine(DATABASE_URL)
+request_metrics = create_request_metrics(engine)
+
+# DATABASE_REPLICA_URL adds a streaming replica for db.read(); pointing it at
+# DATABASE_URL gives a stand-in replica for trying the routing locally
+replica_engine = None
+if DATABASE_REPLICA_URL:
+    print(f">> Connecting to read replica: {DATABASE_REPLICA_URL}", flush=True)
+    replica_engine = create_db_engine(DATABASE_REPLICA_URL)
+    request_metrics.instrument(replica_engine)
+
+# Pure reads use db.read() (autocommit, replica when possible); transactions
+# use db.write() (which pins the writer's reads to the primary) or engine.begin()
+db = create_database(engine, replica_engine)
+if not DB_POOL_PRE_PING:
+    start_pool_liveness(engine)
+    if replica_engine is not None:
+        start_pool_liveness(replica_engine, name='replica')
 
 # Initialize security utilities with database engine
 set_db_engine(engine)
+start_metrics_rollup()
+start_partition_maintenance()
+start_revocation_sync()
 
 app = Flask(__name__)
-CORS(app, resources={r"/api/*": {"origins": "*"}})
-socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
+CORS(app, resources={r"/api/*": {"origins": "*"}},
+     expose_headers=["Retry-After", "X-RateLimit-Limit", "X-RateLimit-Remaining", "X-RateLimit-Reset", "ETag", "X-Server-Timing"])
+
+# SOCKETIO_MESSAGE_QUEUE selects how room broadcasts reach clients held by
+# other worker processes (see run_workers.py); unset means a single process
+fanout_manager = create_fanout_manager()
+if fanout_manager:
+    socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading', client_manager=fanout_manager)
+else:
+    socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
 
 # Add security headers to all responses
 @app.after_request
 def after_request(response):
-    return add_security_headers(response)
+    return add_security_headers(request_metrics.finish_request(response))
 
 # Log all API requests for monitoring
 @app.before_request
 def before_request():
+    request_metrics.start_request()
     log_api_request()
 
-# Simple password hashing function
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
-
-def verify_password(password, hashed):
-    return hashlib.sha256(password.encode()).hexdigest() == hashed
-
 # ============ EMAIL VERIFICATION FUNCTIONS ============
 
 def generate_verification_token():
@@ -211,39 +244,99 @@ def verify_email_token(token):
 
 # ============ WEBSOCKET EVENTS ============
 
+# Authenticated user per socket: sid -> (access token, claims). Events act
+# as this user and ignore any user or sender id in their payload.
+socket_users = {}
+
+def current_socket_user():
+    """
+    Claims for the calling socket, or None once its token has expired or been
+    revoked. The token is rechecked on every event (a jwt_cache hit while it
+    is valid) and a socket whose token no longer verifies is disconnected.
+    """
+    entry = socket_users.get(request.sid)
+    if entry is None:
+        return None
+    claims = get_current_user_claims(entry[0])
+    if not claims:
+        socket_users.pop(request.sid, None)
+        emit('error', {'message': 'Session expired, please log in again'})
+        disconnect()
+        return None
+    return claims
+
+def ack_persisted_messages(batch):
+    """Durable ack: tell each sender which of their messages are now stored"""
+    by_sid = {}
+    for message, sid in batch:
+        by_sid.setdefault(sid, []).append(message['id'])
+    for sid, ids in by_sid.items():
+        if sid:
+            socketio.emit('message_persisted', {'ids': ids}, to=sid)
+
+def report_failed_messages(batch):
+    """Senders keep these messages and resend them with the same ids"""
+    by_sid = {}
+    for message, sid in batch:
+        by_sid.setdefault(sid, []).append(message['id'])
+    for sid, ids in by_sid.items():
+        if sid:
+            socketio.emit('message_failed', {'ids': ids}, to=sid)
+
+message_writer = create_message_writer(engine, on_persisted=ack_persisted_messages,
+                                       on_failed=report_failed_messages)
+
 @socketio.on('connect')
-def handle_connect():
-    print(f"Client connected: {request.sid}")
+def handle_connect(auth=None):
+    token = (auth or {}).get('token') or get_token_from_request()
+    claims = get_current_user_claims(token) if token else None
+    if not claims:
+        print(f"Rejected unauthenticated socket: {request.sid}")
+        raise ConnectionRefusedError('Authentication token is required')
+    
+    socket_users[request.sid] = (token, claims)
+    
+    # Dashboard rooms: pushed service request and inbox changes for this user
+    join_room(f"user_{claims['user_id']}")
+    if claims['user_type'] == 'ServiceProvider':
+        try:
+            with engine.begin() as conn:
+                provider_id = conn.execute(text("""
+                    SELECT id FROM service_providers WHERE user_id = :user_id
+                """), {"user_id": claims['user_id']}).scalar()
+            if provider_id:
+                join_room(f"provider_{provider_id}")
+        except Exception as e:
+            print(f"Error joining provider room: {repr(e)}", file=sys.stderr, flush=True)
+    
+    print(f"Client connected: {request.sid} (user {claims['user_id']})")
     emit('connected', {'message': 'Connected to server'})
 
 @socketio.on('disconnect')
 def handle_disconnect():
+    socket_users.pop(request.sid, None)
     print(f"Client disconnected: {request.sid}")
 
 @socketio.on('join_conversation')
 def handle_join_conversation(data):
     conversation_id = data.get('conversation_id')
-    user_id = data.get('user_id')
+    user = current_socket_user()
     
-    if conversation_id and user_id:
+    if not user:
+        emit('error', {'message': 'Not authenticated'})
+        return
+    
+    if conversation_id:
         # Verify user has access to this conversation
-        with engine.begin() as conn:
-            conv = conn.execute(text("""
-                SELECT c.user_id, c.provider_id, sp.user_id as provider_user_id
-                FROM conversations c
-                LEFT JOIN service_providers sp ON c.provider_id = sp.id
-                WHERE c.id = :conv_id
-            """), {"conv_id": conversation_id}).fetchone()
-            
-            if conv and (conv.user_id == user_id or conv.provider_user_id == user_id):
-                join_room(f"conversation_{conversation_id}")
-                emit('joined_conversation', {'conversation_id': conversation_id})
-                print(f"User {user_id} joined conversation {conversation_id}")
-            else:
-                print(f"Authorization failed for user {user_id} in conversation {conversation_id}")
-                print(f"Conversation user_id: {conv.user_id if conv else 'None'}")
-                print(f"Conversation provider_user_id: {conv.provider_user_id if conv else 'None'}")
-                emit('error', {'message': 'Unauthorized to join this conversation'})
+        members = get_conversation_members(conversation_id)
+        
+        if members and user['user_id'] in members:
+            join_room(f"conversation_{conversation_id}")
+            emit('joined_conversation', {'conversation_id': conversation_id})
+            print(f"User {user['user_id']} joined conversation {conversation_id}")
+        else:
+            print(f"Authorization failed for user {user['user_id']} in conversation {conversation_id}")
+            emit('error', {'message': 'Unauthorized to join this conversation'})
 
 @socketio.on('leave_conversation')
 def handle_leave_conversation(data):
@@ -255,74 +348,151 @@ def handle_leave_conversation(data):
 @socketio.on('send_message')
 def handle_send_message(data):
     conversation_id = data.get('conversation_id')
-    sender_id = data.get('sender_id')
-    sender_type = data.get('sender_type')
     message_text = data.get('message_text')
+    user = current_socket_user()
+    
+    if not user:
+        emit('error', {'message': 'Not authenticated'})
+        return
     
-    if not all([conversation_id, sender_id, sender_type, message_text]):
+    if not all([conversation_id, message_text]):
         emit('error', {'message': 'Missing required fields'})
         return
     
+    # The sender is the authenticated user; their side of the conversation
+    # decides the sender type
+    members = get_conversation_members(conversation_id)
+    if not members:
+        emit('error', {'message': 'Conversation not found'})
+        return
+    
+    sender_id = user['user_id']
+    if sender_id == members[0]:
+        sender_type = 'CLIENT'
+    elif sender_id == members[1]:
+        sender_type = 'PROVIDER'
+    else:
+        print(f"Send authorization failed: user {sender_id} in conversation {conversation_id}")
+        emit('error', {'message': 'Unauthorized'})
+        return
+    
+    # Clients pick the id so a resend after a lost ack is recognised
     try:
-        with engine.begin() as conn:
-            # Verify conversation exists and sender is authorized
-            conv = conn.execute(text("""
-                SELECT c.user_id, c.provider_id, sp.user_id as provider_user_id
-                FROM conversations c
-                LEFT JOIN service_providers sp ON c.provider_id = sp.id
-                WHERE c.id = :conv_id
-            """), {"conv_id": conversation_id}).fetchone()
-            
-            if not conv:
-                emit('error', {'message': 'Conversation not found'})
-                return
-            
-            # Check authorization
-            if sender_type == 'CLIENT' and conv.user_id != sender_id:
-                print(f"Client authorization failed: sender_id={sender_id}, conv.user_id={conv.user_id}")
-                emit('error', {'message': 'Unauthorized'})
-                return
-            elif sender_type == 'PROVIDER' and conv.provider_user_id != sender_id:
-                print(f"Provider authorization failed: sender_id={sender_id}, conv.provider_user_id={conv.provider_user_id}")
-                emit('error', {'message': 'Unauthorized'})
-                return
-            
-            # Insert message
-            message_id = str(uuid.uuid4())
-            conn.execute(text("""
-                INSERT INTO messages (id, conversation_id, sender_id, sender_type, message_text, created_date)
-                VALUES (:id, :conversation_id, :sender_id, :sender_type, :message_text, NOW())
-            """), {
-                "id": message_id,
-                "conversation_id": conversation_id,
-                "sender_id": sender_id,
-                "sender_type": sender_type,
-                "message_text": message_text
-            })
-            
-            # Log message
-            conn.execute(text("""
-                INSERT INTO audit_log (action_type, description, created_by, created_at)
-                VALUES ('MESSAGE_SENT', 'Message sent in conversation: ' || :conv_id, :sender_id, NOW())
-            """), {"conv_id": conversation_id, "sender_id": sender_id})
-        
-        # Broadcast message to all users in the conversation room
-        message_data = {
-            'id': message_id,
-            'conversation_id': conversation_id,
-            'sender_id': sender_id,
-            'sender_type': sender_type,
-            'message_text': message_text,
-            'created_date': datetime.datetime.utcnow().isoformat(),
-            'is_read': False
-        }
+        message_id = str(uuid.UUID(data['id'])) if data.get('id') else str(uuid.uuid4())
+    except ValueError:
+        emit('error', {'message': 'Invalid message id'})
+        return
+    
+    # A resend keeps the timestamp of the copy that is stored, so the cursor
+    # recipients were sent never runs ahead of the row: a copy still queued
+    # just gains this socket as an ack target, a stored one is acked again.
+    # Resends match on id, conversation and sender; an id taken by another
+    # conversation or sender is refused
+    try:
+        if message_writer.attach(message_id, conversation_id, sender_id, ack_target=request.sid):
+            return
+    except MessageIdConflict:
+        emit('error', {'message': 'Invalid message id'})
+        return
+    if data.get('resend'):
+        try:
+            with db.read(primary=True) as conn:
+                stored = conn.execute(text("""
+                    SELECT conversation_id, sender_id FROM messages WHERE id = :id
+                """), {"id": message_id}).fetchone()
+        except Exception as e:
+            print(f"Resend lookup failed for message {message_id}: {e}", flush=True)
+            emit('message_failed', {'ids': [message_id]})
+            return
+        if stored and (stored.conversation_id, stored.sender_id) != (conversation_id, sender_id):
+            emit('error', {'message': 'Invalid message id'})
+            return
+        if stored:
+            emit('message_persisted', {'ids': [message_id]})
+            return
+    
+    created_date = next_message_timestamp()
+    message = {
+        'id': message_id,
+        'conversation_id': conversation_id,
+        'sender_id': sender_id,
+        'sender_type': sender_type,
+        'message_text': message_text,
+        'created_date': created_date
+    }
+    
+    # Broadcast now; the writer stores it in the next batch and then sends
+    # the sender a message_persisted ack
+    try:
+        queued = message_writer.submit(message, ack_target=request.sid)
+    except MessageIdConflict:
+        emit('error', {'message': 'Invalid message id'})
+        return
+    if queued is None:
+        emit('message_failed', {'ids': [message_id]})
+        return
+    if queued is not message:
+        return  # a concurrent resend queued it first and has broadcast it
+    db.pin_to_primary(('conversation', conversation_id), ('user', sender_id))
+    
+    message_data = dict(message,
+                        created_date=created_date.isoformat(),
+                        cursor=encode_message_cursor(created_date, message_id),
+                        is_read=False)
+    socketio.emit('new_message', message_data, room=f"conversation_{conversation_id}")
+    push_conversation_update(members, {
+        'conversation_id': conversation_id,
+        'last_message_text': message_text[:200],
+        'last_message_at': message_data['created_date'],
+        'last_sender_type': sender_type,
+        'sender_id': sender_id
+    })
+
+@socketio.on('mark_read')
+def handle_mark_read(data):
+    """Advance the caller's read watermark; same as PUT /api/conversations/<id>/read"""
+    conversation_id = data.get('conversation_id')
+    user = current_socket_user()
+    
+    if not user:
+        emit('error', {'message': 'Not authenticated'})
+        return
+    
+    if not conversation_id:
+        emit('error', {'message': 'Missing required fields'})
+        return
+    
+    user_id = user['user_id']
+    try:
+        cursor = decode_message_cursor(data['cursor']) if data.get('cursor') else None
+        with db.write(pin=[('conversation', conversation_id), ('user', user_id)]) as conn:
+            unread_count = mark_read_up_to(conn, conversation_id, user_id, cursor)
         
-        socketio.emit('new_message', message_data, room=f"conversation_{conversation_id}")
-        print(f"Message sent in conversation {conversation_id} by {sender_type} {sender_id}")
+        if unread_count is None:
+            emit('error', {'message': 'Unauthorized'})
+            return
         
+        socketio.emit('messages_read', {
+            'conversation_id': conversation_id,
+            'user_id': user_id,
+            'cursor': data.get('cursor'),
+            'unread_count': unread_count
+        }, room=f"conversation_{conversation_id}")
+        push_conversation_update([user_id], {'conversation_id': conversation_id, 'unread_count': unread_count})
+    except ValueError:
+        emit('error', {'message': 'Invalid cursor'})
     except Exception as e:
-        print(f"Error sending message: {repr(e)}", file=sys.stderr, flush=True)
-        emit('error', {'message': 'Failed to send message'})
+        print(f"Error marking conversation read: {repr(e)}", file=sys.stderr, flush=True)
+        emit('error', {'message': 'Failed to mark conversation as read'})
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """Per-route latency and SQL counters in the Prometheus text format"""
+    if not metrics_access_allowed():
+        return jsonify({"ok": False, "msg": "Access denied"}), 403
+    pools = {"primary": engine, "replica": replica_engine} if replica_engine is not None else {"primary": engine}
+    body = request_metrics.render_prometheus() + render_pool_metrics(pools) + db.render_prometheus()
+    return Response(body, mimetype="text/plain; version=0.0.4")
 
 @app.get("/api/health")
 def health():
@@ -340,7 +510,7 @@ def refresh_token():
         return jsonify({"ok": False, "msg": "Refresh token is required"}), 400
     
     payload = verify_jwt_token(refresh_token)
-    if not payload or payload.get('type') != 'refresh':
+    if not isinstance(payload, dict) or payload.get('type') != 'refresh' or is_token_revoked(refresh_token):
         return jsonify({"ok": False, "msg": "Invalid refresh token"}), 401
     
     user_id = payload['user_id']
@@ -376,13 +546,19 @@ def refresh_token():
 @app.post("/api/auth/logout")
 @jwt_required
 def logout():
-    """Logout user and invalidate session"""
+    """Logout user, invalidate session and revoke tokens"""
     try:
         # Get session ID from request
         session_id = request.headers.get('X-Session-ID')
         if session_id:
             destroy_session(session_id)
         
+        # Revoke the access token used for this request and the refresh token if provided
+        revoke_token(get_token_from_request())
+        b = request.get_json(silent=True) or {}
+        if b.get("refresh_token"):
+            revoke_token(b["refresh_token"])
+        
         # Log logout event
         log_security_event(
             'LOGOUT',
@@ -409,11 +585,41 @@ def get_security_metrics_endpoint():
     
     try:
         metrics = get_security_metrics()
-        return jsonify({"ok": True, "metrics": metrics}), 200
+        caches = {
+            "jwt": get_jwt_cache_stats(),
+            "conversation_membership": get_conversation_members_stats(),
+            "provider_directory": provider_directory.get_stats()
+        }
+        return jsonify({"ok": True, "metrics": metrics, "caches": caches}), 200
     except Exception as e:
         print("!! /api/security/metrics error:", repr(e), file=sys.stderr, flush=True)
         return jsonify({"ok": False, "msg": "Failed to get metrics", "error": str(e)}), 500
 
+@app.get("/api/security/events")
+@jwt_required
+def get_security_events_endpoint():
+    """Get recent security events (admin only)"""
+    if g.current_user['user_type'] not in ['ServiceProvider', 'Admin']:
+        return jsonify({"ok": False, "msg": "Access denied"}), 403
+    
+    try:
+        hours = min(max(int(request.args.get('hours', 1)), 1), 24 * 30)
+        limit = min(max(int(request.args.get('limit', 100)), 1), 1000)
+    except ValueError:
+        return jsonify({"ok": False, "msg": "hours and limit must be integers"}), 400
+    
+    try:
+        events = get_security_events(
+            hours=hours,
+            event_type=request.args.get('event_type'),
+            ip_address=request.args.get('ip'),
+            limit=limit
+        )
+        return jsonify({"ok": True, "events": events}), 200
+    except Exception as e:
+        print("!! /api/security/events error:", repr(e), file=sys.stderr, flush=True)
+        return jsonify({"ok": False, "msg": "Failed to get events", "error": str(e)}), 500
+
 @app.get("/api/security/sessions")
 @jwt_required
 def get_active_sessions():
@@ -425,6 +631,41 @@ def get_active_sessions():
         print("!! /api/security/sessions error:", repr(e), file=sys.stderr, flush=True)
         return jsonify({"ok": False, "msg": "Failed to get sessions", "error": str(e)}), 500
 
+@app.get("/api/security/event-pipeline")
+@jwt_required
+def get_event_pipeline():
+    """Get security event pipeline counters (admin only)"""
+    if g.current_user['user_type'] not in ['ServiceProvider', 'Admin']:
+        return jsonify({"ok": False, "msg": "Access denied"}), 403
+    
+    return jsonify({"ok": True, "pipeline": get_event_pipeline_stats()}), 200
+
+@app.get("/api/messaging/pipeline")
+@jwt_required
+def get_message_pipeline():
+    """Get chat message writer counters: batch sizes and persistence lag (admin only)"""
+    if g.current_user['user_type'] not in ['ServiceProvider', 'Admin']:
+        return jsonify({"ok": False, "msg": "Access denied"}), 403
+    
+    return jsonify({"ok": True, "pipeline": message_writer.get_stats()}), 200
+
+@app.get("/api/metrics/queries")
+@jwt_required
+def get_query_profile():
+    """Top SQL fingerprints by total time and routes flagged for N+1 queries (admin only, needs SQL_PROFILE)"""
+    if g.current_user['user_type'] not in ['ServiceProvider', 'Admin']:
+        return jsonify({"ok": False, "msg": "Access denied"}), 403
+    
+    if request_metrics.profiler is None:
+        return jsonify({"ok": False, "msg": "Query profiling is off; set SQL_PROFILE=1"}), 404
+    
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), 500)
+    except ValueError:
+        return jsonify({"ok": False, "msg": "limit must be an integer"}), 400
+    
+    return jsonify({"ok": True, "profile": request_metrics.profiler.get_stats(limit=limit)}), 200
+
 @app.post("/api/security/cleanup")
 @jwt_required
 def cleanup_sessions():
@@ -478,10 +719,13 @@ def register():
     last = " ".join(parts[1:]) if len(parts) > 1 else ""
 
     user_id = str(uuid.uuid4())
-    pw_hash = hash_password(password)
+    try:
+        pw_hash = hash_password(password)
+    except PasswordHasherBusy:
+        return jsonify({"ok": False, "msg": "Server is busy, please try again"}), 503, {"Retry-After": "1"}
 
     try:
-        with engine.begin() as conn:
+        with db.write(pin=[('user', user_id)]) as conn:
             conn.execute(text("""
               INSERT INTO users_login (id, email, password_hash, user_type, created_date)
               VALUES (:id,:email,:hash,:user_type, NOW())
@@ -536,8 +780,8 @@ def login():
     email = sanitize_input(email, max_length=255)
     
     try:
-        with engine.begin() as conn:
-            # Get user with password hash
+        # Primary, not a replica: a lagging copy could still accept an old password
+        with db.read(primary=True) as conn:
             row = conn.execute(text("""
                 SELECT u.id, u.email, u.password_hash, u.is_active, u.is_locked, u.user_type, u.email_verified,
                        p.first_name, p.last_name, u.created_date AS created_at
@@ -545,97 +789,80 @@ def login():
                 LEFT JOIN immigrant_profile p ON p.user_id = u.id
                 WHERE u.email = :email
             """), {"email": email}).fetchone()
+        
+        if not row:
+            # Log failed attempt
+            with db.write(autocommit=True) as conn:
+                record_login_attempt(conn, None, email, success=False)
+            return jsonify({"ok": False, "msg": "Invalid email or password"}), 401
+        
+        # Check if account is locked or inactive
+        if row.is_locked:
+            return jsonify({"ok": False, "msg": "Account is locked. Please contact support."}), 401
+        
+        if not row.is_active:
+            return jsonify({"ok": False, "msg": "Account is inactive. Please contact support."}), 401
+        
+        # Check if email is verified
+        if not row.email_verified:
+            return jsonify({"ok": False, "msg": "Please verify your email address before logging in. Check your email for the verification link."}), 401
+        
+        # Check user type validation
+        if expected_user_type == "ServiceProvider" and row.user_type != "ServiceProvider":
+            log_security_event("LOGIN_FAILURE", f"Service provider login attempt with client account: {email}")
+            return jsonify({"ok": False, "msg": "This account is not registered as a service provider. Please use the client login."}), 401
+        elif expected_user_type == "Immigrant" and row.user_type == "ServiceProvider":
+            log_security_event("LOGIN_FAILURE", f"Client login attempt with service provider account: {email}")
+            return jsonify({"ok": False, "msg": "This account is registered as a service provider. Please use the service provider login."}), 401
+        
+        # Verify password (no connection is held while hashing)
+        password_ok, needs_rehash = verify_password(password, row.password_hash)
+        if not password_ok:
+            # Log failed attempt and increment login attempts
+            with db.write(autocommit=True) as conn:
+                record_login_attempt(conn, row.id, email, success=False)
+            return jsonify({"ok": False, "msg": "Invalid email or password"}), 401
+        
+        # Successful login: one login_attempt() call resets attempts, updates
+        # last login, upgrades an outdated hash, writes the audit row and
+        # creates the session
+        new_hash = hash_password(password) if needs_rehash else None
+        with db.write(autocommit=True, pin=[('user', row.id)]) as conn:
+            session_id = record_login_attempt(conn, row.id, row.email, success=True,
+                                              user_type=row.user_type, new_hash=new_hash)
+        
+        # Tokens are only issued once the login is committed
+        log_security_event('SESSION_CREATED', f"New session created for user {row.email}",
+                           user_id=row.id, severity='INFO')
+        access_token = generate_jwt_token(row.id, row.user_type, row.email)
+        refresh_token = generate_refresh_token(row.id)
+        
+        return jsonify({
+            "ok": True, 
+            "user": {
+                "id": row.id,
+                "email": row.email,
+                "full_name": " ".join([x for x in [row.first_name, row.last_name] if x]),
+                "user_type": row.user_type,
+                "created_at": row.created_at.isoformat() if row.created_at else None
+            },
+            "tokens": {
+                "access_token": access_token,
+                "refresh_token": refresh_token,
+                "expires_in": 86400  # 24 hours in seconds
+            },
+            "session_id": session_id
+        }), 200
             
-            if not row:
-                # Log failed attempt
-                conn.execute(text("""
-                    INSERT INTO audit_log (action_type, description, created_at)
-                    VALUES ('LOGIN_FAILURE', 'User not found: ' || :email, NOW())
-                """), {"email": email})
-                return jsonify({"ok": False, "msg": "Invalid email or password"}), 401
-            
-            # Check if account is locked or inactive
-            if row.is_locked:
-                return jsonify({"ok": False, "msg": "Account is locked. Please contact support."}), 401
-            
-            if not row.is_active:
-                return jsonify({"ok": False, "msg": "Account is inactive. Please contact support."}), 401
-            
-            # Check if email is verified
-            if not row.email_verified:
-                return jsonify({"ok": False, "msg": "Please verify your email address before logging in. Check your email for the verification link."}), 401
-            
-            # Check user type validation
-            if expected_user_type == "ServiceProvider" and row.user_type != "ServiceProvider":
-                log_security_event("LOGIN_FAILURE", f"Service provider login attempt with client account: {email}")
-                return jsonify({"ok": False, "msg": "This account is not registered as a service provider. Please use the client login."}), 401
-            elif expected_user_type == "Immigrant" and row.user_type == "ServiceProvider":
-                log_security_event("LOGIN_FAILURE", f"Client login attempt with service provider account: {email}")
-                return jsonify({"ok": False, "msg": "This account is registered as a service provider. Please use the service provider login."}), 401
-            
-            # Verify password
-            if not verify_password(password, row.password_hash):
-                # Log failed attempt and increment login attempts
-                conn.execute(text("""
-                    UPDATE users_login 
-                    SET login_attempts = login_attempts + 1, 
-                        attempt_time = NOW()
-                    WHERE id = :id
-                """), {"id": row.id})
-                
-                conn.execute(text("""
-                    INSERT INTO audit_log (action_type, description, created_by, created_at)
-                    VALUES ('LOGIN_FAILURE', 'Invalid password attempt', :uid, NOW())
-                """), {"uid": row.id})
-                
-                return jsonify({"ok": False, "msg": "Invalid email or password"}), 401
-            
-            # Successful login - reset attempts and update last login
-            conn.execute(text("""
-                UPDATE users_login 
-                SET login_attempts = 0, 
-                    last_login = NOW(),
-                    login_status = 'SUCCESS'
-                WHERE id = :id
-            """), {"id": row.id})
-            
-            # Log successful login
-            conn.execute(text("""
-                INSERT INTO audit_log (action_type, description, created_by, created_at)
-                VALUES ('LOGIN_SUCCESS', 'User logged in successfully', :uid, NOW())
-            """), {"uid": row.id})
-            
-            # Generate JWT tokens
-            access_token = generate_jwt_token(row.id, row.user_type, row.email)
-            refresh_token = generate_refresh_token(row.id)
-            
-            # Create session
-            session_id = create_session(row.id, row.user_type, row.email)
-            
-            return jsonify({
-                "ok": True, 
-                "user": {
-                    "id": row.id,
-                    "email": row.email,
-                    "full_name": " ".join([x for x in [row.first_name, row.last_name] if x]),
-                    "user_type": row.user_type,
-                    "created_at": row.created_at.isoformat() if row.created_at else None
-                },
-                "tokens": {
-                    "access_token": access_token,
-                    "refresh_token": refresh_token,
-                    "expires_in": 86400  # 24 hours in seconds
-                },
-                "session_id": session_id
-            }), 200
-            
+    except PasswordHasherBusy:
+        return jsonify({"ok": False, "msg": "Server is busy, please try again"}), 503, {"Retry-After": "1"}
     except Exception as e:
         print("!! /api/login error:", repr(e), file=sys.stderr, flush=True)
         return jsonify({"ok": False, "msg": "Login failed", "error": str(e)}), 500
 
 @app.get("/api/users/<user_id>")
 def get_user(user_id):
-    with engine.begin() as conn:
+    with db.read() as conn:
         row = conn.execute(text("""
             SELECT u.id, u.email, p.first_name, p.last_name, u.created_date AS created_at
             FROM users_login u LEFT JOIN immigrant_profile p ON p.user_id = u.id
@@ -655,7 +882,7 @@ def get_user(user_id):
 
 @app.get("/api/users/<user_id>/profile")
 def get_user_profile(user_id):
-    with engine.begin() as conn:
+    with db.read() as conn:
         row = conn.execute(text("""
             SELECT u.id, u.email, u.created_date AS created_at,
                    p.first_name, p.last_name, p.phone, p.age, p.country_residence,
@@ -687,46 +914,350 @@ def get_user_profile(user_id):
         }
     }
 
+PROVIDER_DIRECTORY_PAGE_SIZE = int(os.getenv("PROVIDER_DIRECTORY_PAGE_SIZE", "100"))
+PROVIDER_DIRECTORY_PAGE_MAX = 500
+PROVIDER_DIRECTORY_FIELDS = ("id", "name", "email", "phone", "address", "service_type", "description",
+                             "website", "rating", "total_reviews", "created_date")
+
+# Serialized directory pages per query, dropped whenever any worker writes
+# service_providers (see directory_utils)
+provider_directory = create_provider_directory(engine)
+
+def encode_provider_cursor(rating, name, provider_id):
+    """Opaque cursor for a directory position: base64 of [rating, name, id]"""
+    raw = json.dumps([str(rating), name, provider_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_provider_cursor(cursor):
+    """Inverse of encode_provider_cursor; raises ValueError on a malformed cursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        rating, name, provider_id = json.loads(raw)
+        return Decimal(rating), str(name), str(provider_id)
+    except Exception as e:
+        raise ValueError("invalid cursor") from e
+
+def serialize_provider(row, fields=PROVIDER_DIRECTORY_FIELDS):
+    """Public directory entry for a service_providers row, limited to fields"""
+    provider = {
+        "id": row.id,
+        "name": row.name,
+        "email": row.email,
+        "phone": row.phone,
+        "address": row.address,
+        "service_type": row.service_type,
+        "description": row.description,
+        "website": row.website,
+        "rating": float(row.rating) if row.rating else 0.0,
+        "total_reviews": row.total_reviews,
+        "created_date": row.created_date.isoformat() if row.created_date else None
+    }
+    return {field: provider[field] for field in fields}
+
+def parse_provider_fields(value):
+    """?fields=a,b as a canonical tuple (id always included); raises ValueError on unknown fields"""
+    requested = {f.strip() for f in (value or "").split(",") if f.strip()}
+    unknown = requested - set(PROVIDER_DIRECTORY_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    if not requested:
+        return PROVIDER_DIRECTORY_FIELDS
+    # Canonical order, so equal projections share a cache entry
+    return tuple(f for f in PROVIDER_DIRECTORY_FIELDS if f == "id" or f in requested)
+
+def build_provider_directory_page(service_type, cursor, limit, fields):
+    """JSON body (bytes) for one directory page, best rated first"""
+    query = """
+        SELECT id, name, email, phone, address, service_type, description, 
+               website, rating, total_reviews, created_date
+        FROM service_providers 
+        WHERE is_active = true
+    """
+    params = {"limit": limit + 1}
+    if service_type:
+        query += " AND service_type = :service_type"
+        params["service_type"] = service_type
+    if cursor:
+        query += " AND (rating < :c_rating OR (rating = :c_rating AND (name, id) > (:c_name, :c_id)))"
+        params["c_rating"], params["c_name"], params["c_id"] = cursor
+    
+    query += " ORDER BY rating DESC, name ASC, id ASC LIMIT :limit"
+    
+    # The cache version is read from the primary; rows from a lagging replica
+    # could be older than it and stay cached. Misses are rare, so use the primary
+    with db.read(primary=True) as conn:
+        rows = conn.execute(text(query), params).fetchall()
+    
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    
+    providers = [serialize_provider(row, fields) for row in rows]
+    last = rows[-1] if rows else None
+    return json.dumps({
+        "ok": True,
+        "providers": providers,
+        "next_cursor": encode_provider_cursor(last.rating, last.name, last.id) if has_more else None,
+        "has_more": has_more
+    }).encode()
+
 @app.get("/api/service-providers")
+@db_timeouts(statement_ms=5000)
 def get_service_providers():
-    service_type = request.args.get('service_type')
-    with engine.begin() as conn:
-        query = """
-            SELECT id, name, email, phone, address, service_type, description, 
-                   website, rating, total_reviews, created_date
-            FROM service_providers 
-            WHERE is_active = true
-        """
-        params = {}
-        if service_type:
-            query += " AND service_type = :service_type"
-            params["service_type"] = service_type
-        
-        query += " ORDER BY rating DESC, name ASC"
-        
-        rows = conn.execute(text(query), params).fetchall()
+    """
+    Active providers, best rated first, in pages of ?limit= continued with
+    ?cursor=<next_cursor>. ?fields=a,b picks the provider fields returned.
+    Bodies are cached per query with a strong ETag; a matching
+    If-None-Match gets a 304 without a database query.
+    """
+    service_type = request.args.get('service_type') or None
     
-    providers = []
-    for row in rows:
-        providers.append({
-            "id": row.id,
-            "name": row.name,
-            "email": row.email,
-            "phone": row.phone,
-            "address": row.address,
-            "service_type": row.service_type,
-            "description": row.description,
-            "website": row.website,
-            "rating": float(row.rating) if row.rating else 0.0,
-            "total_reviews": row.total_reviews,
-            "created_date": row.created_date.isoformat() if row.created_date else None
-        })
+    try:
+        limit = min(max(int(request.args.get("limit", PROVIDER_DIRECTORY_PAGE_SIZE)), 1), PROVIDER_DIRECTORY_PAGE_MAX)
+    except ValueError:
+        return jsonify({"ok": False, "msg": "limit must be an integer"}), 400
     
-    return {"ok": True, "providers": providers}
+    cursor = request.args.get("cursor") or None
+    try:
+        decoded_cursor = decode_provider_cursor(cursor) if cursor else None
+    except ValueError:
+        return jsonify({"ok": False, "msg": "cursor must come from a directory page"}), 400
+    
+    try:
+        fields = parse_provider_fields(request.args.get("fields"))
+    except ValueError as e:
+        return jsonify({"ok": False, "msg": str(e)}), 400
+    
+    key = (service_type, cursor, limit, fields)
+    body, etag = provider_directory.get(
+        key, lambda: build_provider_directory_page(service_type, decoded_cursor, limit, fields))
+    
+    headers = {"ETag": f'"{etag}"', "Cache-Control": "no-cache"}
+    if request.if_none_match.contains_weak(etag):
+        return Response(status=304, headers=headers)
+    return Response(body, mimetype="application/json", headers=headers)
+
+PROVIDER_SEARCH_PAGE_SIZE = 20
+PROVIDER_SEARCH_PAGE_MAX = 100
+
+def encode_search_cursor(rank, provider_id):
+    """Opaque cursor for a search result position: base64 of [rank, id]"""
+    raw = json.dumps([rank, provider_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_search_cursor(cursor):
+    """Inverse of encode_search_cursor; raises ValueError on a malformed cursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        rank, provider_id = json.loads(raw)
+        return float(rank), str(provider_id)
+    except Exception as e:
+        raise ValueError("invalid cursor") from e
+
+@app.get("/api/service-providers/search")
+@db_timeouts(statement_ms=5000)
+def search_service_providers():
+    """
+    Ranked full-text search over provider name, description and address
+    (?q=, web search syntax: quoted phrases, OR, -word), optionally filtered
+    by ?service_type= and ?min_rating=. Results are ordered by (rank, id) and
+    continued with ?cursor=<next_cursor>. The first page also returns match
+    counts per service_type (ignoring the service_type filter) for facets.
+    """
+    q = (request.args.get("q") or "").strip()
+    if not q:
+        return jsonify({"ok": False, "msg": "q is required"}), 400
+    q = q[:200]  # bound as a parameter; quotes and operators are query syntax
+    service_type = request.args.get("service_type") or None
+    
+    try:
+        limit = min(max(int(request.args.get("limit", PROVIDER_SEARCH_PAGE_SIZE)), 1), PROVIDER_SEARCH_PAGE_MAX)
+        min_rating = float(request.args.get("min_rating", "0"))
+    except ValueError:
+        return jsonify({"ok": False, "msg": "limit and min_rating must be numbers"}), 400
+    
+    if not 0 <= min_rating <= 5:
+        return jsonify({"ok": False, "msg": "min_rating must be between 0 and 5"}), 400
+    
+    try:
+        fields = parse_provider_fields(request.args.get("fields"))
+    except ValueError as e:
+        return jsonify({"ok": False, "msg": str(e)}), 400
+    
+    cursor = request.args.get("cursor") or None
+    try:
+        after = decode_search_cursor(cursor) if cursor else None
+    except ValueError:
+        return jsonify({"ok": False, "msg": "cursor must come from a search page"}), 400
+    
+    # rank is widened to float8 so the value in a cursor compares exactly
+    matches = """
+        SELECT sp.id, sp.name, sp.email, sp.phone, sp.address, sp.service_type, sp.description,
+               sp.website, sp.rating, sp.total_reviews, sp.created_date,
+               ts_rank(sp.search_vector, query)::float8 AS rank
+        FROM service_providers sp, websearch_to_tsquery('english', :q) query
+        WHERE sp.is_active AND sp.search_vector @@ query AND sp.rating >= :min_rating
+    """
+    params = {"q": q, "min_rating": min_rating, "limit": limit + 1}
+    
+    page_query = f"SELECT * FROM ({matches}) m WHERE TRUE"
+    if service_type:
+        page_query += " AND m.service_type = :service_type"
+        params["service_type"] = service_type
+    if after:
+        page_query += " AND (m.rank < :c_rank OR (m.rank = :c_rank AND m.id > :c_id))"
+        params["c_rank"], params["c_id"] = after
+    page_query += " ORDER BY m.rank DESC, m.id ASC LIMIT :limit"
+    
+    try:
+        with db.read() as conn:
+            rows = conn.execute(text(page_query), params).fetchall()
+            
+            facets = None
+            if not after:
+                facet_rows = conn.execute(text(f"""
+                    SELECT m.service_type, COUNT(*) AS count
+                    FROM ({matches}) m
+                    GROUP BY m.service_type
+                    ORDER BY count DESC, m.service_type
+                """), {"q": q, "min_rating": min_rating}).fetchall()
+                facets = {row.service_type: row.count for row in facet_rows}
+    except Exception as e:
+        print("!! /api/service-providers/search error:", repr(e), file=sys.stderr, flush=True)
+        return jsonify({"ok": False, "msg": "Search failed", "error": str(e)}), 400
+    
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    providers = [dict(serialize_provider(row, fields), rank=row.rank) for row in rows]
+    
+    return {
+        "ok": True,
+        "providers": providers,
+        "facets": facets,
+        "next_cursor": encode_search_cursor(rows[-1].rank, rows[-1].id) if has_more else None,
+        "has_more": has_more
+    }
+
+# ============ DASHBOARD CHANGE FEED ============
+
+# Writes to service requests and conversations are pushed to the
+# "user_<user id>" and "provider_<provider id>" rooms each socket joins at
+# connect. Every service request write also stamps the row with a change_seq
+# (db/init/016), so a dashboard that was offline asks for everything after the
+# last change_seq it saw instead of reloading.
+
+SERVICE_REQUEST_CHANGES_MAX = 200
+
+SERVICE_REQUEST_CHANGE_QUERY = """
+    SELECT sr.id, sr.user_id, sr.provider_id, sr.service_type, sr.title, sr.description,
+           sr.status, sr.priority, sr.requested_date, sr.accepted_date, sr.completed_date,
+           sr.notes, sr.change_seq, c.id as conversation_id,
+           sp.name as provider_name, sp.email as provider_email, sp.phone as provider_phone,
+           u.email as client_email, p.first_name as client_first_name,
+           p.last_name as client_last_name
+    FROM service_requests sr
+    JOIN service_providers sp ON sp.id = sr.provider_id
+    JOIN users_login u ON u.id = sr.user_id
+    LEFT JOIN immigrant_profile p ON p.user_id = u.id
+    LEFT JOIN conversations c ON c.service_request_id = sr.id
+"""
+
+def serialize_service_request_change(row):
+    """Full current state of a request, shaped for both dashboards' request lists"""
+    return {
+        "id": row.id,
+        "user_id": row.user_id,
+        "provider_id": row.provider_id,
+        "service_type": row.service_type,
+        "title": row.title,
+        "description": row.description,
+        "status": row.status,
+        "priority": row.priority,
+        "requested_date": row.requested_date.isoformat() if row.requested_date else None,
+        "accepted_date": row.accepted_date.isoformat() if row.accepted_date else None,
+        "completed_date": row.completed_date.isoformat() if row.completed_date else None,
+        "notes": row.notes,
+        "conversation_id": row.conversation_id,
+        "change_seq": row.change_seq,
+        "provider": {
+            "name": row.provider_name,
+            "email": row.provider_email,
+            "phone": row.provider_phone
+        },
+        "client": {
+            "email": row.client_email,
+            "name": " ".join([x for x in [row.client_first_name, row.client_last_name] if x]) or "Unknown"
+        }
+    }
+
+def fetch_service_request_change(conn, request_id):
+    """Read a request as written by the current transaction, for pushing after commit"""
+    row = conn.execute(text(SERVICE_REQUEST_CHANGE_QUERY + " WHERE sr.id = :request_id"),
+                       {"request_id": request_id}).fetchone()
+    return serialize_service_request_change(row) if row else None
+
+def push_service_request_change(change):
+    """Send a committed request change to its client's and provider's dashboards"""
+    if not change:
+        return
+    try:
+        socketio.emit('service_request_changed', change,
+                      to=[f"user_{change['user_id']}", f"provider_{change['provider_id']}"])
+    except Exception as e:
+        # The write is committed; dashboards catch up through /changes
+        print(f"Error pushing service request change: {repr(e)}", file=sys.stderr, flush=True)
+
+def push_conversation_update(user_ids, update):
+    """Send a partial conversation list entry (preview, unread count) to these users"""
+    rooms = [f"user_{uid}" for uid in user_ids if uid is not None]  # provider without a user_id
+    if not rooms:
+        return
+    try:
+        socketio.emit('conversation_updated', update, to=rooms)
+    except Exception as e:
+        print(f"Error pushing conversation update: {repr(e)}", file=sys.stderr, flush=True)
+
+@app.get("/api/service-requests/changes")
+@jwt_required
+@db_timeouts(statement_ms=5000)
+def get_service_request_changes():
+    """Changes to the caller's service requests after ?since=<change_seq>, oldest first"""
+    try:
+        since = int(request.args.get("since", "0"))
+        limit = min(max(int(request.args.get("limit", SERVICE_REQUEST_CHANGES_MAX)), 1), SERVICE_REQUEST_CHANGES_MAX)
+    except ValueError:
+        return jsonify({"ok": False, "msg": "since and limit must be integers"}), 400
+    
+    user = g.current_user
+    with db.read() as conn:
+        if user['user_type'] == 'ServiceProvider':
+            owner_id = conn.execute(text("""
+                SELECT id FROM service_providers WHERE user_id = :user_id
+            """), {"user_id": user['user_id']}).scalar()
+            if not owner_id:
+                return jsonify({"ok": False, "msg": "Provider profile not found"}), 404
+            owner_column = "sr.provider_id"
+        else:
+            owner_id, owner_column = user['user_id'], "sr.user_id"
+        
+        # One extra row tells whether another page follows
+        rows = conn.execute(text(SERVICE_REQUEST_CHANGE_QUERY + f"""
+            WHERE {owner_column} = :owner_id AND sr.change_seq > :since
+            ORDER BY sr.change_seq
+            LIMIT :limit
+        """), {"owner_id": owner_id, "since": since, "limit": limit + 1}).fetchall()
+    
+    changes = [serialize_service_request_change(row) for row in rows[:limit]]
+    return {
+        "ok": True,
+        "changes": changes,
+        "cursor": changes[-1]["change_seq"] if changes else since,
+        "has_more": len(rows) > limit
+    }
 
 @app.post("/api/service-requests")
 @jwt_required
 @rate_limit(max_requests=20, window_seconds=300)  # 20 requests per 5 minutes
+@db_timeouts(lock_ms=3000)
 def create_service_request():
     b = request.get_json(force=True) or {}
     user_id = b.get("user_id")
@@ -761,7 +1292,7 @@ def create_service_request():
     request_id = str(uuid.uuid4())
     
     try:
-        with engine.begin() as conn:
+        with db.write(pin=[('user', user_id), ('provider', provider_id)]) as conn:
             conn.execute(text("""
                 INSERT INTO service_requests (id, user_id, provider_id, service_type, title, description, priority, requested_date)
                 VALUES (:id, :user_id, :provider_id, :service_type, :title, :description, :priority, NOW())
@@ -779,7 +1310,10 @@ def create_service_request():
                 INSERT INTO audit_log (action_type, description, created_by, created_at)
                 VALUES ('SERVICE_REQUEST', 'Service request created: ' || :title, :uid, NOW())
             """), {"title": title, "uid": user_id})
+            
+            change = fetch_service_request_change(conn, request_id)
         
+        push_service_request_change(change)
         return jsonify({"ok": True, "request_id": request_id}), 201
     except Exception as e:
         print("!! /api/service-requests error:", repr(e), file=sys.stderr, flush=True)
@@ -788,7 +1322,11 @@ def create_service_request():
 @app.get("/api/users/<user_id>/service-requests")
 @jwt_required
 def get_user_service_requests(user_id):
-    with engine.begin() as conn:
+    with db.read() as conn:
+        # Read first: changes committed after this are replayed by /changes
+        cursor = conn.execute(text("""
+            SELECT COALESCE(MAX(change_seq), 0) FROM service_requests WHERE user_id = :user_id
+        """), {"user_id": user_id}).scalar()
         rows = conn.execute(text("""
             SELECT sr.id, sr.service_type, sr.title, sr.description, sr.status, sr.priority,
                    sr.requested_date, sr.accepted_date, sr.completed_date, sr.notes,
@@ -819,7 +1357,7 @@ def get_user_service_requests(user_id):
             }
         })
     
-    return {"ok": True, "requests": requests}
+    return {"ok": True, "requests": requests, "cursor": cursor}
 
 # ============ SERVICE PROVIDER ENDPOINTS ============
 
@@ -890,10 +1428,13 @@ def register_service_provider():
     
     user_id = str(uuid.uuid4())
     provider_id = str(uuid.uuid4())
-    pw_hash = hash_password(password)
+    try:
+        pw_hash = hash_password(password)
+    except PasswordHasherBusy:
+        return jsonify({"ok": False, "msg": "Server is busy, please try again"}), 503, {"Retry-After": "1"}
     
     try:
-        with engine.begin() as conn:
+        with db.write(pin=[('user', user_id), ('provider', provider_id)]) as conn:
             # Create user account
             conn.execute(text("""
                 INSERT INTO users_login (id, email, password_hash, user_type, created_date)
@@ -929,6 +1470,7 @@ def register_service_provider():
                 VALUES ('SERVICE_PROVIDER_SIGNUP', 'Service provider registered: ' || :name, :uid, NOW())
             """), {"name": name, "uid": user_id})
         
+        provider_directory.invalidate()
         return jsonify({
             "ok": True, 
             "provider": {
@@ -945,7 +1487,7 @@ def register_service_provider():
 
 @app.get("/api/users/<user_id>/provider-profile")
 def get_user_provider_profile(user_id):
-    with engine.begin() as conn:
+    with db.read() as conn:
         row = conn.execute(text("""
             SELECT sp.id as provider_id, sp.name, sp.email, sp.service_type, sp.description,
                    u.email as user_email, p.first_name, p.last_name
@@ -973,7 +1515,11 @@ def get_user_provider_profile(user_id):
 
 @app.get("/api/service-providers/<provider_id>/requests")
 def get_provider_service_requests(provider_id):
-    with engine.begin() as conn:
+    with db.read() as conn:
+        # Read first: changes committed after this are replayed by /changes
+        cursor = conn.execute(text("""
+            SELECT COALESCE(MAX(change_seq), 0) FROM service_requests WHERE provider_id = :provider_id
+        """), {"provider_id": provider_id}).scalar()
         rows = conn.execute(text("""
             SELECT sr.id, sr.service_type, sr.title, sr.description, sr.status, sr.priority,
                    sr.requested_date, sr.accepted_date, sr.completed_date, sr.notes,
@@ -1005,9 +1551,10 @@ def get_provider_service_requests(provider_id):
             }
         })
     
-    return {"ok": True, "requests": requests}
+    return {"ok": True, "requests": requests, "cursor": cursor}
 
 @app.post("/api/service-requests/<request_id>/accept")
+@db_timeouts(lock_ms=3000)
 def accept_service_request(request_id):
     b = request.get_json(force=True) or {}
     provider_id = b.get("provider_id")
@@ -1017,7 +1564,7 @@ def accept_service_request(request_id):
         return jsonify({"ok": False, "msg": "provider_id is required"}), 400
     
     try:
-        with engine.begin() as conn:
+        with db.write(pin=[('provider', provider_id), ('request', request_id)]) as conn:
             # Update request status
             result = conn.execute(text("""
                 UPDATE service_requests 
@@ -1041,13 +1588,17 @@ def accept_service_request(request_id):
                 INSERT INTO audit_log (action_type, description, created_by, created_at)
                 VALUES ('SERVICE_REQUEST_ACCEPTED', 'Service request accepted: ' || :req_id, :pid, NOW())
             """), {"req_id": request_id, "pid": provider_id})
+            
+            change = fetch_service_request_change(conn, request_id)
         
+        push_service_request_change(change)
         return jsonify({"ok": True, "conversation_id": conversation_id}), 200
     except Exception as e:
         print("!! /api/service-requests/accept error:", repr(e), file=sys.stderr, flush=True)
         return jsonify({"ok": False, "msg": "Could not accept request", "error": str(e)}), 400
 
 @app.put("/api/service-requests/<request_id>/complete")
+@db_timeouts(lock_ms=3000)
 def complete_service_request(request_id):
     b = request.get_json(force=True) or {}
     provider_id = b.get("provider_id")
@@ -1057,7 +1608,7 @@ def complete_service_request(request_id):
         return jsonify({"ok": False, "msg": "provider_id is required"}), 400
     
     try:
-        with engine.begin() as conn:
+        with db.write(pin=[('provider', provider_id), ('request', request_id)]) as conn:
             # Verify the request exists and belongs to this provider
             request_row = conn.execute(text("""
                 SELECT sr.id, sr.provider_id, sr.status, sr.user_id
@@ -1088,26 +1639,31 @@ def complete_service_request(request_id):
                 INSERT INTO audit_log (action_type, description, created_by, created_at)
                 VALUES ('SERVICE_COMPLETED', 'Service request completed: ' || :req_id, :pid, NOW())
             """), {"req_id": request_id, "pid": provider_id})
+            
+            change = fetch_service_request_change(conn, request_id)
         
+        push_service_request_change(change)
         return jsonify({"ok": True, "msg": "Service marked as completed successfully"}), 200
     except Exception as e:
         print("!! /api/service-requests/complete error:", repr(e), file=sys.stderr, flush=True)
         return jsonify({"ok": False, "msg": "Could not complete service", "error": str(e)}), 400
 
 @app.put("/api/service-requests/<request_id>/confirm")
+@db_timeouts(lock_ms=3000)
 def confirm_service_completion(request_id):
     b = request.get_json(force=True) or {}
     user_id = b.get("user_id")
     rating = b.get("rating")
+    comment = sanitize_input(b.get("comment") or "", max_length=2000)
     
     if not user_id or not rating:
         return jsonify({"ok": False, "msg": "user_id and rating are required"}), 400
     
-    if rating < 1 or rating > 5:
+    if type(rating) is not int or rating < 1 or rating > 5:
         return jsonify({"ok": False, "msg": "Rating must be between 1 and 5"}), 400
     
     try:
-        with engine.begin() as conn:
+        with db.write(pin=[('user', user_id), ('request', request_id)]) as conn:
             # Verify the request exists and belongs to this user
             request_row = conn.execute(text("""
                 SELECT sr.id, sr.user_id, sr.status, sr.provider_id
@@ -1121,34 +1677,44 @@ def confirm_service_completion(request_id):
             if request_row.status != 'COMPLETED':
                 return jsonify({"ok": False, "msg": "Only completed requests can be confirmed"}), 400
             
-            # Update the service request status to CONFIRMED and add rating
-            conn.execute(text("""
+            # Update the service request status to CONFIRMED and add rating;
+            # the status guard makes a concurrent second confirm a no-op
+            result = conn.execute(text("""
                 UPDATE service_requests 
                 SET status = 'CONFIRMED',
                     client_rating = :rating,
                     confirmed_date = NOW()
-                WHERE id = :req_id
+                WHERE id = :req_id AND status = 'COMPLETED'
             """), {"req_id": request_id, "rating": rating})
             
-            # Update provider's rating (calculate new average)
+            if result.rowcount == 0:
+                return jsonify({"ok": False, "msg": "Only completed requests can be confirmed"}), 400
+            
+            # Record the review; its trigger adds the rating to the provider's
+            # running sum and count (db/init/017)
             conn.execute(text("""
-                UPDATE service_providers 
-                SET total_reviews = total_reviews + 1,
-                    rating = (
-                        SELECT AVG(CAST(client_rating AS DECIMAL))
-                        FROM service_requests 
-                        WHERE provider_id = :provider_id 
-                        AND client_rating IS NOT NULL
-                    )
-                WHERE id = :provider_id
-            """), {"provider_id": request_row.provider_id})
+                INSERT INTO service_reviews (id, service_request_id, user_id, provider_id, rating, comment)
+                VALUES (:id, :req_id, :user_id, :provider_id, :rating, :comment)
+            """), {
+                "id": str(uuid.uuid4()),
+                "req_id": request_id,
+                "user_id": user_id,
+                "provider_id": request_row.provider_id,
+                "rating": rating,
+                "comment": comment or None
+            })
             
             # Log the confirmation
             conn.execute(text("""
                 INSERT INTO audit_log (action_type, description, created_by, created_at)
                 VALUES ('SERVICE_CONFIRMED', 'Service request confirmed with rating: ' || :rating || ' for request: ' || :req_id, :uid, NOW())
             """), {"req_id": request_id, "rating": rating, "uid": user_id})
+            
+            change = fetch_service_request_change(conn, request_id)
         
+        # The new review changed the provider's rating
+        provider_directory.invalidate()
+        push_service_request_change(change)
         return jsonify({"ok": True, "msg": "Service confirmed and rating recorded successfully"}), 200
     except Exception as e:
         print("!! /api/service-requests/confirm error:", repr(e), file=sys.stderr, flush=True)
@@ -1158,7 +1724,7 @@ def confirm_service_completion(request_id):
 
 @app.get("/api/service-requests/<request_id>/conversation")
 def get_request_conversation(request_id):
-    with engine.begin() as conn:
+    with db.read() as conn:
         row = conn.execute(text("""
             SELECT c.id as conversation_id, c.status, c.created_date, c.updated_date
             FROM conversations c
@@ -1178,15 +1744,97 @@ def get_request_conversation(request_id):
         }
     }
 
-@app.get("/api/conversations/<conversation_id>/messages")
-def get_conversation_messages(conversation_id):
-    with engine.begin() as conn:
+MESSAGE_PAGE_SIZE = int(os.getenv("MESSAGE_PAGE_SIZE", "50"))
+MESSAGE_PAGE_MAX = 200
+
+def encode_message_cursor(created_date, message_id):
+    """Opaque cursor for a message position: base64 of (created_date, id)"""
+    raw = f"{created_date.isoformat()}|{message_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_message_cursor(cursor):
+    """Inverse of encode_message_cursor; raises ValueError on malformed input"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_date, message_id = raw.split("|", 1)
+        return datetime.datetime.fromisoformat(created_date), message_id
+    except Exception:
+        raise ValueError("invalid cursor")
+
+def fetch_message_page(conn, conversation_id, before=None, after=None, limit=MESSAGE_PAGE_SIZE):
+    """
+    One page of a conversation in ascending order plus whether more rows
+    exist beyond it. Without a cursor the newest messages are returned.
+    Walks idx_messages_conversation_keyset, so the cost depends on the page
+    size only, not on how long the history is.
+    """
+    params = {"conversation_id": conversation_id, "limit": limit + 1}
+    if after:
+        params["ts"], params["id"] = after
         rows = conn.execute(text("""
             SELECT id, sender_id, sender_type, message_text, is_read, created_date
             FROM messages
             WHERE conversation_id = :conversation_id
-            ORDER BY created_date ASC
-        """), {"conversation_id": conversation_id}).fetchall()
+              AND (created_date, id) > (:ts, :id)
+            ORDER BY created_date ASC, id ASC
+            LIMIT :limit
+        """), params).fetchall()
+        return rows[:limit], len(rows) > limit
+    
+    keyset = ""
+    if before:
+        params["ts"], params["id"] = before
+        keyset = "AND (created_date, id) < (:ts, :id)"
+    rows = conn.execute(text(f"""
+        SELECT id, sender_id, sender_type, message_text, is_read, created_date
+        FROM messages
+        WHERE conversation_id = :conversation_id {keyset}
+        ORDER BY created_date DESC, id DESC
+        LIMIT :limit
+    """), params).fetchall()
+    return rows[:limit][::-1], len(rows) > limit
+
+def mark_read_up_to(conn, conversation_id, user_id, cursor=None):
+    """
+    Move user_id's read watermark up to the decoded cursor (the newest
+    message when None) in one statement. Returns the remaining unread
+    count, or None when user_id is not a participant.
+    """
+    members = get_conversation_members(conversation_id, conn)
+    if not members or user_id not in members:
+        return None
+    
+    read_at, message_id = cursor or (None, None)
+    return conn.execute(text("""
+        SELECT mark_conversation_read(:conversation_id, :user_id, :read_at, :message_id)
+    """), {
+        "conversation_id": conversation_id,
+        "user_id": user_id,
+        "read_at": read_at,
+        "message_id": message_id
+    }).scalar()
+
+@app.get("/api/conversations/<conversation_id>/messages")
+def get_conversation_messages(conversation_id):
+    """
+    Keyset-paginated history. ?before=<cursor> pages back, ?after=<cursor>
+    pages forward, neither returns the newest page. prev_cursor/next_cursor
+    point at the first/last message of the page.
+    """
+    before = request.args.get('before')
+    after = request.args.get('after')
+    if before and after:
+        return jsonify({"ok": False, "msg": "Use either before or after, not both"}), 400
+    
+    try:
+        limit = min(max(int(request.args.get('limit', MESSAGE_PAGE_SIZE)), 1), MESSAGE_PAGE_MAX)
+        before = decode_message_cursor(before) if before else None
+        after = decode_message_cursor(after) if after else None
+    except ValueError:
+        return jsonify({"ok": False, "msg": "limit must be an integer and cursors must come from a previous page"}), 400
+    
+    with db.read() as conn:
+        rows, has_more = fetch_message_page(conn, conversation_id, before=before, after=after, limit=limit)
     
     messages = []
     for row in rows:
@@ -1199,7 +1847,14 @@ def get_conversation_messages(conversation_id):
             "created_date": row.created_date.isoformat() if row.created_date else None
         })
     
-    return {"ok": True, "messages": messages}
+    return {
+        "ok": True,
+        "messages": messages,
+        "prev_cursor": encode_message_cursor(rows[0].created_date, rows[0].id) if rows else None,
+        "next_cursor": encode_message_cursor(rows[-1].created_date, rows[-1].id) if rows else None,
+        "has_older": has_more if not after else True,
+        "has_newer": has_more if after else bool(before)
+    }
 
 @app.post("/api/conversations/<conversation_id>/messages")
 def send_message(conversation_id):
@@ -1217,38 +1872,31 @@ def send_message(conversation_id):
     message_id = str(uuid.uuid4())
     
     try:
-        with engine.begin() as conn:
-            # Verify conversation exists and sender is authorized
-            conv = conn.execute(text("""
-                SELECT user_id, provider_id FROM conversations WHERE id = :conv_id
-            """), {"conv_id": conversation_id}).fetchone()
-            
-            if not conv:
-                return jsonify({"ok": False, "msg": "Conversation not found"}), 404
-            
-            # Check authorization
-            if sender_type == 'CLIENT' and conv.user_id != sender_id:
-                return jsonify({"ok": False, "msg": "Unauthorized"}), 403
-            elif sender_type == 'PROVIDER':
-                # For providers, we need to check if the sender_id matches the user_id 
-                # that corresponds to the provider_id in the conversation
-                provider_user = conn.execute(text("""
-                    SELECT user_id FROM service_providers WHERE id = :provider_id
-                """), {"provider_id": conv.provider_id}).fetchone()
-                
-                if not provider_user or provider_user.user_id != sender_id:
-                    return jsonify({"ok": False, "msg": "Unauthorized"}), 403
-            
+        # Verify conversation exists and sender is authorized
+        members = get_conversation_members(conversation_id)
+        
+        if not members:
+            return jsonify({"ok": False, "msg": "Conversation not found"}), 404
+        
+        client_user_id, provider_user_id = members
+        if sender_type == 'CLIENT' and client_user_id != sender_id:
+            return jsonify({"ok": False, "msg": "Unauthorized"}), 403
+        elif sender_type == 'PROVIDER' and provider_user_id != sender_id:
+            return jsonify({"ok": False, "msg": "Unauthorized"}), 403
+        
+        created_date = next_message_timestamp()
+        with db.write(pin=[('conversation', conversation_id), ('user', sender_id)]) as conn:
             # Insert message
             conn.execute(text("""
                 INSERT INTO messages (id, conversation_id, sender_id, sender_type, message_text, created_date)
-                VALUES (:id, :conversation_id, :sender_id, :sender_type, :message_text, NOW())
+                VALUES (:id, :conversation_id, :sender_id, :sender_type, :message_text, :created_date)
             """), {
                 "id": message_id,
                 "conversation_id": conversation_id,
                 "sender_id": sender_id,
                 "sender_type": sender_type,
-                "message_text": message_text
+                "message_text": message_text,
+                "created_date": created_date
             })
             
             conn.execute(text("""
@@ -1256,6 +1904,13 @@ def send_message(conversation_id):
                 VALUES ('MESSAGE_SENT', 'Message sent in conversation: ' || :conv_id, :sender_id, NOW())
             """), {"conv_id": conversation_id, "sender_id": sender_id})
         
+        push_conversation_update(members, {
+            'conversation_id': conversation_id,
+            'last_message_text': message_text[:200],
+            'last_message_at': created_date.isoformat(),
+            'last_sender_type': sender_type,
+            'sender_id': sender_id
+        })
         return jsonify({"ok": True, "message_id": message_id}), 201
     except Exception as e:
         print("!! /api/conversations/messages error:", repr(e), file=sys.stderr, flush=True)
@@ -1263,14 +1918,17 @@ def send_message(conversation_id):
 
 @app.get("/api/users/<user_id>/conversations")
 def get_user_conversations(user_id):
-    with engine.begin() as conn:
+    with db.read() as conn:
         rows = conn.execute(text("""
             SELECT c.id, c.service_request_id, c.status, c.created_date, c.updated_date,
+                   c.last_message_text, c.last_message_at, c.last_sender_type,
+                   COALESCE(cr.unread_count, 0) as unread_count,
                    sr.title as request_title, sr.status as request_status,
                    sp.name as provider_name, sp.service_type
             FROM conversations c
             JOIN service_requests sr ON sr.id = c.service_request_id
             JOIN service_providers sp ON sp.id = c.provider_id
+            LEFT JOIN conversation_reads cr ON cr.conversation_id = c.id AND cr.user_id = c.user_id
             WHERE c.user_id = :user_id
             ORDER BY c.updated_date DESC
         """), {"user_id": user_id}).fetchall()
@@ -1286,22 +1944,68 @@ def get_user_conversations(user_id):
             "request_title": row.request_title,
             "request_status": row.request_status,
             "provider_name": row.provider_name,
-            "service_type": row.service_type
+            "service_type": row.service_type,
+            "unread_count": row.unread_count,
+            "last_message_text": row.last_message_text,
+            "last_message_at": row.last_message_at.isoformat() if row.last_message_at else None,
+            "last_sender_type": row.last_sender_type
         })
     
     return {"ok": True, "conversations": conversations}
 
+@app.put("/api/conversations/<conversation_id>/read")
+def mark_conversation_read(conversation_id):
+    """Mark every message up to body.cursor (default: the newest) as read for body.user_id"""
+    b = request.get_json(force=True) or {}
+    user_id = b.get("user_id")
+    
+    if not user_id:
+        return jsonify({"ok": False, "msg": "user_id is required"}), 400
+    
+    try:
+        cursor = decode_message_cursor(b["cursor"]) if b.get("cursor") else None
+    except ValueError:
+        return jsonify({"ok": False, "msg": "cursor must come from a message page"}), 400
+    
+    try:
+        with db.write(pin=[('conversation', conversation_id), ('user', user_id)]) as conn:
+            unread_count = mark_read_up_to(conn, conversation_id, user_id, cursor)
+        
+        if unread_count is None:
+            return jsonify({"ok": False, "msg": "Conversation not found or unauthorized"}), 404
+        
+        socketio.emit('messages_read', {
+            'conversation_id': conversation_id,
+            'user_id': user_id,
+            'cursor': b.get("cursor"),
+            'unread_count': unread_count
+        }, room=f"conversation_{conversation_id}")
+        push_conversation_update([user_id], {'conversation_id': conversation_id, 'unread_count': unread_count})
+        return jsonify({"ok": True, "unread_count": unread_count}), 200
+    except Exception as e:
+        print("!! /api/conversations/read error:", repr(e), file=sys.stderr, flush=True)
+        return jsonify({"ok": False, "msg": "Could not mark conversation as read", "error": str(e)}), 400
+
 @app.put("/api/conversations/<conversation_id>/messages/<message_id>/read")
 def mark_message_read(conversation_id, message_id):
     try:
-        with engine.begin() as conn:
+        with db.write(pin=[('conversation', conversation_id)]) as conn:
+            # The reader is whichever participant did not send the message;
+            # their watermark moves up to it (and so covers earlier messages too)
             result = conn.execute(text("""
-                UPDATE messages 
-                SET is_read = true 
-                WHERE id = :message_id AND conversation_id = :conversation_id
-            """), {"message_id": message_id, "conversation_id": conversation_id})
+                SELECT mark_conversation_read(
+                    m.conversation_id,
+                    CASE WHEN m.sender_id = c.user_id THEN sp.user_id ELSE c.user_id END,
+                    m.created_date,
+                    m.id
+                )
+                FROM messages m
+                JOIN conversations c ON c.id = m.conversation_id
+                LEFT JOIN service_providers sp ON sp.id = c.provider_id
+                WHERE m.id = :message_id AND m.conversation_id = :conversation_id
+            """), {"message_id": message_id, "conversation_id": conversation_id}).fetchone()
             
-            if result.rowcount == 0:
+            if not result:
                 return jsonify({"ok": False, "msg": "Message not found"}), 404
             
             return jsonify({"ok": True}), 200
@@ -1311,9 +2015,11 @@ def mark_message_read(conversation_id, message_id):
 
 @app.get("/api/service-providers/<provider_id>/conversations")
 def get_provider_conversations(provider_id):
-    with engine.begin() as conn:
+    with db.read() as conn:
         rows = conn.execute(text("""
             SELECT c.id, c.service_request_id, c.status, c.created_date, c.updated_date,
+                   c.last_message_text, c.last_message_at, c.last_sender_type,
+                   COALESCE(cr.unread_count, 0) as unread_count,
                    sr.title as request_title, sr.status as request_status,
                    u.email as client_email, p.first_name as client_first_name, 
                    p.last_name as client_last_name
@@ -1321,6 +2027,8 @@ def get_provider_conversations(provider_id):
             JOIN service_requests sr ON sr.id = c.service_request_id
             JOIN users_login u ON u.id = c.user_id
             LEFT JOIN immigrant_profile p ON p.user_id = u.id
+            JOIN service_providers sp ON sp.id = c.provider_id
+            LEFT JOIN conversation_reads cr ON cr.conversation_id = c.id AND cr.user_id = sp.user_id
             WHERE c.provider_id = :provider_id
             ORDER BY c.updated_date DESC
         """), {"provider_id": provider_id}).fetchall()
@@ -1338,7 +2046,11 @@ def get_provider_conversations(provider_id):
             "client": {
                 "email": row.client_email,
                 "name": " ".join([x for x in [row.client_first_name, row.client_last_name] if x]) or "Unknown"
-            }
+            },
+            "unread_count": row.unread_count,
+            "last_message_text": row.last_message_text,
+            "last_message_at": row.last_message_at.isoformat() if row.last_message_at else None,
+            "last_sender_type": row.last_sender_type
         })
     
     return {"ok": True, "conversations": conversations}
@@ -0,0 +1,47 @@
+"""
+Benchmark: per-request authentication overhead of jwt_required with and
+without the verified-token cache
+
+Usage (from backend/):
+    python benchmarks/bench_jwt_cache.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, g
+import security_utils
+from security_utils import jwt_required, generate_jwt_token, JWTVerificationCache
+
+app = Flask(__name__)
+
+@jwt_required
+def protected():
+    return g.current_user['user_id']
+
+def bench(requests=20000):
+    token = generate_jwt_token('00000000-0000-0000-0000-000000000001', 'Immigrant', 'bench@example.com')
+    headers = {'Authorization': f'Bearer {token}'}
+    
+    with app.test_request_context('/api/bench', headers=headers):
+        protected()  # warm up
+        start = time.perf_counter()
+        for _ in range(requests):
+            protected()
+        elapsed = time.perf_counter() - start
+    return elapsed / requests * 1e6
+
+if __name__ == "__main__":
+    security_utils.jwt_cache = JWTVerificationCache(max_size=0)
+    uncached = bench()
+    
+    security_utils.jwt_cache = JWTVerificationCache()
+    cached = bench()
+    stats = security_utils.jwt_cache.get_stats()
+    
+    print(f"{'mode':>10} {'us/request':>12}")
+    print(f"{'no cache':>10} {uncached:>12.2f}")
+    print(f"{'cache':>10} {cached:>12.2f}")
+    print(f"speedup: {uncached / cached:.1f}x  (hits={stats['hits']}, misses={stats['misses']})")
@@ -0,0 +1,144 @@
+"""
+Benchmark: logins/sec of the login database pipeline, before and after
+login_attempt() (db/init/020)
+
+before: the previous sequence, a transaction holding the user SELECT, the
+        counter UPDATE and the audit INSERT, then a second transaction for
+        the active_sessions INSERT (the old create_session)
+after:  an autocommit user SELECT, then one login_attempt() call
+
+Both run from BENCH_THREADS threads (default 8) against BENCH_USERS seeded
+users (default 1,000), so commit and round-trip costs show up under
+contention. Password hashing is left out of these two because it is the
+same in both; the last line times whole POST /api/login requests with the
+configured PASSWORD_HASH_SCHEME for scale. Needs DATABASE_URL pointing at a
+database with the db/init schema applied; seeded rows are deleted afterwards.
+
+Usage (from backend/):
+    python benchmarks/bench_login_pipeline.py
+    BENCH_THREADS=32 python benchmarks/bench_login_pipeline.py
+"""
+import os
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+load_dotenv()
+
+if not os.getenv("DATABASE_URL"):
+    print("DATABASE_URL is not set; this benchmark needs a running database")
+    sys.exit(0)
+
+from sqlalchemy import text
+from app import app, engine, db
+from security_utils import hash_password
+
+USERS = int(os.getenv("BENCH_USERS", "1000"))
+THREADS = int(os.getenv("BENCH_THREADS", "8"))
+SECONDS = float(os.getenv("BENCH_SECONDS", "5"))
+PREFIX = "bench-login-"
+PASSWORD = "Correct-Horse-42!"
+
+LOOKUP = text("""
+    SELECT u.id, u.email, u.password_hash, u.is_active, u.is_locked, u.user_type, u.email_verified,
+           p.first_name, p.last_name, u.created_date AS created_at
+    FROM users_login u
+    LEFT JOIN immigrant_profile p ON p.user_id = u.id
+    WHERE u.email = :email
+""")
+
+def session_params(row):
+    created_at = datetime.now()
+    return {"id": str(uuid.uuid4()), "user_id": row.id, "user_type": row.user_type, "email": row.email,
+            "ip_address": "127.0.0.1", "user_agent": "bench", "created_at": created_at,
+            "expires_at": created_at + timedelta(hours=24)}
+
+def login_before(email):
+    with engine.begin() as conn:
+        row = conn.execute(LOOKUP, {"email": email}).fetchone()
+        conn.execute(text("""
+            UPDATE users_login
+            SET login_attempts = 0, last_login = NOW(), login_status = 'SUCCESS',
+                password_hash = COALESCE(:new_hash, password_hash)
+            WHERE id = :id
+        """), {"id": row.id, "new_hash": None})
+        conn.execute(text("""
+            INSERT INTO audit_log (action_type, description, created_by, created_at)
+            VALUES ('LOGIN_SUCCESS', 'User logged in successfully', :uid, NOW())
+        """), {"uid": row.id})
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO active_sessions (id, user_id, user_type, email, ip_address, user_agent, created_at, last_activity, expires_at)
+            VALUES (:id, :user_id, :user_type, :email, :ip_address, :user_agent, :created_at, :created_at, :expires_at)
+        """), session_params(row))
+
+def login_after(email):
+    with db.read(primary=True) as conn:
+        row = conn.execute(LOOKUP, {"email": email}).fetchone()
+    session = session_params(row)
+    with db.write(autocommit=True) as conn:
+        conn.execute(text("""
+            SELECT login_attempt(:user_id, :email, TRUE, :id, :user_type, NULL,
+                                 :ip_address, :user_agent, :created_at, :expires_at)
+        """), session)
+
+def logins_per_second(login, threads=THREADS, seconds=SECONDS):
+    counts = [0] * threads
+    deadline = time.perf_counter() + seconds
+
+    def worker(index):
+        i = index
+        while time.perf_counter() < deadline:
+            login(f"{PREFIX}{i % USERS}@example.com")
+            counts[index] += 1
+            i += threads
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for worker_thread in workers:
+        worker_thread.start()
+    for worker_thread in workers:
+        worker_thread.join()
+    return sum(counts) / (time.perf_counter() - start)
+
+def endpoint_logins_per_second(requests=200):
+    client = app.test_client()
+    start = time.perf_counter()
+    for i in range(requests):
+        response = client.post("/api/login", json={"email": f"{PREFIX}{i % USERS}@example.com",
+                                                   "password": PASSWORD})
+        assert response.status_code == 200, response.get_json()
+    return requests / (time.perf_counter() - start)
+
+if __name__ == "__main__":
+    print(f"seeding {USERS} users...", flush=True)
+    password_hash = hash_password(PASSWORD)
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("""
+                INSERT INTO users_login (id, email, password_hash, user_type, email_verified)
+                SELECT :prefix || i, :prefix || i || '@example.com', :hash, 'Immigrant', TRUE
+                FROM generate_series(0, :users - 1) AS i
+            """), {"prefix": PREFIX, "hash": password_hash, "users": USERS})
+
+        login_before(f"{PREFIX}0@example.com")  # warm up the pool
+        login_after(f"{PREFIX}0@example.com")
+
+        before = logins_per_second(login_before)
+        after = logins_per_second(login_after)
+        endpoint = endpoint_logins_per_second()
+
+        print(f"{'pipeline':>28} {'logins/sec':>11}")
+        print(f"{'before (2 transactions)':>28} {before:>11.0f}")
+        print(f"{'after (login_attempt)':>28} {after:>11.0f}")
+        print(f"speedup: {after / before:.2f}x with {THREADS} threads")
+        print(f"POST /api/login, 1 client, with password hashing: {endpoint:.1f} logins/sec")
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text("DELETE FROM audit_log WHERE created_by LIKE :pattern"), {"pattern": PREFIX + "%"})
+            conn.execute(text("DELETE FROM users_login WHERE id LIKE :pattern"), {"pattern": PREFIX + "%"})
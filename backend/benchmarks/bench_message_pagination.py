@@ -0,0 +1,116 @@
+"""
+Benchmark: GET /api/conversations/<id>/messages latency as a conversation's
+history grows
+
+Seeds one throwaway conversation, grows it to each history size and times
+the newest page, a page deep in the history (via a before cursor), and the
+old unpaginated full-history query for comparison. Needs DATABASE_URL
+pointing at a database with the db/init schema applied; the seeded users
+(and everything cascading from them) are deleted afterwards.
+
+Usage (from backend/):
+    python benchmarks/bench_message_pagination.py
+"""
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+load_dotenv()
+
+if not os.getenv("DATABASE_URL"):
+    print("DATABASE_URL is not set; this benchmark needs a running database")
+    sys.exit(0)
+
+from sqlalchemy import text
+from app import app, engine, encode_message_cursor
+
+def seed_conversation(conn):
+    client_id, provider_user_id = str(uuid.uuid4()), str(uuid.uuid4())
+    provider_id, request_id, conversation_id = str(uuid.uuid4()), str(uuid.uuid4()), str(uuid.uuid4())
+
+    for uid in (client_id, provider_user_id):
+        conn.execute(text("""
+            INSERT INTO users_login (id, email, password_hash)
+            VALUES (:id, :email, 'x')
+        """), {"id": uid, "email": f"bench-{uid}@example.com"})
+    conn.execute(text("""
+        INSERT INTO service_providers (id, user_id, name, email, service_type)
+        VALUES (:id, :uid, 'Benchmark Provider', :email, 'Other')
+    """), {"id": provider_id, "uid": provider_user_id, "email": f"bench-{provider_id}@example.com"})
+    conn.execute(text("""
+        INSERT INTO service_requests (id, user_id, provider_id, service_type, title)
+        VALUES (:id, :uid, :pid, 'Other', 'Benchmark')
+    """), {"id": request_id, "uid": client_id, "pid": provider_id})
+    conn.execute(text("""
+        INSERT INTO conversations (id, service_request_id, user_id, provider_id)
+        VALUES (:id, :rid, :uid, :pid)
+    """), {"id": conversation_id, "rid": request_id, "uid": client_id, "pid": provider_id})
+    return conversation_id, [client_id, provider_user_id]
+
+def grow_history(conn, conversation_id, sender_id, start, stop):
+    # Message i is i seconds newer than message 0, so the history is ordered
+    conn.execute(text("""
+        INSERT INTO messages (id, conversation_id, sender_id, sender_type, message_text, created_date)
+        SELECT gen_random_uuid()::text, :cid, :sid, 'CLIENT',
+               'benchmark message ' || i, TIMESTAMP '2020-01-01' + i * INTERVAL '1 second'
+        FROM generate_series(:start, :stop - 1) AS i
+    """), {"cid": conversation_id, "sid": sender_id, "start": start, "stop": stop})
+    conn.execute(text("ANALYZE messages"))
+
+def time_get(client, url, runs):
+    client.get(url)  # warm up
+    start = time.perf_counter()
+    for _ in range(runs):
+        response = client.get(url)
+    elapsed = time.perf_counter() - start
+    assert response.status_code == 200, response.get_json()
+    return elapsed / runs * 1000
+
+def time_full_history(conversation_id, runs):
+    start = time.perf_counter()
+    for _ in range(runs):
+        with engine.begin() as conn:
+            rows = conn.execute(text("""
+                SELECT id, sender_id, sender_type, message_text, is_read, created_date
+                FROM messages
+                WHERE conversation_id = :conversation_id
+                ORDER BY created_date ASC
+            """), {"conversation_id": conversation_id}).fetchall()
+        [{"id": r.id, "message_text": r.message_text, "created_date": r.created_date.isoformat()} for r in rows]
+    return (time.perf_counter() - start) / runs * 1000
+
+if __name__ == "__main__":
+    client = app.test_client()
+    with engine.begin() as conn:
+        conversation_id, user_ids = seed_conversation(conn)
+
+    try:
+        url = f"/api/conversations/{conversation_id}/messages"
+        print(f"{'messages':>10} {'newest ms':>10} {'deep ms':>10} {'full ms':>10}")
+        size = 0
+        for target in (1000, 10000, 100000):
+            with engine.begin() as conn:
+                grow_history(conn, conversation_id, user_ids[0], size, target)
+            size = target
+
+            newest = time_get(client, url, runs=200)
+
+            # A page from the middle of the history, as reached by scrolling back
+            with engine.begin() as conn:
+                middle = conn.execute(text("""
+                    SELECT id, created_date FROM messages
+                    WHERE conversation_id = :cid
+                    ORDER BY created_date, id OFFSET :offset LIMIT 1
+                """), {"cid": conversation_id, "offset": size // 2}).fetchone()
+            cursor = encode_message_cursor(middle.created_date, middle.id)
+            deep = time_get(client, f"{url}?before={cursor}", runs=200)
+
+            full = time_full_history(conversation_id, runs=5)
+            print(f"{size:>10} {newest:>10.2f} {deep:>10.2f} {full:>10.2f}")
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text("DELETE FROM users_login WHERE id = ANY(:ids)"), {"ids": user_ids})
@@ -0,0 +1,77 @@
+"""
+Benchmark: password hashing throughput per scheme, and verify latency
+percentiles when many logins arrive at once
+
+Usage (from backend/):
+    python benchmarks/bench_password_hashing.py [concurrency]
+"""
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from security_utils import PASSWORD_HASHERS, PasswordHashingEngine, PasswordHasherBusy
+
+PASSWORD = "Correct-Horse-42!"
+
+def hashes_per_second(hasher, seconds=2.0):
+    count = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        hasher.hash(PASSWORD)
+        count += 1
+    return count / (time.perf_counter() - start)
+
+def login_latencies(engine, stored, concurrency, per_thread=5):
+    latencies = []
+    busy = []
+    lock = threading.Lock()
+    
+    def client():
+        for _ in range(per_thread):
+            start = time.perf_counter()
+            try:
+                engine.verify(PASSWORD, stored)
+            except PasswordHasherBusy:
+                with lock:
+                    busy.append(1)
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - start)
+    
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    
+    latencies.sort()
+    return latencies, len(busy)
+
+def pct(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000 if values else float('nan')
+
+if __name__ == "__main__":
+    concurrency = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    
+    print(f"{'scheme':>15} {'hashes/sec':>12}")
+    for name, hasher in PASSWORD_HASHERS.items():
+        try:
+            print(f"{name:>15} {hashes_per_second(hasher):>12.1f}")
+        except Exception as e:
+            print(f"{name:>15} {'unavailable':>12} ({e.__class__.__name__})")
+    
+    print()
+    print(f"Login verify latency with {concurrency} concurrent clients")
+    print(f"{'scheme':>15} {'p50 ms':>10} {'p99 ms':>10} {'busy':>6}")
+    for name in ('pbkdf2-sha256', 'bcrypt', 'argon2'):
+        try:
+            stored = PASSWORD_HASHERS[name].hash(PASSWORD)
+            engine = PasswordHashingEngine(scheme=name, max_pending=concurrency * 2)
+        except Exception as e:
+            print(f"{name:>15} {'unavailable':>10} ({e.__class__.__name__})")
+            continue
+        latencies, busy = login_latencies(engine, stored, concurrency)
+        print(f"{name:>15} {pct(latencies, 0.5):>10.1f} {pct(latencies, 0.99):>10.1f} {busy:>6}")
@@ -0,0 +1,117 @@
+"""
+Benchmark: GET /api/service-providers/search latency over a large directory
+
+Seeds BENCH_PROVIDERS synthetic providers (default 1,000,000, each with its
+login row), then times selective, medium and broad searches: the first page
+(which also computes the service_type facets), a later page via its cursor,
+and a filtered search. Needs DATABASE_URL pointing at a database with the
+db/init schema applied; the seeded rows are deleted afterwards.
+
+Seeded descriptions contain two of 30 topic words and a reference keyword
+shared by 1 in 20,000 providers, so queries of known selectivity exist per
+million providers: "kw<n>" matches ~50, two topics ~2,200 and one topic
+~65,000 (broad queries rank every match, so expect them to be slowest).
+
+Usage (from backend/):
+    python benchmarks/bench_provider_search.py
+    BENCH_PROVIDERS=200000 python benchmarks/bench_provider_search.py
+"""
+import os
+import sys
+import time
+import statistics
+from urllib.parse import urlencode
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+load_dotenv()
+
+if not os.getenv("DATABASE_URL"):
+    print("DATABASE_URL is not set; this benchmark needs a running database")
+    sys.exit(0)
+
+from sqlalchemy import text
+from app import app, engine
+
+PROVIDERS = int(os.getenv("BENCH_PROVIDERS", "1000000"))
+CHUNK = 100000
+PREFIX = "bench-search-"
+
+TOPICS = ["immigration", "housing", "resume", "tax", "dental", "language", "driving", "banking",
+          "insurance", "childcare", "citizenship", "licensing", "translation", "mortgage", "pharmacy",
+          "counselling", "nutrition", "tutoring", "accounting", "pension", "refugee", "settlement",
+          "volunteer", "internship", "apprenticeship", "notary", "physiotherapy", "optometry",
+          "rental", "mentoring"]
+NAMES = ["Maple", "Northern", "Harbour", "Prairie", "Summit", "Lakeside", "Evergreen", "Aurora",
+         "Cedar", "Riverside", "Pioneer", "Beacon", "Granite", "Meadow", "Coastal", "Frontier"]
+KINDS = ["Services", "Partners", "Clinic", "Group", "Centre", "Associates", "Network", "Collective"]
+CITIES = ["Toronto", "Vancouver", "Montreal", "Calgary", "Ottawa", "Edmonton", "Winnipeg", "Halifax"]
+
+def sql_array(words):
+    return "ARRAY[" + ",".join(f"'{w}'" for w in words) + "]"
+
+def seed(conn, start, stop):
+    conn.execute(text("""
+        INSERT INTO users_login (id, email, password_hash)
+        SELECT :prefix || i, :prefix || i || '@example.com', 'x'
+        FROM generate_series(:start, :stop - 1) AS i
+    """), {"prefix": PREFIX, "start": start, "stop": stop})
+    conn.execute(text(f"""
+        INSERT INTO service_providers (id, user_id, name, email, address, service_type,
+                                       description, rating, total_reviews)
+        SELECT :prefix || i, :prefix || i,
+               ({sql_array(NAMES)})[1 + i % {len(NAMES)}] || ' ' ||
+                   ({sql_array(KINDS)})[1 + (i / {len(NAMES)}) % {len(KINDS)}],
+               :prefix || i || '@example.com',
+               (1 + i % 9999) || ' Main Street, ' || ({sql_array(CITIES)})[1 + i % {len(CITIES)}],
+               (ARRAY['Legal','Medical','Education','Employment','Housing','Other'])[1 + i % 6],
+               'Helping newcomers with ' || ({sql_array(TOPICS)})[1 + i % {len(TOPICS)}] ||
+                   ' and ' || ({sql_array(TOPICS)})[1 + (i / {len(TOPICS)}) % {len(TOPICS)}] ||
+                   ' support. Reference kw' || (i % 20000),
+               (i % 51) / 10.0,
+               i % 200
+        FROM generate_series(:start, :stop - 1) AS i
+    """), {"prefix": PREFIX, "start": start, "stop": stop})
+
+def time_search(client, params, runs):
+    url = "/api/service-providers/search?" + urlencode(params)
+    client.get(url)  # warm up
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        response = client.get(url)
+        times.append((time.perf_counter() - start) * 1000)
+    body = response.get_json()
+    assert response.status_code == 200, body
+    return statistics.median(times), body
+
+if __name__ == "__main__":
+    client = app.test_client()
+    print(f"seeding {PROVIDERS} providers...", flush=True)
+    try:
+        for start in range(0, PROVIDERS, CHUNK):
+            with engine.begin() as conn:
+                seed(conn, start, min(start + CHUNK, PROVIDERS))
+        with engine.begin() as conn:
+            conn.execute(text("ANALYZE service_providers"))
+
+        cases = [
+            ("selective", {"q": "kw4242"}),
+            ("two topics", {"q": "tax dental"}),
+            ("one topic", {"q": "housing"}),
+            ("filtered", {"q": "tax dental", "service_type": "Medical", "min_rating": "4"}),
+        ]
+        print(f"{'query':>12} {'matches':>9} {'page 1 ms':>10} {'page 2 ms':>10}")
+        for label, params in cases:
+            first_ms, body = time_search(client, params, runs=50)
+            facets = body["facets"]
+            matches = facets.get(params["service_type"], 0) if "service_type" in params else sum(facets.values())
+            next_ms = None
+            if body["next_cursor"]:
+                next_ms, _ = time_search(client, dict(params, cursor=body["next_cursor"]), runs=50)
+            next_col = f"{next_ms:>10.2f}" if next_ms is not None else f"{'-':>10}"
+            print(f"{label:>12} {matches:>9} {first_ms:>10.2f} {next_col}")
+    finally:
+        with engine.begin() as conn:
+            conn.execute(text("DELETE FROM users_login WHERE id LIKE :pattern"), {"pattern": PREFIX + "%"})
@@ -0,0 +1,69 @@
+"""
+Benchmark: per-check cost of the rate limiter backends
+
+Measures the in-process backend as the number of distinct keys grows, then
+compares it with the cross-process backends (shared memory, and the
+rate_limits table when DATABASE_URL points at a running database).
+
+Usage (from backend/):
+    python benchmarks/bench_rate_limiter.py
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+from security_utils import InMemoryRateLimiter, SharedMemoryRateLimiter, DatabaseRateLimiter
+
+def make_keys(num_keys):
+    return [f"10.{i // 65536}.{(i // 256) % 256}.{i % 256}" for i in range(num_keys)]
+
+def bench(limiter, num_keys, checks=200000):
+    keys = make_keys(num_keys)
+    
+    # Warm up so every key already has state
+    for key in keys:
+        limiter.hit('benchmark', key, 10, 300)
+    
+    start = time.perf_counter()
+    for i in range(checks):
+        limiter.hit('benchmark', keys[i % num_keys], 10, 300)
+    elapsed = time.perf_counter() - start
+    return elapsed / checks * 1e6
+
+if __name__ == "__main__":
+    load_dotenv()
+    
+    print("In-process backend")
+    print(f"{'keys':>10} {'us/check':>10} {'tracked':>10}")
+    for num_keys in (100, 1000, 10000, 100000):
+        limiter = InMemoryRateLimiter(max_keys=200000)
+        per_check = bench(limiter, num_keys)
+        print(f"{num_keys:>10} {per_check:>10.2f} {len(limiter):>10}")
+    
+    print()
+    print("Backends at 10000 keys")
+    print(f"{'backend':>10} {'us/check':>10}")
+    print(f"{'memory':>10} {bench(InMemoryRateLimiter(), 10000):>10.2f}")
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        limiter = SharedMemoryRateLimiter(path=os.path.join(tmp, 'rate_limits'), slots=65536)
+        print(f"{'shm':>10} {bench(limiter, 10000):>10.2f}")
+        limiter.close()
+    
+    database_url = os.getenv("DATABASE_URL")
+    if database_url:
+        try:
+            from sqlalchemy import create_engine, text
+            engine = create_engine(database_url, future=True)
+            with engine.begin() as conn:
+                conn.execute(text("SELECT 1"))
+            limiter = DatabaseRateLimiter(engine)
+            print(f"{'database':>10} {bench(limiter, 1000, checks=5000):>10.2f}")
+            with engine.begin() as conn:
+                conn.execute(text("DELETE FROM rate_limits WHERE endpoint = 'benchmark'"))
+        except Exception as e:
+            print(f"{'database':>10} skipped ({e.__class__.__name__})")
@@ -0,0 +1,72 @@
+"""
+Benchmark: overhead of request metrics, per request (start_request and
+finish_request, including the X-Server-Timing header) and per SQL statement
+(cursor event hooks, timed against an in-memory SQLite engine). A whole
+test-client request is timed for scale. Runs alternate and the best of
+five is kept, so other load on the machine skews the result less.
+
+Usage (from backend/):
+    python benchmarks/bench_request_metrics.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, Response
+from sqlalchemy import create_engine, text
+from metrics_utils import RequestMetrics
+
+app = Flask(__name__)
+
+@app.get("/api/users/<user_id>")
+def user(user_id):
+    return ""
+
+def bench_requests(requests=50000):
+    metrics = RequestMetrics()
+    response = Response()
+    with app.test_request_context('/api/users/42'):
+        app.preprocess_request()  # match the URL rule the way a real request does
+        start = time.perf_counter()
+        for _ in range(requests):
+            metrics.start_request()
+            metrics.finish_request(response)
+        elapsed = time.perf_counter() - start
+    return elapsed / requests * 1e6
+
+def bench_test_client(requests=5000):
+    client = app.test_client()
+    client.get('/api/users/42')  # warm up
+    start = time.perf_counter()
+    for _ in range(requests):
+        client.get('/api/users/42')
+    return (time.perf_counter() - start) / requests * 1e6
+
+def bench_statements(instrumented, statements=20000):
+    engine = create_engine("sqlite://")
+    if instrumented:
+        RequestMetrics().instrument(engine)
+    with engine.connect() as conn:
+        query = text("SELECT 1")
+        conn.execute(query)  # warm up
+        start = time.perf_counter()
+        for _ in range(statements):
+            conn.execute(query)
+        elapsed = time.perf_counter() - start
+    return elapsed / statements * 1e6
+
+if __name__ == "__main__":
+    runs = [(bench_statements(False), bench_statements(True)) for _ in range(5)]
+    plain = min(run[0] for run in runs)
+    hooked = min(run[1] for run in runs)
+    per_request = min(bench_requests() for _ in range(5))
+    full_request = min(bench_test_client() for _ in range(5))
+
+    print(f"{'measurement':>24} {'us':>8}")
+    print(f"{'test-client request':>24} {full_request:>8.2f}")
+    print(f"{'request bookkeeping':>24} {per_request:>8.2f}")
+    print(f"{'SELECT 1, no hooks':>24} {plain:>8.2f}")
+    print(f"{'SELECT 1, hooked':>24} {hooked:>8.2f}")
+    print(f"per-statement overhead: {hooked - plain:.2f} us")
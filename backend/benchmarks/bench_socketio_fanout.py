@@ -0,0 +1,185 @@
+"""
+Load test: room broadcast throughput across Socket.IO worker processes
+
+Starts N worker processes (a minimal Flask-SocketIO app using the same
+fan-out backends as app.py), connects websocket clients spread evenly over
+them into one room, then publishes messages to the room from an external
+write-only manager and measures deliveries per second until every client has
+every message. Uses SOCKETIO_MESSAGE_QUEUE if set, otherwise a
+UnixSocketBroker started here. Throughput should grow with the worker count
+until the host runs out of cores.
+
+Usage (from backend/):
+    python benchmarks/bench_socketio_fanout.py
+"""
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import simple_websocket
+from messaging_utils import UnixSocketBroker, create_fanout_manager
+
+BASE_PORT = 5601
+ROOM = 'bench'
+
+def serve(port, queue_url):
+    import logging
+    from flask import Flask
+    from flask_socketio import SocketIO, join_room
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    app = Flask(__name__)
+    # Generous ping window: on a loaded host clients may answer pings late
+    socketio = SocketIO(app, async_mode='threading', client_manager=create_fanout_manager(queue_url),
+                        ping_interval=60, ping_timeout=120)
+
+    @socketio.on('connect')
+    def handle_connect(auth=None):
+        join_room(ROOM)
+
+    socketio.run(app, port=port, allow_unsafe_werkzeug=True, log_output=False)
+
+def wait_for_port(port, timeout=10):
+    import socket
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"worker on port {port} did not start")
+
+def connect_client(port, attempts=5):
+    """
+    Raw Engine.IO v4 websocket handshake plus a Socket.IO namespace connect.
+    A handshake that stalls under load is abandoned and retried.
+    """
+    for _ in range(attempts):
+        ws = simple_websocket.Client(f"ws://127.0.0.1:{port}/socket.io/?EIO=4&transport=websocket")
+        try:
+            assert (ws.receive(timeout=5) or '').startswith('0')  # engine.io open
+            ws.send('40')
+            while True:
+                frame = ws.receive(timeout=5)
+                if frame is None:
+                    raise TimeoutError
+                if frame.startswith('40'):
+                    return ws
+        except (AssertionError, TimeoutError, simple_websocket.ConnectionClosed):
+            try:
+                ws.close()
+            except simple_websocket.ConnectionClosed:
+                pass
+    raise RuntimeError(f"could not connect to worker on port {port}")
+
+def run_clients(ports, expected, ready, results):
+    """
+    Hold one client per port entry. Reports ready once every client has seen
+    a warmup broadcast (so all fan-out listeners are subscribed), then
+    (ticks received, last receipt time).
+    """
+    counts = [0] * len(ports)
+    last_receipt = [0.0] * len(ports)
+    warmed = [threading.Event() for _ in ports]
+    clients = [connect_client(port) for port in ports]
+
+    def read(i, ws):
+        while counts[i] < expected:
+            try:
+                frame = ws.receive(timeout=30)
+            except simple_websocket.ConnectionClosed:
+                return
+            if frame is None:
+                return
+            if frame == '2':
+                try:
+                    ws.send('3')  # engine.io ping
+                except simple_websocket.ConnectionClosed:
+                    return
+            elif frame.startswith('42["warmup"'):
+                warmed[i].set()
+            elif frame.startswith('42["tick"'):
+                counts[i] += 1
+                last_receipt[i] = time.time()
+
+    threads = [threading.Thread(target=read, args=(i, ws), daemon=True) for i, ws in enumerate(clients)]
+    for t in threads:
+        t.start()
+    for event in warmed:
+        event.wait(60)
+    ready.put(len(clients))
+    for t in threads:
+        t.join(60)
+    results.put((sum(counts), max(last_receipt)))
+    for ws in clients:
+        try:
+            ws.close()
+        except simple_websocket.ConnectionClosed:
+            pass
+
+def bench(queue_url, workers, clients=200, messages=200, client_procs=4):
+    servers = [multiprocessing.Process(target=serve, args=(BASE_PORT + i, queue_url), daemon=True)
+               for i in range(workers)]
+    for proc in servers:
+        proc.start()
+    for i in range(workers):
+        wait_for_port(BASE_PORT + i)
+    time.sleep(0.5)  # let each worker's fan-out listener subscribe
+
+    ports = [BASE_PORT + i % workers for i in range(clients)]
+    ready, results = multiprocessing.Queue(), multiprocessing.Queue()
+    client_groups = [ports[i::client_procs] for i in range(client_procs)]
+    procs = [multiprocessing.Process(target=run_clients, args=(group, messages, ready, results), daemon=True)
+             for group in client_groups]
+    for proc in procs:
+        proc.start()
+
+    publisher = create_fanout_manager(queue_url, write_only=True)
+    pending = len(procs)
+    deadline = time.time() + 120
+    while pending and time.time() < deadline:
+        publisher.emit('warmup', {}, namespace='/', room=ROOM)
+        try:
+            ready.get(timeout=0.2)
+            pending -= 1
+        except Exception:
+            pass
+    time.sleep(0.5)  # let the last warmup frames drain
+
+    start = time.time()
+    for i in range(messages):
+        publisher.emit('tick', {'seq': i, 'text': 'x' * 100}, namespace='/', room=ROOM)
+
+    delivered, finished = 0, start
+    for _ in procs:
+        count, last = results.get(timeout=120)
+        delivered += count
+        finished = max(finished, last)
+
+    for proc in servers + procs:
+        proc.terminate()
+    return delivered, clients * messages, finished - start
+
+if __name__ == "__main__":
+    queue_url = os.getenv("SOCKETIO_MESSAGE_QUEUE")
+    broker = None
+    if not queue_url:
+        path = os.path.join(tempfile.mkdtemp(), 'socketio.sock')
+        broker = UnixSocketBroker(path).start()
+        queue_url = f"unixbroker://{path}"
+
+    print(f"backend: {queue_url}  cpus: {os.cpu_count()}", flush=True)
+    print(f"{'workers':>8} {'delivered':>10} {'seconds':>8} {'msgs/s':>10}", flush=True)
+    for workers in (1, 2, 4):
+        delivered, expected, elapsed = bench(queue_url, workers)
+        note = "" if delivered == expected else f"  (expected {expected})"
+        print(f"{workers:>8} {delivered:>10} {elapsed:>8.2f} {delivered / elapsed:>10.0f}{note}", flush=True)
+
+    if broker:
+        broker.stop()
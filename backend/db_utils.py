@@ -0,0 +1,380 @@
+"""
+Database access utilities: a pool configured from the environment, checked
+in the background instead of on every checkout, and separate read (autocommit)
+and write (transaction) connections with per-route statement and lock
+timeouts. Reads can be routed to a streaming replica with read-your-writes
+pinning and a lag check.
+"""
+import os
+import time
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import g, request, has_request_context
+from sqlalchemy import create_engine, text
+
+from metrics_utils import InstrumentedQueuePool
+from security_utils import start_background_job
+
+# ============ CONNECTION POOL ============
+
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))  # connections kept open per process
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '20'))  # extra connections opened under load, closed when returned
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '10'))  # seconds a checkout waits before failing
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))  # seconds before a connection is replaced
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', '').lower() in ('1', 'true', 'yes')  # ping on every checkout instead
+DB_LIVENESS_INTERVAL = float(os.getenv('DB_LIVENESS_INTERVAL', '30'))  # seconds between pings of idle connections
+
+# Postgres session defaults for every connection; routes may override them
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', '30000'))
+DB_LOCK_TIMEOUT_MS = int(os.getenv('DB_LOCK_TIMEOUT_MS', '10000'))
+
+def create_db_engine(url):
+    """
+    Engine with a LIFO QueuePool sized from the environment. LIFO keeps the
+    busy connections warm and lets surplus idle ones age out via recycle.
+    The default timeouts are sent as startup options, so setting them costs
+    no round trip.
+    """
+    connect_args = {}
+    if url.startswith(('postgres://', 'postgresql')):
+        connect_args['options'] = (f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS} "
+                                   f"-c lock_timeout={DB_LOCK_TIMEOUT_MS}")
+    return create_engine(
+        url,
+        future=True,
+        poolclass=InstrumentedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        pool_use_lifo=True,
+        connect_args=connect_args
+    )
+
+_liveness_stats = {}  # pool name -> counters
+_liveness_lock = threading.Lock()
+
+def check_pool_liveness(engine, name='primary'):
+    """
+    Ping every idle pooled connection once, in place and one at a time, and
+    discard the ones that fail. Requests keep the rest of the pool meanwhile,
+    and the pings are not counted as checkouts.
+    Replaces pre-ping: a connection dropped while idle (server restart,
+    idle timeout, network) is found here rather than on a request's
+    checkout. A connection that dies between checks still fails the
+    request that gets it, and SQLAlchemy then invalidates the pool.
+    """
+    pool = engine.pool
+    if not isinstance(pool, InstrumentedQueuePool):
+        return
+
+    pings, failures = pool.ping_idle()
+
+    with _liveness_lock:
+        stats = _liveness_stats.setdefault(name, {'checks': 0, 'pings': 0, 'failures': 0})
+        stats['checks'] += 1
+        stats['pings'] += pings
+        stats['failures'] += failures
+    if failures:
+        print(f"DB liveness: discarded {failures} of {pings} idle {name} connections", flush=True)
+
+def start_pool_liveness(engine, name='primary', interval=DB_LIVENESS_INTERVAL):
+    """Ping idle connections every `interval` seconds in the background"""
+    start_background_job(f'db-pool-liveness-{name}', lambda: check_pool_liveness(engine, name), interval)
+
+def get_pool_stats(engine, name='primary'):
+    pool = engine.pool
+    with _liveness_lock:
+        stats = {'liveness': dict(_liveness_stats.get(name, {'checks': 0, 'pings': 0, 'failures': 0}))}
+    if isinstance(pool, InstrumentedQueuePool):
+        stats.update(pool.get_stats())
+    return stats
+
+def render_pool_metrics(engines):
+    """Pool saturation gauges and counters for {name: engine} in the Prometheus text format"""
+    series = {}  # metric -> (kind, description, [(pool name, value)])
+    for pool_name, engine in engines.items():
+        for name, kind, description, value in _pool_metrics(get_pool_stats(engine, pool_name)):
+            if value is not None:
+                series.setdefault(name, (kind, description, []))[2].append((pool_name, value))
+    lines = []
+    for name, (kind, description, values) in series.items():
+        lines += [f'# HELP {name} {description}', f'# TYPE {name} {kind}']
+        lines += [f'{name}{{pool="{pool_name}"}} {value}' for pool_name, value in values]
+    return '\n'.join(lines) + '\n'
+
+def _pool_metrics(stats):
+    return [
+        ('db_pool_size', 'gauge', 'Connections the pool keeps open', stats.get('size')),
+        ('db_pool_max_overflow', 'gauge', 'Connections the pool may open beyond its size', stats.get('max_overflow')),
+        ('db_pool_connections', 'gauge', 'Open pooled connections', stats.get('connections')),
+        ('db_pool_checked_out', 'gauge', 'Connections in use', stats.get('checked_out')),
+        ('db_pool_idle', 'gauge', 'Open connections waiting in the pool', stats.get('idle')),
+        ('db_pool_checkouts_in_progress', 'gauge', 'Checkouts waiting for or opening a connection', stats.get('checkouts_in_progress')),
+        ('db_pool_utilization', 'gauge', 'Checked out connections over size plus max overflow', stats.get('utilization')),
+        ('db_pool_checkouts_total', 'counter', 'Connection checkouts', stats.get('checkouts')),
+        ('db_pool_checkout_seconds_total', 'counter', 'Time spent checking out connections', stats.get('checkout_seconds')),
+        ('db_pool_checkout_timeouts_total', 'counter', 'Checkouts that gave up after DB_POOL_TIMEOUT', stats.get('checkout_timeouts')),
+        ('db_liveness_pings_total', 'counter', 'Background pings of idle connections', stats['liveness']['pings']),
+        ('db_liveness_failures_total', 'counter', 'Idle connections discarded after a failed ping', stats['liveness']['failures']),
+    ]
+
+# ============ READ AND WRITE CONNECTIONS ============
+
+def db_timeouts(statement_ms=None, lock_ms=None):
+    """
+    Route decorator: statement_timeout / lock_timeout (milliseconds) for the
+    route's db.read() and db.write() connections, in place of the
+    DB_STATEMENT_TIMEOUT_MS / DB_LOCK_TIMEOUT_MS defaults
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            g.db_timeouts = (statement_ms, lock_ms)
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+# A user's reads go to the primary for DB_READ_YOUR_WRITES_WINDOW seconds after
+# they write; replicas lagging more than DB_REPLICA_MAX_LAG get no reads at all.
+# Keep the window above the max lag so a write is on the replica by the time
+# its writer's reads return there.
+DATABASE_REPLICA_URL = os.getenv('DATABASE_REPLICA_URL', '')  # unset: every read goes to the primary
+DB_READ_YOUR_WRITES_WINDOW = float(os.getenv('DB_READ_YOUR_WRITES_WINDOW', '5'))
+DB_REPLICA_MAX_LAG = float(os.getenv('DB_REPLICA_MAX_LAG', '2'))  # seconds
+DB_REPLICA_LAG_CHECK_INTERVAL = float(os.getenv('DB_REPLICA_LAG_CHECK_INTERVAL', '1'))
+DB_PIN_MAX_KEYS = 100000
+
+# Route arguments that identify whose data a read returns
+PIN_VIEW_ARGS = {'user_id': 'user', 'provider_id': 'provider', 'conversation_id': 'conversation',
+                 'request_id': 'request'}
+
+# Seconds the replica is behind the primary; 0 when it has replayed all WAL it
+# received, or when it is not a standby at all (a stand-in pointing at the
+# primary)
+REPLICA_LAG_QUERY = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+def _first_set(*values):
+    return next(value for value in values if value is not None)
+
+class Database:
+    """
+    read() hands out autocommit connections for pure reads: each statement
+    runs on its own, with no BEGIN / COMMIT round trips and no transaction
+    held open while the route serializes its response. Reads that need one
+    snapshot across statements should use write().
+
+    write() is engine.begin(): one transaction, committed on exit. With
+    autocommit=True it is a primary connection for single-statement writes.
+
+    Both apply the route's db_timeouts. Pooled connections always carry the
+    defaults, so routes that keep them pay nothing. A write sets overrides
+    with SET LOCAL, which ends with the transaction. A read sets them for
+    the session and resets them before the connection goes back.
+
+    With a replica engine, read() uses the replica unless:
+    - its last lag check failed, is stale or exceeded DB_REPLICA_MAX_LAG;
+    - the read is pinned;
+    - the replica refuses a connection.
+    A commit through write() pins the authenticated user and the keys the
+    route passes as pin=; pin_to_primary() does the same for asynchronous
+    writes. A read is pinned when the JWT user or a user_id, provider_id,
+    conversation_id or request_id route argument matches a pin from the last
+    DB_READ_YOUR_WRITES_WINDOW seconds. Pins are per process, which holds
+    with the sticky sessions run_workers.py already needs.
+    """
+
+    def __init__(self, engine, replica_engine=None):
+        self.engine = engine
+        self.autocommit_engine = engine.execution_options(isolation_level="AUTOCOMMIT")
+        self.timeouts_supported = engine.dialect.name == 'postgresql'
+        self.replica_engine = replica_engine
+        self.replica_autocommit_engine = (replica_engine.execution_options(isolation_level="AUTOCOMMIT")
+                                          if replica_engine is not None else None)
+        self.replica_lag = None  # None: unknown or unreachable
+        self.replica_checked_at = 0.0
+        self._pins = {}  # (kind, id) -> monotonic expiry
+        self._lock = threading.Lock()
+        self.stats = {'primary_reads': 0, 'replica_reads': 0, 'pinned_reads': 0,
+                      'lagging_reads': 0, 'replica_connect_failures': 0, 'lag_check_failures': 0}
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _timeouts(self, statement_ms, lock_ms):
+        """Explicit, then route (@db_timeouts), then default; 0 means no timeout"""
+        route = g.get('db_timeouts', (None, None)) if has_request_context() else (None, None)
+        return (_first_set(statement_ms, route[0], DB_STATEMENT_TIMEOUT_MS),
+                _first_set(lock_ms, route[1], DB_LOCK_TIMEOUT_MS))
+
+    def _set_timeouts(self, conn, timeouts, local):
+        conn.execute(text("""
+            SELECT set_config('statement_timeout', :statement_ms, :local),
+                   set_config('lock_timeout', :lock_ms, :local)
+        """), {"statement_ms": str(timeouts[0]), "lock_ms": str(timeouts[1]), "local": local})
+
+    # ---- replica routing ----
+
+    def check_replica_lag(self):
+        """Measure replica lag (run in the background); a failure stops replica reads"""
+        try:
+            with self.replica_autocommit_engine.connect() as conn:
+                lag = float(conn.execute(text(REPLICA_LAG_QUERY)).scalar() or 0)
+            with self._lock:
+                self.replica_lag = lag
+                self.replica_checked_at = time.monotonic()
+        except Exception as e:
+            with self._lock:
+                self.replica_lag = None
+                self.stats['lag_check_failures'] += 1
+            print(f"Replica lag check failed: {e}", flush=True)
+        self._prune_pins()
+
+    def replica_usable(self):
+        with self._lock:
+            lag, checked_at = self.replica_lag, self.replica_checked_at
+        fresh = time.monotonic() - checked_at <= DB_REPLICA_LAG_CHECK_INTERVAL * 3 + 1
+        return lag is not None and fresh and lag <= DB_REPLICA_MAX_LAG
+
+    def _user_keys(self):
+        user = g.get('current_user') if has_request_context() else None
+        return [('user', str(user['user_id']))] if user else []
+
+    def _read_keys(self):
+        keys = self._user_keys()
+        if has_request_context() and request.view_args:
+            for arg, kind in PIN_VIEW_ARGS.items():
+                if request.view_args.get(arg):
+                    keys.append((kind, str(request.view_args[arg])))
+        return keys
+
+    def pin_to_primary(self, *keys):
+        """Send reads matching these (kind, id) keys to the primary for the read-your-writes window"""
+        if self.replica_engine is None or not keys:
+            return
+        expires = time.monotonic() + DB_READ_YOUR_WRITES_WINDOW
+        with self._lock:
+            if len(self._pins) >= DB_PIN_MAX_KEYS:
+                self._pins.clear()  # losing pins early only costs staleness up to the max lag
+            for kind, key in keys:
+                self._pins[(kind, str(key))] = expires
+
+    def _pinned(self):
+        keys = self._read_keys()
+        if not keys:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            return any(self._pins.get(key, 0) > now for key in keys)
+
+    def _prune_pins(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, expires in self._pins.items() if expires <= now]
+            for key in expired:
+                del self._pins[key]
+
+    def _read_connection(self, primary):
+        if not primary and self.replica_engine is not None:
+            if not self.replica_usable():
+                self._count('lagging_reads')
+            elif self._pinned():
+                self._count('pinned_reads')
+            else:
+                try:
+                    conn = self.replica_autocommit_engine.connect()
+                    self._count('replica_reads')
+                    return conn
+                except Exception as e:
+                    with self._lock:
+                        self.replica_lag = None  # until the next lag check succeeds
+                        self.stats['replica_connect_failures'] += 1
+                    print(f"Replica connection failed, reading from the primary: {e}", flush=True)
+        self._count('primary_reads')
+        return self.autocommit_engine.connect()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['replica_configured'] = self.replica_engine is not None
+            stats['replica_lag'] = self.replica_lag
+            stats['pinned_keys'] = len(self._pins)
+        stats['replica_usable'] = self.replica_engine is not None and self.replica_usable()
+        return stats
+
+    def render_prometheus(self):
+        stats = self.get_stats()
+        lines = ['# HELP db_reads_total Database reads by where they were routed and why',
+                 '# TYPE db_reads_total counter']
+        for target, name in (('replica', 'replica_reads'), ('primary', 'primary_reads')):
+            lines.append(f'db_reads_total{{target="{target}"}} {stats[name]}')
+        lines += ['# HELP db_primary_fallback_reads_total Reads sent to the primary although a replica is configured',
+                  '# TYPE db_primary_fallback_reads_total counter']
+        for reason, name in (('pinned', 'pinned_reads'), ('lagging', 'lagging_reads'),
+                             ('connect_failed', 'replica_connect_failures')):
+            lines.append(f'db_primary_fallback_reads_total{{reason="{reason}"}} {stats[name]}')
+        if stats['replica_configured']:
+            lines += ['# HELP db_replica_lag_seconds Replica lag at the last check (-1: check failed)',
+                      '# TYPE db_replica_lag_seconds gauge',
+                      f'db_replica_lag_seconds {stats["replica_lag"] if stats["replica_lag"] is not None else -1}']
+        return '\n'.join(lines) + '\n'
+
+    # ---- connections ----
+
+    @contextmanager
+    def _session_timeouts(self, conn, statement_ms, lock_ms):
+        """Route timeouts on an autocommit connection, reset before it goes back"""
+        timeouts = self._timeouts(statement_ms, lock_ms)
+        custom = self.timeouts_supported and timeouts != (DB_STATEMENT_TIMEOUT_MS, DB_LOCK_TIMEOUT_MS)
+        if custom:
+            self._set_timeouts(conn, timeouts, local=False)
+        try:
+            yield conn
+        finally:
+            if custom:
+                try:
+                    self._set_timeouts(conn, (DB_STATEMENT_TIMEOUT_MS, DB_LOCK_TIMEOUT_MS), local=False)
+                except Exception:
+                    conn.invalidate()  # never return a connection with a route's timeouts
+
+    @contextmanager
+    def read(self, statement_ms=None, lock_ms=None, primary=False):
+        """Autocommit connection, on a replica when routing allows (primary=True never)"""
+        with self._read_connection(primary) as conn, self._session_timeouts(conn, statement_ms, lock_ms):
+            yield conn
+
+    @contextmanager
+    def write(self, statement_ms=None, lock_ms=None, pin=(), autocommit=False):
+        """
+        Transaction on the primary; after it commits, pins the JWT user and `pin` keys.
+        autocommit=True skips BEGIN / COMMIT for a write that is one statement,
+        such as a stored function call; each statement then commits on its own.
+        """
+        if autocommit:
+            with self.autocommit_engine.connect() as conn, self._session_timeouts(conn, statement_ms, lock_ms):
+                yield conn
+        else:
+            timeouts = self._timeouts(statement_ms, lock_ms)
+            with self.engine.begin() as conn:
+                if self.timeouts_supported and timeouts != (DB_STATEMENT_TIMEOUT_MS, DB_LOCK_TIMEOUT_MS):
+                    self._set_timeouts(conn, timeouts, local=True)
+                yield conn
+        self.pin_to_primary(*pin, *self._user_keys())
+
+def create_database(engine, replica_engine=None, interval=DB_REPLICA_LAG_CHECK_INTERVAL):
+    """Build the process-wide Database and, with a replica, keep its lag measured"""
+    database = Database(engine, replica_engine)
+    if replica_engine is not None:
+        database.check_replica_lag()
+        start_background_job('db-replica-lag', database.check_replica_lag, interval)
+    return database
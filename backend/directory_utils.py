@@ -0,0 +1,111 @@
+"""
+Provider directory utilities: a versioned per-worker cache of serialized
+directory pages, kept in step with writes made through any worker
+"""
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+from security_utils import start_background_job
+
+# ============ PROVIDER DIRECTORY CACHE ============
+
+PROVIDER_DIRECTORY_SYNC_INTERVAL = float(os.getenv('PROVIDER_DIRECTORY_SYNC_INTERVAL', '2'))  # max staleness seen by other workers
+PROVIDER_DIRECTORY_CACHE_MAX_SIZE = int(os.getenv('PROVIDER_DIRECTORY_CACHE_MAX_SIZE', '256'))  # 0 disables the cache
+PROVIDER_DIRECTORY_VERSION = 'provider_directory'  # cache_versions row bumped by service_providers writes
+
+class ProviderDirectoryCache:
+    """
+    LRU cache of serialized directory responses keyed by query (service
+    type, page cursor, page size, fields), each stored as (body, etag) with a
+    strong ETag over the body bytes.
+
+    Every statement that writes service_providers bumps the
+    provider_directory row of cache_versions (db/init/018). sync() polls that
+    version in the background and drops every entry when it moves, so a
+    registration, rating or activation change made through any worker is
+    served everywhere within PROVIDER_DIRECTORY_SYNC_INTERVAL seconds;
+    invalidate() makes the writing worker reload on its next request.
+    Between changes a matching If-None-Match is answered without a query.
+    """
+
+    def __init__(self, engine, max_size=PROVIDER_DIRECTORY_CACHE_MAX_SIZE):
+        self.engine = engine
+        self.max_size = max_size
+        self._entries = OrderedDict()  # key -> (body, etag)
+        self._version = None  # None: unknown, read it before caching anything
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.syncs = 0
+
+    def sync(self):
+        """Read the shared directory version; a new one empties the cache"""
+        from sqlalchemy import text
+
+        with self.engine.connect() as conn:
+            version = conn.execute(text("""
+                SELECT version FROM cache_versions WHERE name = :name
+            """), {"name": PROVIDER_DIRECTORY_VERSION}).scalar()
+
+        with self._lock:
+            self.syncs += 1
+            if version != self._version:
+                self._version = version
+                self._entries.clear()
+        return version
+
+    def get(self, key, build):
+        """(body, etag) for a query; build() returns the body bytes on a miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+            version = self._version
+
+        if version is None:
+            try:
+                version = self.sync()
+            except Exception as e:
+                print(f"Provider directory version check failed: {e}", flush=True)
+
+        # The version is read before the rows, so a concurrent write can only
+        # make this body newer than its version, never older
+        body = build()
+        entry = (body, hashlib.sha256(body).hexdigest()[:32])
+
+        if version is not None and self.max_size > 0:
+            with self._lock:
+                if self._version == version:
+                    self._entries[key] = entry
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_size:
+                        self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self):
+        """Call after committing a provider write in this worker"""
+        with self._lock:
+            self._version = None
+            self._entries.clear()
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'syncs': self.syncs,
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'version': self._version
+            }
+
+def create_provider_directory(engine, interval=PROVIDER_DIRECTORY_SYNC_INTERVAL):
+    """Build the process-wide directory cache and keep its version in sync"""
+    cache = ProviderDirectoryCache(engine)
+    start_background_job('provider-directory-sync', cache.sync, interval)
+    return cache
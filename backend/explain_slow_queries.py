@@ -0,0 +1,105 @@
+"""
+Run EXPLAIN (ANALYZE, BUFFERS) on statements captured by the slow-query log.
+
+With SQL_PROFILE=1 and SQL_SLOW_QUERY_CAPTURE=<file>, the backend appends
+every slow statement to <file> as JSON lines, with its bound parameters when
+SQL_SLOW_QUERY_CAPTURE_VALUES=1 and otherwise only their shape. Entries
+without values, or with redacted ones (anything but ids, paging, filters and
+timestamps), are listed but reported as not explainable. This
+replays the slowest capture of each fingerprint against a database (point it
+at a local copy, not production) and prints the plans. Each statement runs in
+a transaction that is rolled back, so captured writes are not kept.
+
+Usage (from backend/):
+    python explain_slow_queries.py slow_queries.jsonl
+    python explain_slow_queries.py slow_queries.jsonl --fingerprint 3f2a9c0d1b7e --limit 1
+    python explain_slow_queries.py slow_queries.jsonl --database-url postgresql://localhost/immican --no-analyze
+"""
+import argparse
+import json
+import os
+import sys
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine
+
+from metrics_utils import REDACTED
+
+def load_captures(path, fingerprint=None):
+    """Slowest capture per fingerprint, slowest first, with its capture count"""
+    slowest, counts = {}, {}
+    with open(path) as capture:
+        for line in capture:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if fingerprint and not entry['fingerprint'].startswith(fingerprint):
+                continue
+            key = entry['fingerprint']
+            counts[key] = counts.get(key, 0) + 1
+            if key not in slowest or entry['ms'] > slowest[key]['ms']:
+                slowest[key] = entry
+    return sorted(((entry, counts[key]) for key, entry in slowest.items()), key=lambda item: -item[0]['ms'])
+
+def explain(engine, entry, analyze=True):
+    options = "ANALYZE, BUFFERS" if analyze else "COSTS"
+    parameters = entry['parameters']
+    if parameters is None:
+        raise ValueError(f"not explainable: captured without values (params {entry.get('parameter_shape')}); "
+                         "set SQL_SLOW_QUERY_CAPTURE_VALUES=1 to capture them")
+    if isinstance(parameters, list) and parameters and isinstance(parameters[0], (dict, list)):
+        parameters = parameters[0]  # executemany: explain the first row
+    values = parameters.items() if isinstance(parameters, dict) else enumerate(parameters)
+    redacted = [str(name) for name, value in values if value == REDACTED]
+    if redacted:
+        # A plan for a placeholder value that can never match would mislead
+        raise ValueError(f"not explainable: parameters redacted at capture ({', '.join(redacted[:10])})")
+    if isinstance(parameters, list):
+        parameters = tuple(parameters)
+
+    with engine.connect() as conn:
+        trans = conn.begin()
+        try:
+            result = conn.exec_driver_sql(f"EXPLAIN ({options}) {entry['statement']}", parameters)
+            return [row[0] for row in result]
+        finally:
+            trans.rollback()
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="EXPLAIN captured slow SQL statements")
+    parser.add_argument("capture", nargs="?", default=os.getenv("SQL_SLOW_QUERY_CAPTURE"),
+                        help="capture file (default: SQL_SLOW_QUERY_CAPTURE)")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"))
+    parser.add_argument("--fingerprint", help="only this fingerprint (prefix match)")
+    parser.add_argument("--limit", type=int, default=10, help="fingerprints to explain, slowest first")
+    parser.add_argument("--no-analyze", action="store_true", help="plan only; do not execute the statements")
+    args = parser.parse_args()
+
+    if not args.capture:
+        print("!! No capture file given and SQL_SLOW_QUERY_CAPTURE is not set", file=sys.stderr, flush=True)
+        sys.exit(1)
+    if not args.database_url:
+        print("!! DATABASE_URL is missing; pass --database-url", file=sys.stderr, flush=True)
+        sys.exit(1)
+
+    captures = load_captures(args.capture, args.fingerprint)[:args.limit]
+    if not captures:
+        print("No captured statements match")
+        return
+
+    engine = create_engine(args.database_url, future=True)
+    for entry, count in captures:
+        print(f"=== fp={entry['fingerprint']}  {entry['ms']}ms  {entry['route']}  "
+              f"(captured {count}x, last {entry['captured_at']})")
+        print(entry['statement'].strip())
+        print("---")
+        try:
+            for line in explain(engine, entry, analyze=not args.no_analyze):
+                print(f"  {line}")
+        except Exception as e:
+            print(f"  !! EXPLAIN failed: {e}")
+        print(flush=True)
+
+if __name__ == "__main__":
+    main()
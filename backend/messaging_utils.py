@@ -0,0 +1,540 @@
+"""
+Messaging utilities for ordering and batching chat message writes, and for
+fanning Socket.IO broadcasts out across worker processes
+"""
+import os
+import time
+import atexit
+import select
+import socket
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
+
+import socketio
+
+# ============ MESSAGE TIMESTAMPS ============
+
+_clock_lock = threading.Lock()
+_last_timestamp = datetime.min
+
+def next_message_timestamp():
+    """
+    created_date for a new message, strictly increasing within the process.
+    Messages are stamped when they are accepted rather than when they are
+    written, so a batch keeps the order in which its messages arrived and
+    the cursor broadcast with a message matches the stored row. A resend is
+    not stamped again while its first copy is queued or stored (see
+    MessageWriter.attach).
+    """
+    global _last_timestamp
+    with _clock_lock:
+        now = datetime.now()
+        if now <= _last_timestamp:
+            now = _last_timestamp + timedelta(microseconds=1)
+        _last_timestamp = now
+        return now
+
+# ============ MESSAGE PERSISTENCE PIPELINE ============
+
+# Chat messages are broadcast as soon as they are accepted and written by a
+# background thread in batches, so a burst of messages costs one INSERT and
+# one commit instead of one per message.
+MESSAGE_QUEUE_SIZE = int(os.getenv('MESSAGE_QUEUE_SIZE', '10000'))
+MESSAGE_BATCH_SIZE = int(os.getenv('MESSAGE_BATCH_SIZE', '200'))
+MESSAGE_FLUSH_INTERVAL = float(os.getenv('MESSAGE_FLUSH_INTERVAL', '0.05'))  # seconds
+MESSAGE_MAX_RETRIES = int(os.getenv('MESSAGE_MAX_RETRIES', '5'))
+
+MESSAGE_COLUMNS = ['id', 'conversation_id', 'sender_id', 'sender_type', 'message_text', 'created_date']
+
+class MessageIdConflict(Exception):
+    """A client-chosen message id that already belongs to another conversation or sender"""
+
+class MessageWriter:
+    """
+    FIFO queue with a single writer thread that persists chat messages with
+    one multi-row INSERT per batch. The statement-level messages trigger then
+    updates each conversation once per batch.
+    
+    Delivery contract: a message is only durable once on_persisted has been
+    called for it. Senders keep unacknowledged messages and resend them with
+    the same id (e.g. after reconnecting to a restarted server); the INSERT
+    ignores ids that already exist, so resends never duplicate rows. A message
+    whose conversation was deleted before its batch ran is not stored and
+    goes to on_failed.
+    
+    A failed batch is retried with backoff before anything queued after it,
+    which keeps per-conversation order. After max_retries it is handed to
+    on_failed instead. The queue is bounded and submit() refuses new messages
+    when it is full rather than dropping accepted ones.
+    """
+    
+    def __init__(self, engine, on_persisted=None, on_failed=None, max_size=MESSAGE_QUEUE_SIZE,
+                 batch_size=MESSAGE_BATCH_SIZE, flush_interval=MESSAGE_FLUSH_INTERVAL,
+                 max_retries=MESSAGE_MAX_RETRIES):
+        self.engine = engine
+        self.on_persisted = on_persisted
+        self.on_failed = on_failed
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self._queue = deque()  # (message, ack_targets, accepted_at)
+        self._pending = {}  # message id -> its queue entry, until the batch is written or given up
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self.stats = {'queued': 0, 'persisted': 0, 'rejected': 0, 'failed': 0, 'retries': 0, 'batches': 0}
+        self._max_batch = 0
+        self._lag_total = 0.0
+        self._lag_max = 0.0
+        self._lag_last = 0.0
+    
+    def start(self):
+        """Start the writer thread (idempotent)"""
+        with self._cond:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name='message-writer', daemon=True)
+            self._thread.start()
+    
+    def _match_pending(self, message, ack_target):
+        """Queued copy of message (caller holds the lock); raises MessageIdConflict for a foreign id"""
+        entry = self._pending.get(message['id'])
+        if entry is None:
+            return None
+        queued = entry[0]
+        if (queued['conversation_id'], queued['sender_id']) != (message['conversation_id'], message['sender_id']):
+            raise MessageIdConflict(message['id'])
+        if ack_target not in entry[1]:
+            entry[1].append(ack_target)
+        return queued
+    
+    def attach(self, message_id, conversation_id, sender_id, ack_target=None):
+        """
+        If this message (same id, conversation and sender) is still queued,
+        add ack_target to it and return the queued message; otherwise None.
+        A resend then keeps the timestamp (and cursor) of the copy that will
+        be stored. Raises MessageIdConflict if the id is queued for another
+        conversation or sender.
+        """
+        with self._cond:
+            return self._match_pending({'id': message_id, 'conversation_id': conversation_id,
+                                        'sender_id': sender_id}, ack_target)
+    
+    def submit(self, message, ack_target=None):
+        """
+        Queue a message (a dict with MESSAGE_COLUMNS) for writing. ack_target
+        is passed back to the callbacks, e.g. the sender's socket id.
+        Returns the queued message, which is an earlier copy when the same
+        message is still queued, or None if the queue is full. Raises
+        MessageIdConflict if the id is queued for another conversation or sender.
+        """
+        with self._cond:
+            queued = self._match_pending(message, ack_target)
+            if queued is not None:
+                return queued
+            
+            if len(self._queue) >= self.max_size:
+                self.stats['rejected'] += 1
+                return None
+            
+            entry = (message, [ack_target], time.monotonic())
+            self._queue.append(entry)
+            self._pending[message['id']] = entry
+            self.stats['queued'] += 1
+            
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify()
+        
+        if self._thread is None or not self._thread.is_alive():
+            self.start()
+        return message
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                if len(self._queue) < self.batch_size and not self._stopping:
+                    self._cond.wait(self.flush_interval)
+                batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+                stopping = self._stopping
+            
+            if batch:
+                self._write_with_retry(batch, stopping)
+            elif stopping:
+                return
+    
+    def _write_with_retry(self, batch, stopping):
+        for attempt in range(self.max_retries + 1):
+            try:
+                stored = self._write([entry[0] for entry in batch])
+            except Exception as e:
+                print(f"Failed to write {len(batch)} messages (attempt {attempt + 1}): {e}", flush=True)
+                if attempt == self.max_retries or stopping:
+                    break
+                with self._cond:
+                    self.stats['retries'] += 1
+                time.sleep(min(0.1 * 2 ** attempt, 5.0))
+                continue
+            
+            # Rows the INSERT skipped (their conversation was deleted after
+            # the message was accepted) are not stored and must not be acked
+            persisted = [entry for entry in batch if entry[0]['id'] in stored]
+            dropped = [entry for entry in batch if entry[0]['id'] not in stored]
+            self._release(batch)
+            self._record_success(persisted)
+            self._notify(self.on_persisted, persisted)
+            if dropped:
+                with self._cond:
+                    self.stats['failed'] += len(dropped)
+                self._notify(self.on_failed, dropped)
+            return
+        
+        self._release(batch)
+        with self._cond:
+            self.stats['failed'] += len(batch)
+        self._notify(self.on_failed, batch)
+    
+    def _release(self, batch):
+        """Forget written or abandoned ids; later resends are checked against the table"""
+        with self._cond:
+            for entry in batch:
+                self._pending.pop(entry[0]['id'], None)
+    
+    def _notify(self, callback, batch):
+        if not callback or not batch:
+            return
+        try:
+            callback([(entry[0], target) for entry in batch for target in entry[1]])
+        except Exception as e:
+            print(f"Message writer callback failed: {e}", flush=True)
+    
+    def _write(self, messages):
+        """
+        Insert a batch (and its audit rows) in a single statement. Returns the
+        ids that are stored: the ones inserted plus resends that already
+        existed, which the statement's snapshot still shows as they were
+        before it ran. An existing id from another conversation or sender is
+        not this message, so it is left out and reported as failed.
+        """
+        from sqlalchemy import text
+        
+        params = {}
+        rows = []
+        for i, message in enumerate(messages):
+            rows.append("(" + ", ".join(f":{col}_{i}" for col in MESSAGE_COLUMNS) + ")")
+            for col in MESSAGE_COLUMNS:
+                params[f"{col}_{i}"] = message[col]
+        
+        # A recipient may already have read past a message that is still
+        # queued (read watermarks move on broadcast), so is_read is taken
+        # from their watermark at insert time
+        with self.engine.begin() as conn:
+            return {row.id for row in conn.execute(text(f"""
+                WITH batch AS (
+                    SELECT * FROM (VALUES {', '.join(rows)}) AS v({', '.join(MESSAGE_COLUMNS)})
+                ),
+                inserted AS (
+                    INSERT INTO messages ({', '.join(MESSAGE_COLUMNS)}, is_read)
+                    SELECT v.id, v.conversation_id, v.sender_id, v.sender_type, v.message_text, v.created_date,
+                           COALESCE((v.created_date, v.id) <= (cr.last_read_at, cr.last_read_message_id), FALSE)
+                    FROM batch v
+                    JOIN conversations c ON c.id = v.conversation_id
+                    LEFT JOIN service_providers sp ON sp.id = c.provider_id
+                    LEFT JOIN conversation_reads cr
+                      ON cr.conversation_id = v.conversation_id
+                     AND cr.user_id = CASE WHEN v.sender_id = c.user_id THEN sp.user_id ELSE c.user_id END
+                    ON CONFLICT (id) DO NOTHING
+                    RETURNING id, conversation_id, sender_id
+                ),
+                audited AS (
+                    INSERT INTO audit_log (action_type, description, created_by, created_at)
+                    SELECT 'MESSAGE_SENT', 'Message sent in conversation: ' || conversation_id, sender_id, NOW()
+                    FROM inserted
+                )
+                SELECT id FROM inserted
+                UNION
+                SELECT m.id FROM messages m
+                JOIN batch v ON v.id = m.id AND v.conversation_id = m.conversation_id AND v.sender_id = m.sender_id
+            """), params)}
+    
+    def _record_success(self, batch):
+        if not batch:
+            return
+        now = time.monotonic()
+        lags = [now - entry[2] for entry in batch]
+        with self._cond:
+            self.stats['persisted'] += len(batch)
+            self.stats['batches'] += 1
+            self._max_batch = max(self._max_batch, len(batch))
+            self._lag_total += sum(lags)
+            self._lag_max = max(self._lag_max, max(lags))
+            self._lag_last = lags[0]
+    
+    def flush(self, timeout=5.0):
+        """Wait until everything queued so far has been handed to the writer"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            with self._cond:
+                if not self._queue:
+                    return True
+                self._cond.notify()
+            time.sleep(0.01)
+        return False
+    
+    def stop(self, timeout=5.0):
+        """Write remaining messages and stop the writer thread"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout)
+    
+    def get_stats(self):
+        """Throughput counters, batch sizes and accept-to-commit lag in milliseconds"""
+        with self._cond:
+            batches = self.stats['batches']
+            persisted = self.stats['persisted']
+            return dict(
+                self.stats,
+                pending=len(self._queue),
+                max_size=self.max_size,
+                avg_batch_size=round(persisted / batches, 2) if batches else 0,
+                max_batch_size=self._max_batch,
+                lag_ms={
+                    'last': round(self._lag_last * 1000, 2),
+                    'avg': round(self._lag_total / persisted * 1000, 2) if persisted else 0,
+                    'max': round(self._lag_max * 1000, 2)
+                }
+            )
+
+def create_message_writer(engine, on_persisted=None, on_failed=None):
+    """Build the process-wide writer and make sure it drains on shutdown"""
+    writer = MessageWriter(engine, on_persisted=on_persisted, on_failed=on_failed)
+    writer.start()
+    atexit.register(writer.stop)
+    return writer
+
+# ============ SOCKET.IO FAN-OUT ============
+
+# With more than one worker process a room broadcast must reach clients held
+# by every worker. Each worker publishes emits on a shared channel and relays
+# what the others publish to its own clients. Clients must stick to one
+# worker (sticky sessions) since their connection state lives there.
+SOCKETIO_MESSAGE_QUEUE = os.getenv('SOCKETIO_MESSAGE_QUEUE', '')  # empty: single process, no fan-out
+SOCKETIO_CHANNEL = os.getenv('SOCKETIO_CHANNEL', 'immican_socketio')
+
+class PostgresNotifyManager(socketio.PubSubManager):
+    """
+    Fan-out over Postgres LISTEN/NOTIFY, so a multi-worker deployment needs
+    no extra server. NOTIFY payloads are capped at 8000 bytes; larger emits
+    are parked in socketio_fanout and only their row id is notified.
+    """
+    name = 'postgres'
+    NOTIFY_MAX_BYTES = 7900
+    SPILL_RETENTION_SECONDS = 60
+    
+    def __init__(self, url, channel=SOCKETIO_CHANNEL, write_only=False, logger=None, json=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+        # Accept SQLAlchemy URLs such as postgresql+psycopg2://
+        parsed = urlparse(url)
+        self.dsn = parsed._replace(scheme='postgresql').geturl()
+        self._publisher = None
+        self._publish_lock = threading.Lock()
+        self._last_spill_cleanup = 0.0
+    
+    def _connect(self):
+        import psycopg2
+        
+        conn = psycopg2.connect(self.dsn)
+        conn.autocommit = True
+        return conn
+    
+    def _publish(self, data):
+        payload = self.json.dumps(data)
+        with self._publish_lock:
+            for attempt in range(2):
+                try:
+                    if self._publisher is None or self._publisher.closed:
+                        self._publisher = self._connect()
+                    with self._publisher.cursor() as cur:
+                        if len(payload.encode()) > self.NOTIFY_MAX_BYTES:
+                            cur.execute("INSERT INTO socketio_fanout (payload) VALUES (%s) RETURNING id", (payload,))
+                            notify = self.json.dumps({'spill_id': cur.fetchone()[0]})
+                            self._cleanup_spill(cur)
+                        else:
+                            notify = payload
+                        cur.execute("SELECT pg_notify(%s, %s)", (self.channel, notify))
+                    return
+                except Exception:
+                    self._publisher = None
+                    if attempt:
+                        raise
+    
+    def _cleanup_spill(self, cur):
+        now = time.monotonic()
+        if now - self._last_spill_cleanup < self.SPILL_RETENTION_SECONDS:
+            return
+        self._last_spill_cleanup = now
+        cur.execute("DELETE FROM socketio_fanout WHERE created_at < NOW() - make_interval(secs => %s)",
+                    (self.SPILL_RETENTION_SECONDS,))
+    
+    def _listen(self):
+        from psycopg2 import sql
+        
+        while True:
+            try:
+                conn = self._connect()
+                with conn.cursor() as cur:
+                    cur.execute(sql.SQL("LISTEN {}").format(sql.Identifier(self.channel)))
+                    while True:
+                        if select.select([conn], [], [], 5) == ([], [], []):
+                            continue
+                        conn.poll()
+                        while conn.notifies:
+                            message = self.json.loads(conn.notifies.pop(0).payload)
+                            if 'spill_id' in message:
+                                cur.execute("SELECT payload FROM socketio_fanout WHERE id = %s", (message['spill_id'],))
+                                row = cur.fetchone()
+                                if row is None:
+                                    continue
+                                message = self.json.loads(row[0])
+                            yield message
+            except Exception as e:
+                print(f"Socket.IO fan-out listener lost Postgres connection: {e}", flush=True)
+                time.sleep(1)
+
+class UnixSocketBroker:
+    """
+    Minimal stand-in for a queue server on a single host: every newline
+    delimited frame a connected manager writes is relayed to all other
+    connections on the Unix socket.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self._clients = set()
+        self._lock = threading.Lock()
+        self._server = None
+    
+    def start(self):
+        """Bind the socket and serve in a daemon thread"""
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(self.path)
+        self._server.listen(128)
+        threading.Thread(target=self._accept, name='socketio-broker', daemon=True).start()
+        return self
+    
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return
+            with self._lock:
+                self._clients.add(conn)
+            threading.Thread(target=self._relay, args=(conn,), daemon=True).start()
+    
+    def _relay(self, conn):
+        try:
+            for frame in conn.makefile('rb'):
+                with self._lock:
+                    targets = [c for c in self._clients if c is not conn]
+                for target in targets:
+                    try:
+                        target.sendall(frame)
+                    except OSError:
+                        self._drop(target)
+        except OSError:
+            pass
+        self._drop(conn)
+    
+    def _drop(self, conn):
+        with self._lock:
+            self._clients.discard(conn)
+        conn.close()
+    
+    def stop(self):
+        if self._server:
+            self._server.close()
+        with self._lock:
+            for conn in self._clients:
+                conn.close()
+            self._clients.clear()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+class UnixSocketManager(socketio.PubSubManager):
+    """Fan-out through a UnixSocketBroker (unixbroker:///path/to.sock)"""
+    name = 'unixbroker'
+    
+    def __init__(self, url, channel=SOCKETIO_CHANNEL, write_only=False, logger=None, json=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+        self.path = urlparse(url).path
+        self._publisher = None
+        self._publish_lock = threading.Lock()
+    
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self.path)
+        return sock
+    
+    def _publish(self, data):
+        frame = (self.json.dumps(dict(data, channel=self.channel)) + '\n').encode()
+        with self._publish_lock:
+            for attempt in range(2):
+                try:
+                    if self._publisher is None:
+                        self._publisher = self._connect()
+                    self._publisher.sendall(frame)
+                    return
+                except OSError:
+                    if self._publisher is not None:
+                        self._publisher.close()
+                    self._publisher = None
+                    if attempt:
+                        raise
+    
+    def _listen(self):
+        while True:
+            try:
+                sock = self._connect()
+                for frame in sock.makefile('rb'):
+                    message = self.json.loads(frame)
+                    if message.get('channel') == self.channel:
+                        yield message
+            except OSError as e:
+                print(f"Socket.IO fan-out listener lost broker connection: {e}", flush=True)
+            time.sleep(1)
+
+def create_fanout_manager(url=SOCKETIO_MESSAGE_QUEUE, channel=SOCKETIO_CHANNEL, write_only=False):
+    """
+    Socket.IO client manager for the fan-out backend named by url, or None
+    for a single process. write_only managers let other processes (jobs,
+    benchmarks) emit to clients without serving any.
+      postgresql://...          LISTEN/NOTIFY on the application database
+      unixbroker:///path.sock   UnixSocketBroker on this host
+      redis://, rediss://       Redis pub/sub
+      kafka://                  Kafka
+      zmq+tcp://                ZeroMQ
+      amqp:// and others        Kombu (RabbitMQ, etc.)
+    """
+    if not url:
+        return None
+    
+    scheme = urlparse(url).scheme.split('+', 1)[0].lower()
+    if scheme in ('postgres', 'postgresql'):
+        return PostgresNotifyManager(url, channel=channel, write_only=write_only)
+    if scheme == 'unixbroker':
+        return UnixSocketManager(url, channel=channel, write_only=write_only)
+    if scheme in ('redis', 'rediss', 'valkey', 'valkeys', 'unix'):
+        return socketio.RedisManager(url, channel=channel, write_only=write_only)
+    if scheme == 'kafka':
+        return socketio.KafkaManager(url, channel=channel, write_only=write_only)
+    if scheme == 'zmq':
+        return socketio.ZmqManager(url, channel=channel, write_only=write_only)
+    return socketio.KombuManager(url, channel=channel, write_only=write_only)
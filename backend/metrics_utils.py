@@ -0,0 +1,520 @@
+"""
+Request metrics: per-route latency histograms and database usage (query
+count, query time, connection pool wait) for every HTTP request, exported in
+the Prometheus text format and summarized per response in X-Server-Timing.
+An opt-in query profiler adds per-statement fingerprints, a slow-query log
+and detection of requests that repeat one statement (N+1 queries).
+"""
+import os
+import re
+import hmac
+import json
+import math
+import time
+import hashlib
+import threading
+from bisect import bisect_left
+from collections import deque
+from datetime import datetime
+
+from flask import request, has_request_context
+from sqlalchemy import event, exc as sqlalchemy_exc
+from sqlalchemy.pool import QueuePool
+
+# ============ REQUEST METRICS ============
+
+REQUEST_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # seconds
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')  # bearer token for /metrics; unset: loopback scrapes only
+
+# The request being served by this thread. SQL and pool hooks add to it;
+# work done outside a request (background jobs) counts as background.
+_local = threading.local()
+
+class RequestTimer:
+    """Timings collected while one request is served"""
+    __slots__ = ('start', 'queries', 'db_time', 'pool_wait', 'statements')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.pool_wait = 0.0
+        self.statements = None  # fingerprint -> executions, when profiling
+
+class RouteStats:
+    """Running totals for one (method, route)"""
+    __slots__ = ('buckets', 'count', 'latency', 'queries', 'db_time', 'pool_wait', 'statuses')
+
+    def __init__(self, bucket_count):
+        self.buckets = [0] * (bucket_count + 1)  # the last one counts requests above every bound
+        self.count = 0
+        self.latency = 0.0
+        self.queries = 0
+        self.db_time = 0.0
+        self.pool_wait = 0.0
+        self.statuses = {}
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that charges checkout time (queueing for a free connection,
+    opening a new one, the pre-ping) to the current request and counts
+    checkouts, waits and timeouts for saturation metrics"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.checkouts_in_progress = 0
+        self.checkout_seconds = 0.0
+        self.checkout_timeouts = 0
+
+    def connect(self):
+        with self._stats_lock:
+            self.checkouts_in_progress += 1
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except sqlalchemy_exc.TimeoutError:
+            with self._stats_lock:
+                self.checkout_timeouts += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._stats_lock:
+                self.checkouts_in_progress -= 1
+                self.checkouts += 1
+                self.checkout_seconds += elapsed
+            timer = getattr(_local, 'timer', None)
+            if timer is not None:
+                timer.pool_wait += elapsed
+
+    def ping_idle(self):
+        """
+        Ping the idle connections one at a time where they sit in the pool,
+        invalidating (to be reopened on next use) the ones that fail. This is
+        not a checkout: at most one connection is out of the pool at a time,
+        its place in the LIFO order is kept, and the checkout counters above
+        are untouched. Returns (pings, failures).
+        """
+        idle = self._pool  # QueuePool's queue of idle connection records
+        pings = failures = 0
+        position = 0
+        while True:
+            with idle.mutex:
+                if position >= len(idle.queue):
+                    break
+                record = idle.queue[position]
+                del idle.queue[position]
+            try:
+                connection = record.dbapi_connection
+                if connection is not None:  # None: already invalidated, reopened on checkout
+                    pings += 1
+                    try:
+                        cursor = connection.cursor()
+                        cursor.execute("SELECT 1")
+                        cursor.fetchall()
+                        cursor.close()
+                        connection.rollback()
+                    except Exception as e:
+                        failures += 1
+                        record.invalidate(e)
+            finally:
+                with idle.mutex:
+                    idle.queue.insert(min(position, len(idle.queue)), record)
+                    idle.not_empty.notify()
+            position += 1
+        return pings, failures
+
+    def get_stats(self):
+        checked_out = self.checkedout()
+        capacity = self.size() + max(self._max_overflow, 0)
+        with self._stats_lock:
+            return {
+                'size': self.size(),
+                'max_overflow': self._max_overflow,
+                'connections': self.size() + self.overflow(),  # overflow() starts at -size
+                'checked_out': checked_out,
+                'idle': self.checkedin(),
+                'checkouts_in_progress': self.checkouts_in_progress,
+                'utilization': round(checked_out / capacity, 3) if capacity else 0,
+                'checkouts': self.checkouts,
+                'checkout_seconds': round(self.checkout_seconds, 6),
+                'checkout_timeouts': self.checkout_timeouts
+            }
+
+class RequestMetrics:
+    """
+    Process-wide request and SQL counters. start_request() and
+    finish_request() wrap every Flask request; instrument() hooks an engine's
+    cursor events so each statement is charged to the request running on its
+    thread. Recording a request is one lock acquisition and a bisect, about
+    5-7us per request. A statement costs about 13-18us more, mostly
+    SQLAlchemy's event dispatch rather than the two clock reads
+    (benchmarks/bench_request_metrics.py).
+
+    Counters are per process: with run_workers.py scrape every worker.
+    """
+
+    def __init__(self, buckets=REQUEST_LATENCY_BUCKETS, profiler=None):
+        self.buckets = tuple(buckets)
+        self.profiler = profiler
+        self._routes = {}  # (method, route) -> RouteStats
+        self._lock = threading.Lock()
+        self.background_queries = 0
+        self.background_db_time = 0.0
+
+    def instrument(self, engine):
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+        event.listen(engine, 'handle_error', self._handle_error)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        _local.query_start = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self._record_query(statement, parameters)
+
+    def _handle_error(self, exception_context):
+        # Failed statements skip after_cursor_execute but still took DB time
+        if getattr(_local, 'query_start', None) is not None:
+            self._record_query(exception_context.statement, exception_context.parameters)
+
+    def _record_query(self, statement, parameters):
+        elapsed = time.perf_counter() - _local.query_start
+        _local.query_start = None
+        timer = getattr(_local, 'timer', None)
+        if timer is not None:
+            timer.queries += 1
+            timer.db_time += elapsed
+        else:
+            with self._lock:
+                self.background_queries += 1
+                self.background_db_time += elapsed
+        if self.profiler is not None:
+            self.profiler.record(statement, parameters, elapsed, timer)
+
+    def start_request(self):
+        _local.timer = RequestTimer()
+
+    def finish_request(self, response):
+        """Record the request and add its X-Server-Timing header"""
+        timer = getattr(_local, 'timer', None)
+        if timer is None:
+            return response
+        _local.timer = None
+        elapsed = time.perf_counter() - timer.start
+
+        # Label by URL rule, not path, so ids don't create new series
+        current = request._get_current_object()
+        rule = current.url_rule
+        key = (current.method, rule.rule if rule is not None else '<unmatched>')
+        status = response.status_code
+        with self._lock:
+            stats = self._routes.get(key)
+            if stats is None:
+                stats = self._routes[key] = RouteStats(len(self.buckets))
+            stats.buckets[bisect_left(self.buckets, elapsed)] += 1
+            stats.count += 1
+            stats.latency += elapsed
+            stats.queries += timer.queries
+            stats.db_time += timer.db_time
+            stats.pool_wait += timer.pool_wait
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+
+        if timer.statements is not None:
+            self.profiler.check_repeats(key, timer.statements)
+
+        response.headers['X-Server-Timing'] = (
+            f'app;dur={elapsed * 1000:.2f}, '
+            f'db;dur={timer.db_time * 1000:.2f};desc="{timer.queries} queries", '
+            f'pool;dur={timer.pool_wait * 1000:.2f}'
+        )
+        return response
+
+    def render_prometheus(self):
+        """All counters in the Prometheus text exposition format"""
+        with self._lock:
+            routes = [(key, stats.buckets[:], stats.count, stats.latency, stats.queries,
+                       stats.db_time, stats.pool_wait, dict(stats.statuses))
+                      for key, stats in sorted(self._routes.items())]
+            background = (self.background_queries, self.background_db_time)
+
+        requests_total = ['# HELP http_requests_total HTTP requests by route and status',
+                          '# TYPE http_requests_total counter']
+        duration = ['# HELP http_request_duration_seconds HTTP request latency by route',
+                    '# TYPE http_request_duration_seconds histogram']
+        queries = ['# HELP http_request_db_queries_total SQL statements issued while serving requests',
+                   '# TYPE http_request_db_queries_total counter']
+        db_time = ['# HELP http_request_db_seconds_total Time spent executing SQL while serving requests',
+                   '# TYPE http_request_db_seconds_total counter']
+        pool_wait = ['# HELP http_request_pool_wait_seconds_total Time spent checking out pool connections while serving requests',
+                     '# TYPE http_request_pool_wait_seconds_total counter']
+
+        for (method, route), buckets, count, latency, route_queries, route_db, route_wait, statuses in routes:
+            labels = f'method="{method}",route="{_escape(route)}"'
+            for status, n in sorted(statuses.items()):
+                requests_total.append(f'http_requests_total{{{labels},status="{status}"}} {n}')
+            cumulative = 0
+            for bound, n in zip(self.buckets, buckets):
+                cumulative += n
+                duration.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            duration.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {count}')
+            duration.append(f'http_request_duration_seconds_sum{{{labels}}} {latency:.6f}')
+            duration.append(f'http_request_duration_seconds_count{{{labels}}} {count}')
+            queries.append(f'http_request_db_queries_total{{{labels}}} {route_queries}')
+            db_time.append(f'http_request_db_seconds_total{{{labels}}} {route_db:.6f}')
+            pool_wait.append(f'http_request_pool_wait_seconds_total{{{labels}}} {route_wait:.6f}')
+
+        lines = requests_total + duration + queries + db_time + pool_wait + [
+            '# HELP db_background_queries_total SQL statements issued outside requests (background jobs)',
+            '# TYPE db_background_queries_total counter',
+            f'db_background_queries_total {background[0]}',
+            '# HELP db_background_seconds_total Time spent executing SQL outside requests',
+            '# TYPE db_background_seconds_total counter',
+            f'db_background_seconds_total {background[1]:.6f}',
+        ]
+        if self.profiler is not None:
+            lines += self.profiler.render_prometheus()
+        return '\n'.join(lines) + '\n'
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def metrics_access_allowed():
+    """Scrapes need METRICS_TOKEN as a bearer token, or come from loopback when it is unset"""
+    if METRICS_TOKEN:
+        return hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {METRICS_TOKEN}')
+    return request.remote_addr in ('127.0.0.1', '::1')
+
+def create_request_metrics(engine, profile=None):
+    """Build the process-wide request metrics and hook the engine's SQL
+    events; profile (default SQL_PROFILE) adds the query profiler"""
+    if profile is None:
+        profile = SQL_PROFILE
+    metrics = RequestMetrics(profiler=QueryProfiler() if profile else None)
+    metrics.instrument(engine)
+    return metrics
+
+# ============ QUERY PROFILER ============
+
+SQL_PROFILE = os.getenv('SQL_PROFILE', '').lower() in ('1', 'true', 'yes')  # opt in to the profiler below
+SQL_SLOW_QUERY_MS = float(os.getenv('SQL_SLOW_QUERY_MS', '100'))  # statements at least this slow are logged
+SQL_REPEAT_THRESHOLD = int(os.getenv('SQL_REPEAT_THRESHOLD', '10'))  # more executions of one fingerprint per request are flagged
+SQL_SLOW_QUERY_CAPTURE = os.getenv('SQL_SLOW_QUERY_CAPTURE', '')  # JSON lines file of slow statements for explain_slow_queries.py
+# Capture bound values too (sensitive names redacted); without them only parameter shapes are written
+SQL_SLOW_QUERY_CAPTURE_VALUES = os.getenv('SQL_SLOW_QUERY_CAPTURE_VALUES', '').lower() in ('1', 'true', 'yes')
+SQL_PROFILE_MAX_FINGERPRINTS = int(os.getenv('SQL_PROFILE_MAX_FINGERPRINTS', '1000'))
+SQL_PROFILE_SAMPLES = 256  # recent durations kept per fingerprint for p95
+SQL_SHAPE_MAX_PARAMS = 20  # parameters described per logged statement (multi-row INSERTs bind thousands)
+
+# Literals and bind parameters in any DBAPI paramstyle (%(name)s, %s, :name, ?)
+_SQL_COMMENTS = re.compile(r'--[^\n]*|/\*.*?\*/', re.S)
+_SQL_VALUES = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|%\(\w+\)s|%s|(?<![:\w]):\w+|\?")
+_SQL_VALUE_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_SQL_REPEATED_ROWS = re.compile(r'\(\?\)(?:\s*,\s*\(\?\))+')
+_SQL_WHITESPACE = re.compile(r'\s+')
+# Bind names whose values may reach a capture file: ids, paging, filters and
+# timestamps. Everything else (credentials, sessions, names, contact details,
+# free text) is redacted. Multi-row statements suffix names with _<row>.
+_SAFE_PARAMS = re.compile(
+    r'(?!session_)(?:\w+_)?ids?|uid|pid|limit|offset|cursor|since|until|c_\w+|q|rating|min_rating|priority|'
+    r'status|severity|\w*_?type|success|local|exp|lag|window|weight|max_requests|endpoint|event_count|max_length|'
+    r'statement_ms|lock_ms|ts|timestamp|\w+_(?:at|date|start)'
+)
+_ROW_SUFFIX = re.compile(r'_\d+$')
+REDACTED = '<redacted>'
+
+def normalize_sql(statement):
+    """Statement text with comments, literals and parameters removed, so
+    executions that differ only in values share one fingerprint"""
+    normalized = _SQL_COMMENTS.sub(' ', statement)
+    normalized = _SQL_VALUES.sub('?', normalized)
+    normalized = _SQL_VALUE_LISTS.sub('(?)', normalized)  # IN (?, ?, ?) and VALUES rows
+    normalized = _SQL_REPEATED_ROWS.sub('(?)', normalized)  # multi-row VALUES
+    return _SQL_WHITESPACE.sub(' ', normalized).strip()
+
+def parameter_shape(parameters):
+    """Types (and lengths) of bound parameters, never their values"""
+    if isinstance(parameters, (list, tuple)) and parameters and isinstance(parameters[0], (dict, list, tuple)):
+        return f"{len(parameters)} x {parameter_shape(parameters[0])}"  # executemany
+    if isinstance(parameters, dict):
+        shapes = [f"{name}: {_value_type(value)}" for name, value in list(parameters.items())[:SQL_SHAPE_MAX_PARAMS]]
+        return '{' + ', '.join(shapes + _more(len(parameters))) + '}'
+    if isinstance(parameters, (list, tuple)):
+        shapes = [_value_type(value) for value in parameters[:SQL_SHAPE_MAX_PARAMS]]
+        return '(' + ', '.join(shapes + _more(len(parameters))) + ')'
+    return type(parameters).__name__
+
+def redact_parameters(parameters):
+    """Bound parameters with every value outside the safe bind names replaced"""
+    if isinstance(parameters, dict):
+        return {name: value if _SAFE_PARAMS.fullmatch(_ROW_SUFFIX.sub('', name)) else REDACTED
+                for name, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)) and parameters and isinstance(parameters[0], dict):
+        return [redact_parameters(row) for row in parameters]  # executemany
+    if isinstance(parameters, (list, tuple)):
+        return [REDACTED for _ in parameters]  # positional: no names to judge by
+    return parameters
+
+def _more(count):
+    return [f"... {count} total"] if count > SQL_SHAPE_MAX_PARAMS else []
+
+def _value_type(value):
+    if isinstance(value, (str, bytes, list, tuple)):
+        return f"{type(value).__name__}[{len(value)}]"
+    return type(value).__name__
+
+class FingerprintStats:
+    """Running totals for one normalized statement"""
+    __slots__ = ('sql', 'count', 'total', 'max', 'samples')
+
+    def __init__(self, sql):
+        self.sql = sql
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen=SQL_PROFILE_SAMPLES)
+
+    def p95(self):
+        ordered = sorted(self.samples)
+        return ordered[max(math.ceil(len(ordered) * 0.95) - 1, 0)] if ordered else 0.0
+
+class QueryProfiler:
+    """
+    Per-fingerprint statement statistics, fed by RequestMetrics' cursor
+    hooks. A fingerprint is a hash of the normalized statement, so every
+    execution of one query shape is counted together whatever its values.
+
+    Statements slower than SQL_SLOW_QUERY_MS are logged with their parameter
+    types (not values) and, when SQL_SLOW_QUERY_CAPTURE is set, appended to
+    that file for explain_slow_queries.py. Values are only captured with
+    capture_values (SQL_SLOW_QUERY_CAPTURE_VALUES), and even then only bind
+    names known to be safe (ids, paging, filters, timestamps) keep them; keep that file
+    on a trusted host. The file has its own lock, so a capture never holds up
+    the statement bookkeeping of other threads. A request that runs one fingerprint more than
+    SQL_REPEAT_THRESHOLD times is logged as a likely N+1 query.
+    """
+
+    def __init__(self, slow_ms=SQL_SLOW_QUERY_MS, repeat_threshold=SQL_REPEAT_THRESHOLD,
+                 capture_path=SQL_SLOW_QUERY_CAPTURE, max_fingerprints=SQL_PROFILE_MAX_FINGERPRINTS,
+                 capture_values=SQL_SLOW_QUERY_CAPTURE_VALUES):
+        self.slow_seconds = slow_ms / 1000
+        self.repeat_threshold = repeat_threshold
+        self.capture_path = capture_path
+        self.capture_values = capture_values
+        self.max_fingerprints = max_fingerprints
+        self._fingerprints = {}  # statement text -> (fingerprint, normalized)
+        self._stats = {}  # fingerprint -> FingerprintStats
+        self._repeats = {}  # (method, route, fingerprint) -> requests flagged
+        self._lock = threading.Lock()
+        self._capture_lock = threading.Lock()  # capture file writes only
+        self.slow_queries = 0
+        self.untracked = 0  # executions of fingerprints beyond max_fingerprints
+
+    def fingerprint(self, statement):
+        cached = self._fingerprints.get(statement)
+        if cached is None:
+            normalized = normalize_sql(statement)
+            cached = (hashlib.sha1(normalized.encode()).hexdigest()[:12], normalized)
+            if len(self._fingerprints) >= self.max_fingerprints * 4:
+                self._fingerprints.clear()
+            self._fingerprints[statement] = cached
+        return cached
+
+    def record(self, statement, parameters, elapsed, timer):
+        fingerprint, normalized = self.fingerprint(statement)
+        with self._lock:
+            stats = self._stats.get(fingerprint)
+            if stats is None and len(self._stats) < self.max_fingerprints:
+                stats = self._stats[fingerprint] = FingerprintStats(normalized)
+            if stats is not None:
+                stats.count += 1
+                stats.total += elapsed
+                stats.max = max(stats.max, elapsed)
+                stats.samples.append(elapsed)
+            else:
+                self.untracked += 1
+
+        if timer is not None:
+            if timer.statements is None:
+                timer.statements = {}
+            timer.statements[fingerprint] = timer.statements.get(fingerprint, 0) + 1
+
+        if elapsed >= self.slow_seconds:
+            self._log_slow(fingerprint, normalized, statement, parameters, elapsed)
+
+    def _log_slow(self, fingerprint, normalized, statement, parameters, elapsed):
+        route = 'background'
+        if has_request_context():
+            rule = request.url_rule
+            route = f"{request.method} {rule.rule if rule is not None else request.path}"
+        with self._lock:
+            self.slow_queries += 1
+        shape = parameter_shape(parameters)
+        print(f"SLOW SQL {elapsed * 1000:.1f}ms fp={fingerprint} [{route}] "
+              f"params={shape}: {normalized[:500]}", flush=True)
+
+        if self.capture_path:
+            entry = json.dumps({
+                'fingerprint': fingerprint,
+                'ms': round(elapsed * 1000, 2),
+                'route': route,
+                'statement': statement,
+                'parameters': redact_parameters(parameters) if self.capture_values else None,
+                'parameter_shape': shape,
+                'captured_at': datetime.now().isoformat()
+            }, default=str)
+            try:
+                with self._capture_lock, open(self.capture_path, 'a') as capture:
+                    capture.write(entry + '\n')
+            except OSError as e:
+                print(f"Slow query capture failed: {e}", flush=True)
+
+    def check_repeats(self, route_key, statements):
+        """Flag fingerprints a finished request ran more than repeat_threshold times"""
+        for fingerprint, executions in statements.items():
+            if executions > self.repeat_threshold:
+                method, route = route_key
+                with self._lock:
+                    key = (method, route, fingerprint)
+                    self._repeats[key] = self._repeats.get(key, 0) + 1
+                    stats = self._stats.get(fingerprint)
+                sql = stats.sql[:300] if stats else ''
+                print(f"N+1 SQL: {method} {route} ran fp={fingerprint} {executions} times: {sql}", flush=True)
+
+    def get_stats(self, limit=50):
+        """Top fingerprints by total time, and the routes flagged for repeats"""
+        with self._lock:
+            top = sorted(self._stats.items(), key=lambda item: item[1].total, reverse=True)[:limit]
+            statements = [{
+                'fingerprint': fingerprint,
+                'sql': stats.sql,
+                'count': stats.count,
+                'total_ms': round(stats.total * 1000, 2),
+                'mean_ms': round(stats.total / stats.count * 1000, 3),
+                'p95_ms': round(stats.p95() * 1000, 3),
+                'max_ms': round(stats.max * 1000, 3)
+            } for fingerprint, stats in top]
+            repeats = [{'method': method, 'route': route, 'fingerprint': fingerprint, 'requests': count}
+                       for (method, route, fingerprint), count in sorted(self._repeats.items(), key=lambda item: -item[1])]
+            return {
+                'statements': statements,
+                'repeated_statements': repeats,
+                'fingerprints': len(self._stats),
+                'untracked_executions': self.untracked,
+                'slow_queries': self.slow_queries,
+                'slow_query_ms': self.slow_seconds * 1000,
+                'repeat_threshold': self.repeat_threshold
+            }
+
+    def render_prometheus(self):
+        with self._lock:
+            repeats = sorted(self._repeats.items())
+            slow = self.slow_queries
+        lines = ['# HELP sql_slow_queries_total Statements slower than SQL_SLOW_QUERY_MS',
+                 '# TYPE sql_slow_queries_total counter',
+                 f'sql_slow_queries_total {slow}',
+                 '# HELP sql_repeated_statement_requests_total Requests that ran one fingerprint more than SQL_REPEAT_THRESHOLD times',
+                 '# TYPE sql_repeated_statement_requests_total counter']
+        for (method, route, fingerprint), count in repeats:
+            lines.append(f'sql_repeated_statement_requests_total{{method="{method}",route="{_escape(route)}",fingerprint="{fingerprint}"}} {count}')
+        return lines
@@ -0,0 +1,73 @@
+"""
+Run the backend as N Socket.IO worker processes on consecutive ports.
+
+Each worker is a single-process gunicorn server (threaded, as Flask-SocketIO
+requires in threading mode). Put them behind a load balancer with sticky
+sessions (e.g. nginx ip_hash) and set SOCKETIO_MESSAGE_QUEUE so room
+broadcasts reach clients on every worker. With a unixbroker:// queue the
+broker is started here, so one host needs nothing else.
+
+Usage (from backend/):
+    SOCKETIO_MESSAGE_QUEUE=unixbroker:///tmp/immican_socketio.sock python run_workers.py --workers 4
+    SOCKETIO_MESSAGE_QUEUE=redis://localhost:6379/0 python run_workers.py --workers 4 --port 5001
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+from urllib.parse import urlparse
+
+from dotenv import load_dotenv
+from messaging_utils import UnixSocketBroker
+
+def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Run Socket.IO backend workers")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WORKERS", "2")))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "5001")), help="port of the first worker")
+    parser.add_argument("--threads", type=int, default=100, help="threads per worker (one per open socket)")
+    args = parser.parse_args()
+
+    queue = os.getenv("SOCKETIO_MESSAGE_QUEUE", "")
+    if args.workers > 1 and not queue:
+        print("!! SOCKETIO_MESSAGE_QUEUE must be set to run more than one worker", file=sys.stderr, flush=True)
+        sys.exit(1)
+
+    broker = None
+    if urlparse(queue).scheme == "unixbroker":
+        broker = UnixSocketBroker(urlparse(queue).path).start()
+        print(f">> Socket.IO broker listening on {broker.path}", flush=True)
+
+    workers = []
+    for i in range(args.workers):
+        port = args.port + i
+        workers.append(subprocess.Popen([
+            sys.executable, "-m", "gunicorn",
+            "--workers", "1", "--threads", str(args.threads),
+            "--bind", f"0.0.0.0:{port}", "app:app"
+        ]))
+        print(f">> Worker {i + 1} on port {port}", flush=True)
+
+    print(">> Load balancer upstream (sticky sessions required):", flush=True)
+    print("   upstream immican_backend {\n       ip_hash;", flush=True)
+    for i in range(args.workers):
+        print(f"       server 127.0.0.1:{args.port + i};", flush=True)
+    print("   }", flush=True)
+
+    def shutdown(signum, frame):
+        for worker in workers:
+            worker.terminate()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    exit_code = 0
+    for worker in workers:
+        exit_code = worker.wait() or exit_code
+    if broker:
+        broker.stop()
+    sys.exit(exit_code)
+
+if __name__ == "__main__":
+    main()
@@ -5,12 +5,20 @@ import re
 import html
 import hashlib
 import secrets
+import hmac
+import base64
 import jwt
 from functools import wraps
-from flask import request, jsonify, g
+from flask import request, jsonify, g, make_response
 from datetime import datetime, timedelta
 import time
 import os
+import math
+import struct
+import threading
+import atexit
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 
 # ============ JWT CONFIGURATION ============
 
@@ -30,6 +38,7 @@ def generate_jwt_token(user_id, user_type, email):
         'email': email,
         'exp': datetime.utcnow() + timedelta(hours=JWT_EXPIRATION_HOURS),
         'iat': datetime.utcnow(),
+        'jti': secrets.token_hex(8),  # unique per token so revoking one never hits another
         'type': 'access'
     }
     return jwt.encode(payload, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
@@ -40,6 +49,7 @@ def generate_refresh_token(user_id):
         'user_id': user_id,
         'exp': datetime.utcnow() + timedelta(days=JWT_REFRESH_EXPIRATION_DAYS),
         'iat': datetime.utcnow(),
+        'jti': secrets.token_hex(8),
         'type': 'refresh'
     }
     return jwt.encode(payload, JWT_SECRET_KEY, algorithm=JWT_ALGORITHM)
@@ -54,6 +64,243 @@ def verify_jwt_token(token):
     except jwt.InvalidTokenError:
         return None, "Invalid token"
 
+JWT_CACHE_MAX_SIZE = int(os.getenv('JWT_CACHE_MAX_SIZE', '10000'))  # 0 disables the cache
+
+class JWTVerificationCache:
+    """
+    Bounded LRU cache of verified access token claims, keyed by a SHA-256
+    digest of the token. Entries expire at the token's own exp, so a cached
+    token is never accepted for longer than jwt.decode would accept it.
+    """
+    
+    def __init__(self, max_size=JWT_CACHE_MAX_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()  # digest -> (claims, exp)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, digest):
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None or entry[1] <= time.time():
+                if entry is not None:
+                    del self._entries[digest]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return entry[0]
+    
+    def put(self, digest, claims, exp):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[digest] = (claims, exp)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    
+    def discard(self, digest):
+        with self._lock:
+            self._entries.pop(digest, None)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def get_stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries), 'max_size': self.max_size}
+
+jwt_cache = JWTVerificationCache()
+
+def token_digest(token):
+    """Digest used to key tokens in memory and in the database"""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def get_current_user_claims(token):
+    """
+    Return the g.current_user claims for a valid access token, or None.
+    
+    Verified tokens are cached until they expire, so repeat requests with the
+    same token skip signature verification and JSON parsing. Revoked tokens
+    are rejected from the in-memory revocation list.
+    """
+    digest = token_digest(token)
+    if revocation_list.is_revoked(digest):
+        return None
+    
+    claims = jwt_cache.get(digest)
+    if claims is not None:
+        return claims
+    
+    try:
+        payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
+        claims = {
+            'user_id': payload['user_id'],
+            'user_type': payload['user_type'],
+            'email': payload['email']
+        }
+    except (jwt.InvalidTokenError, KeyError):
+        return None
+    
+    jwt_cache.put(digest, claims, payload['exp'])
+    return claims
+
+def get_jwt_cache_stats():
+    """Get JWT verification cache hit/miss counters"""
+    return jwt_cache.get_stats()
+
+# ============ TOKEN REVOCATION ============
+
+JWT_REVOCATION_SYNC_INTERVAL = float(os.getenv('JWT_REVOCATION_SYNC_INTERVAL', '5'))  # max delay before other workers see a revocation
+JWT_REVOCATION_PRUNE_INTERVAL = 3600  # seconds between dropping expired revocations
+
+class RevocationList:
+    """
+    Per-process copy of the revoked tokens in jwt_tokens.
+    
+    A Bloom filter answers "definitely not revoked" for almost every request
+    without touching the exact set; positives are confirmed against the exact
+    set of digests. sync() pulls rows revoked since the last sync (with a small
+    overlap for transactions that commit out of order), so each worker picks up
+    a revocation within JWT_REVOCATION_SYNC_INTERVAL seconds.
+    
+    The cursor only ever holds database time: revoked_at is stamped with
+    clock_timestamp() by a single-statement transaction, so it trails its
+    commit by far less than SYNC_OVERLAP, and the first sync starts from the
+    database clock rather than this host's, whose timezone may differ.
+    """
+    SYNC_OVERLAP = timedelta(seconds=5)
+    
+    def __init__(self, bloom_bits=1 << 20, bloom_hashes=4):
+        self.bloom_bits = bloom_bits
+        self.bloom_hashes = bloom_hashes
+        self._bloom = bytearray(bloom_bits // 8)
+        self._exact = {}  # token digest -> exp (epoch seconds)
+        self._cursor = None  # latest revoked_at seen in the database
+        self._last_prune = time.time()
+        self._lock = threading.Lock()
+    
+    def _positions(self, digest):
+        raw = bytes.fromhex(digest)
+        return [int.from_bytes(raw[i * 4:i * 4 + 4], 'little') % self.bloom_bits for i in range(self.bloom_hashes)]
+    
+    def _add(self, bloom, exact, digest, exp):
+        for pos in self._positions(digest):
+            bloom[pos >> 3] |= 1 << (pos & 7)
+        exact[digest] = exp
+    
+    def add(self, digest, exp):
+        with self._lock:
+            self._add(self._bloom, self._exact, digest, exp)
+    
+    def is_revoked(self, digest):
+        bloom = self._bloom
+        for pos in self._positions(digest):
+            if not bloom[pos >> 3] & (1 << (pos & 7)):
+                return False
+        exp = self._exact.get(digest)
+        return exp is not None and exp > time.time()
+    
+    def _prune(self):
+        """Rebuild the filter without expired tokens (caller holds the lock)"""
+        now = time.time()
+        bloom, exact = bytearray(len(self._bloom)), {}
+        for digest, exp in self._exact.items():
+            if exp > now:
+                self._add(bloom, exact, digest, exp)
+        self._bloom, self._exact = bloom, exact
+        self._last_prune = now
+    
+    def sync(self):
+        """Pull revocations recorded by any worker since the last sync"""
+        from sqlalchemy import text
+        
+        if not db_engine:
+            return 0
+        
+        with db_engine.connect() as conn:
+            db_now = None
+            if self._cursor is None:
+                db_now = conn.execute(text("SELECT NOW()::timestamp")).scalar()
+                rows = conn.execute(text("""
+                    SELECT token_hash, EXTRACT(EPOCH FROM expires_at::timestamptz) AS exp, revoked_at
+                    FROM jwt_tokens
+                    WHERE is_revoked = TRUE AND expires_at > NOW()
+                """)).fetchall()
+            else:
+                rows = conn.execute(text("""
+                    SELECT token_hash, EXTRACT(EPOCH FROM expires_at::timestamptz) AS exp, revoked_at
+                    FROM jwt_tokens
+                    WHERE is_revoked = TRUE AND revoked_at > :since
+                """), {"since": self._cursor - self.SYNC_OVERLAP}).fetchall()
+            
+            prune = time.time() - self._last_prune > JWT_REVOCATION_PRUNE_INTERVAL
+            if prune:
+                conn.execute(text("SELECT cleanup_expired_tokens()"))
+                conn.commit()
+        
+        with self._lock:
+            for row in rows:
+                self._add(self._bloom, self._exact, row.token_hash, float(row.exp))
+                if row.revoked_at and (self._cursor is None or row.revoked_at > self._cursor):
+                    self._cursor = row.revoked_at
+            if self._cursor is None:
+                self._cursor = db_now
+            if prune:
+                self._prune()
+        
+        return len(rows)
+    
+    def __len__(self):
+        return len(self._exact)
+
+revocation_list = RevocationList()
+
+def start_revocation_sync(interval=JWT_REVOCATION_SYNC_INTERVAL):
+    """Keep this worker's revocation list in sync with jwt_tokens"""
+    start_background_job('jwt-revocation-sync', revocation_list.sync, interval)
+
+def revoke_token(token):
+    """Revoke an access or refresh token for every worker. Returns False if the token is not ours."""
+    from sqlalchemy import text
+    import uuid
+    
+    try:
+        payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM], options={'verify_exp': False})
+    except jwt.InvalidTokenError:
+        return False
+    
+    digest = token_digest(token)
+    revocation_list.add(digest, payload['exp'])
+    jwt_cache.discard(digest)
+    
+    if db_engine:
+        try:
+            with db_engine.begin() as conn:
+                conn.execute(text("""
+                    INSERT INTO jwt_tokens (id, user_id, token_type, token_hash, expires_at, is_revoked, revoked_at)
+                    VALUES (:id, :user_id, :token_type, :token_hash, to_timestamp(:exp)::timestamp, TRUE, clock_timestamp())
+                    ON CONFLICT (token_hash) DO UPDATE
+                    SET is_revoked = TRUE, revoked_at = clock_timestamp()
+                """), {
+                    'id': str(uuid.uuid4()),
+                    'user_id': payload['user_id'],
+                    'token_type': payload.get('type', 'access'),
+                    'token_hash': digest,
+                    'exp': payload['exp']
+                })
+        except Exception as e:
+            print(f"Failed to record token revocation: {e}", flush=True)
+    
+    return True
+
+def is_token_revoked(token):
+    """Check a token against the in-memory revocation list (no database lookup)"""
+    return revocation_list.is_revoked(token_digest(token))
+
 def get_token_from_request():
     """Extract JWT token from request headers"""
     auth_header = request.headers.get('Authorization')
@@ -75,19 +322,15 @@ def jwt_required(f):
                 "msg": "Authentication token is required"
             }), 401
         
-        payload = verify_jwt_token(token)
-        if not payload:
+        claims = get_current_user_claims(token)
+        if not claims:
             return jsonify({
                 "ok": False,
                 "msg": "Invalid or expired token"
             }), 401
         
         # Store user info in Flask's g object for use in the route
-        g.current_user = {
-            'user_id': payload['user_id'],
-            'user_type': payload['user_type'],
-            'email': payload['email']
-        }
+        g.current_user = dict(claims)
         
         return f(*args, **kwargs)
     return decorated_function
@@ -98,18 +341,8 @@ def jwt_optional(f):
     def decorated_function(*args, **kwargs):
         token = get_token_from_request()
         
-        if token:
-            payload = verify_jwt_token(token)
-            if payload:
-                g.current_user = {
-                    'user_id': payload['user_id'],
-                    'user_type': payload['user_type'],
-                    'email': payload['email']
-                }
-            else:
-                g.current_user = None
-        else:
-            g.current_user = None
+        claims = get_current_user_claims(token) if token else None
+        g.current_user = dict(claims) if claims else None
         
         return f(*args, **kwargs)
     return decorated_function
@@ -245,8 +478,282 @@ def validate_priority(priority):
 
 # ============ RATE LIMITING ============
 
-# In-memory rate limiting store (in production, use Redis)
-rate_limit_store = {}
+# 'memory' (per process), 'database' (rate_limits table) or 'shm' (mmap file shared by workers on one host)
+RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'memory')
+RATE_LIMIT_MAX_KEYS = int(os.getenv('RATE_LIMIT_MAX_KEYS', '100000'))
+RATE_LIMIT_SHM_PATH = os.getenv('RATE_LIMIT_SHM_PATH', '/dev/shm/immican_rate_limits')
+RATE_LIMIT_SHM_SLOTS = int(os.getenv('RATE_LIMIT_SHM_SLOTS', '65536'))
+
+class RateLimitResult:
+    """Outcome of a rate limit check"""
+    __slots__ = ('allowed', 'limit', 'remaining', 'reset_after', 'retry_after')
+    
+    def __init__(self, allowed, limit, remaining, reset_after, retry_after):
+        self.allowed = allowed
+        self.limit = limit
+        self.remaining = remaining
+        self.reset_after = reset_after  # seconds until the key is fully replenished
+        self.retry_after = retry_after  # seconds until the next request is allowed (0 if allowed)
+
+def gcra_check(tat, now, max_requests, window_seconds):
+    """
+    Generic Cell Rate Algorithm step.
+    
+    The whole per-key state is one number, the theoretical arrival time (tat).
+    Returns (new_tat, RateLimitResult); new_tat is None when the request is denied.
+    """
+    interval = window_seconds / max_requests
+    tat = max(tat or now, now)
+    new_tat = tat + interval
+    allow_at = new_tat - window_seconds
+    
+    if now < allow_at:
+        return None, RateLimitResult(False, max_requests, 0, tat - now, allow_at - now)
+    
+    remaining = int((window_seconds - (new_tat - now)) // interval)
+    return new_tat, RateLimitResult(True, max_requests, remaining, new_tat - now, 0)
+
+def sliding_window_check(previous_count, current_count, elapsed, max_requests, window_seconds):
+    """
+    Sliding window estimate from two fixed-window counters.
+    
+    The previous window's count is weighted by how much of it still overlaps
+    the sliding window. current_count excludes the request being checked.
+    """
+    weight = 1 - elapsed / window_seconds
+    estimate = previous_count * weight + current_count
+    reset_after = window_seconds - elapsed
+    
+    if estimate + 1 > max_requests:
+        if current_count >= max_requests or not previous_count:
+            retry_after = reset_after
+        else:
+            # Time until the previous window has decayed enough to admit one more request
+            retry_after = window_seconds * (1 - (max_requests - 1 - current_count) / previous_count) - elapsed
+        return RateLimitResult(False, max_requests, 0, reset_after, max(retry_after, 0))
+    
+    remaining = max(0, int(max_requests - estimate - 1))
+    return RateLimitResult(True, max_requests, remaining, reset_after, 0)
+
+class InMemoryRateLimiter:
+    """
+    Thread-safe GCRA limiter for a single process.
+    
+    Each key stores a single float. Keys are kept in least-recently-used
+    order; fully replenished keys are dropped as they reach the front and
+    the total is capped at max_keys, so memory stays bounded no matter how
+    many distinct clients show up.
+    """
+    
+    def __init__(self, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._state = OrderedDict()  # key -> tat
+        self._lock = threading.Lock()
+    
+    def hit(self, scope, key, max_requests, window_seconds, now=None):
+        now = now if now is not None else time.time()
+        key = f"{scope}:{key}"
+        
+        with self._lock:
+            new_tat, result = gcra_check(self._state.get(key), now, max_requests, window_seconds)
+            if new_tat is not None:
+                self._state[key] = new_tat
+                self._state.move_to_end(key)
+            self._evict(now)
+        
+        return result
+    
+    def _evict(self, now):
+        """Drop idle keys from the LRU end (caller holds the lock)"""
+        state = self._state
+        while len(state) > self.max_keys:
+            state.popitem(last=False)
+        # Amortized O(1): only look at a couple of entries per call
+        for _ in range(2):
+            if not state:
+                break
+            key, tat = next(iter(state.items()))
+            if tat > now:
+                break
+            del state[key]
+    
+    def reset(self, key=None):
+        with self._lock:
+            if key is None:
+                self._state.clear()
+            else:
+                self._state.pop(key, None)
+    
+    def __len__(self):
+        return len(self._state)
+
+class DatabaseRateLimiter:
+    """
+    Rate limiter shared by every worker through the rate_limits table.
+    
+    Each (identifier, endpoint) gets one row per fixed window, bumped with an
+    atomic UPSERT; the previous window's row is read in the same statement to
+    form a sliding window estimate. Both the insert and the update only
+    count a request the estimate allows, so the stored count is exactly the
+    allowed requests. Old rows are removed with
+    cleanup_old_rate_limits() every cleanup_interval seconds.
+    """
+    
+    def __init__(self, engine, cleanup_interval=300):
+        self.engine = engine
+        self.cleanup_interval = cleanup_interval
+        self._last_cleanup = time.time()
+    
+    def hit(self, scope, key, max_requests, window_seconds, now=None):
+        from sqlalchemy import text
+        import uuid
+        
+        now = now if now is not None else time.time()
+        window_start = (now // window_seconds) * window_seconds
+        elapsed = now - window_start
+        
+        try:
+            with self.engine.begin() as conn:
+                row = conn.execute(text("""
+                    WITH prev AS (
+                        SELECT COALESCE(MAX(request_count), 0) AS n
+                        FROM rate_limits
+                        WHERE identifier = :identifier AND endpoint = :endpoint
+                          AND window_start = to_timestamp(:prev_start)::timestamp
+                    ), hit AS (
+                        INSERT INTO rate_limits (id, identifier, endpoint, request_count, window_start, window_duration, updated_at)
+                        SELECT :id, :identifier, :endpoint, 1, to_timestamp(:window_start)::timestamp, :window, NOW()
+                        WHERE (SELECT n FROM prev) * :weight < :max_requests
+                        ON CONFLICT (identifier, endpoint, window_start) DO UPDATE
+                        SET request_count = rate_limits.request_count + 1, updated_at = NOW()
+                        WHERE rate_limits.request_count + (SELECT n FROM prev) * :weight < :max_requests
+                        RETURNING request_count
+                    )
+                    SELECT (SELECT request_count FROM hit) AS current_count, (SELECT n FROM prev) AS previous_count
+                """), {
+                    'id': str(uuid.uuid4()),
+                    'identifier': key[:255],
+                    'endpoint': scope,
+                    'window_start': window_start,
+                    'prev_start': window_start - window_seconds,
+                    'window': window_seconds,
+                    'weight': 1 - elapsed / window_seconds,
+                    'max_requests': max_requests
+                }).fetchone()
+                
+                if now - self._last_cleanup > self.cleanup_interval:
+                    self._last_cleanup = now
+                    conn.execute(text("SELECT cleanup_old_rate_limits()"))
+        except Exception as e:
+            # Fail open: a database hiccup should not lock everyone out
+            print(f"Failed to check rate limit in database: {e}", flush=True)
+            return RateLimitResult(True, max_requests, max_requests, window_seconds, 0)
+        
+        if row.current_count is None:
+            # Conditional UPSERT refused to count this request
+            return sliding_window_check(row.previous_count, max_requests, elapsed, max_requests, window_seconds)
+        return sliding_window_check(row.previous_count, row.current_count - 1, elapsed, max_requests, window_seconds)
+
+class SharedMemoryRateLimiter:
+    """
+    Rate limiter shared by worker processes on the same host through an
+    mmap'ed file (on /dev/shm by default).
+    
+    The file is a fixed-size hash table split into buckets of BUCKET_SLOTS
+    slots; a key hashes to one bucket, which is locked with a byte-range
+    fcntl lock while it is read and updated. Each slot holds a key hash, a
+    window index and current/previous window counts for a sliding window
+    estimate. When a bucket is full the slot with the oldest window is reused,
+    so memory never grows.
+    """
+    SLOT = struct.Struct('<QqII')  # key hash, window index, current count, previous count
+    BUCKET_SLOTS = 8
+    
+    def __init__(self, path=RATE_LIMIT_SHM_PATH, slots=RATE_LIMIT_SHM_SLOTS):
+        import fcntl
+        import mmap
+        
+        self._fcntl = fcntl
+        self.num_buckets = max(1, slots // self.BUCKET_SLOTS)
+        self.bucket_bytes = self.BUCKET_SLOTS * self.SLOT.size
+        size = self.num_buckets * self.bucket_bytes
+        
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+        self._mm = mmap.mmap(self._fd, size)
+        # fcntl locks are per process, so threads in this process also need a lock
+        self._lock = threading.Lock()
+    
+    def hit(self, scope, key, max_requests, window_seconds, now=None):
+        now = now if now is not None else time.time()
+        key_hash = int.from_bytes(
+            hashlib.blake2b(f"{scope}:{key}".encode(), digest_size=8).digest(), 'little'
+        ) | 1  # 0 marks an empty slot
+        window = int(now // window_seconds)
+        elapsed = now - window * window_seconds
+        base = (key_hash % self.num_buckets) * self.bucket_bytes
+        
+        with self._lock:
+            self._fcntl.lockf(self._fd, self._fcntl.LOCK_EX, self.bucket_bytes, base)
+            try:
+                offset, current, previous = self._find_slot(base, key_hash, window)
+                result = sliding_window_check(previous, current, elapsed, max_requests, window_seconds)
+                if result.allowed:
+                    current += 1
+                self.SLOT.pack_into(self._mm, offset, key_hash, window, current, previous)
+            finally:
+                self._fcntl.lockf(self._fd, self._fcntl.LOCK_UN, self.bucket_bytes, base)
+        
+        return result
+    
+    def _find_slot(self, base, key_hash, window):
+        """Return (offset, current, previous) for key_hash, claiming a slot if needed"""
+        victim, victim_window = base, None
+        for i in range(self.BUCKET_SLOTS):
+            offset = base + i * self.SLOT.size
+            slot_hash, slot_window, current, previous = self.SLOT.unpack_from(self._mm, offset)
+            if slot_hash == key_hash:
+                if slot_window == window:
+                    return offset, current, previous
+                if slot_window == window - 1:
+                    return offset, 0, current
+                return offset, 0, 0
+            if victim_window is None or slot_window < victim_window:
+                victim, victim_window = offset, slot_window
+        return victim, 0, 0
+    
+    def close(self):
+        self._mm.close()
+        os.close(self._fd)
+
+def create_rate_limiter(backend=RATE_LIMIT_BACKEND, engine=None):
+    """Build the rate limiter backend selected by RATE_LIMIT_BACKEND"""
+    if backend == 'database':
+        if engine is None:
+            raise ValueError("The database rate limit backend needs a database engine")
+        return DatabaseRateLimiter(engine)
+    if backend == 'shm':
+        return SharedMemoryRateLimiter()
+    if backend == 'memory':
+        return InMemoryRateLimiter()
+    raise ValueError(f"Unknown rate limit backend: {backend}")
+
+# The database backend is installed by set_db_engine once an engine exists
+rate_limiter = create_rate_limiter('memory' if RATE_LIMIT_BACKEND == 'database' else RATE_LIMIT_BACKEND)
+
+def set_rate_limiter(limiter):
+    """Swap the rate limiter backend used by the rate_limit decorator"""
+    global rate_limiter
+    rate_limiter = limiter
+
+def _rate_limit_headers(response, result):
+    response.headers['X-RateLimit-Limit'] = str(result.limit)
+    response.headers['X-RateLimit-Remaining'] = str(result.remaining)
+    response.headers['X-RateLimit-Reset'] = str(math.ceil(result.reset_after))
+    if not result.allowed:
+        response.headers['Retry-After'] = str(max(1, math.ceil(result.retry_after)))
+    return response
 
 def rate_limit(max_requests=10, window_seconds=60, key_func=None):
     """
@@ -257,6 +764,10 @@ def rate_limit(max_requests=10, window_seconds=60, key_func=None):
         window_seconds: Time window in seconds
         key_func: Function to generate rate limit key (defaults to IP address)
     
+    Limits are tracked per endpoint and enforced by the configured backend
+    (see set_rate_limiter). Responses carry X-RateLimit-* headers, and
+    Retry-After when the limit is exceeded.
+    
     Note: Registration endpoints should NOT use rate limiting to allow legitimate users
     to register without restrictions. Rate limiting is primarily for login and API endpoints.
     """
@@ -269,30 +780,17 @@ def rate_limit(max_requests=10, window_seconds=60, key_func=None):
             else:
                 key = request.remote_addr or 'unknown'
             
-            # Get current time
-            now = time.time()
+            result = rate_limiter.hit(f.__name__, key, max_requests, window_seconds)
             
-            # Initialize or get existing requests for this key
-            if key not in rate_limit_store:
-                rate_limit_store[key] = []
-            
-            # Remove old requests outside the window
-            rate_limit_store[key] = [
-                req_time for req_time in rate_limit_store[key]
-                if now - req_time < window_seconds
-            ]
-            
-            # Check if limit exceeded
-            if len(rate_limit_store[key]) >= max_requests:
-                return jsonify({
+            if not result.allowed:
+                response = jsonify({
                     "ok": False,
                     "msg": f"Rate limit exceeded. Maximum {max_requests} requests per {window_seconds} seconds."
-                }), 429
-            
-            # Add current request
-            rate_limit_store[key].append(now)
+                })
+                response.status_code = 429
+                return _rate_limit_headers(response, result)
             
-            return f(*args, **kwargs)
+            return _rate_limit_headers(make_response(f(*args, **kwargs)), result)
         return decorated_function
     return decorator
 
@@ -333,6 +831,176 @@ def verify_password_secure(password, hashed_password, salt):
     computed_hash, _ = hash_password_secure(password, salt)
     return computed_hash == hashed_password
 
+# ============ PASSWORD HASHING ENGINE ============
+
+# Scheme used for new hashes; stored hashes in any known scheme still verify
+PASSWORD_HASH_SCHEME = os.getenv('PASSWORD_HASH_SCHEME', 'pbkdf2-sha256')
+PBKDF2_ITERATIONS = int(os.getenv('PBKDF2_ITERATIONS', '600000'))
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', '12'))
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', str(os.cpu_count() or 2)))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv('PASSWORD_HASH_MAX_PENDING', '64'))
+PASSWORD_HASH_TIMEOUT = float(os.getenv('PASSWORD_HASH_TIMEOUT', '10'))  # seconds
+
+class PasswordHasherBusy(Exception):
+    """Raised when too many hash/verify jobs are already waiting, or one waited past the timeout"""
+
+class Sha256LegacyHasher:
+    """Unsalted SHA-256 hex digest used by accounts created before the hashing engine"""
+    name = 'sha256-legacy'
+    
+    def identify(self, stored):
+        return len(stored) == 64 and all(c in '0123456789abcdef' for c in stored)
+    
+    def hash(self, password):
+        return hashlib.sha256(password.encode()).hexdigest()
+    
+    def verify(self, password, stored):
+        return hmac.compare_digest(self.hash(password), stored)
+    
+    def needs_update(self, stored):
+        return True
+
+class Pbkdf2Hasher:
+    """PBKDF2-HMAC-SHA256 via hashlib: $pbkdf2-sha256$<iterations>$<salt>$<hash> (base64)"""
+    name = 'pbkdf2-sha256'
+    prefix = '$pbkdf2-sha256$'
+    
+    def __init__(self, iterations=PBKDF2_ITERATIONS):
+        self.iterations = iterations
+    
+    def identify(self, stored):
+        return stored.startswith(self.prefix)
+    
+    def _derive(self, password, salt, iterations):
+        return hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+    
+    def hash(self, password):
+        salt = secrets.token_bytes(16)
+        derived = self._derive(password, salt, self.iterations)
+        return f"{self.prefix}{self.iterations}${_b64(salt)}${_b64(derived)}"
+    
+    def _parse(self, stored):
+        iterations, salt, derived = stored[len(self.prefix):].split('$')
+        return int(iterations), _unb64(salt), _unb64(derived)
+    
+    def verify(self, password, stored):
+        try:
+            iterations, salt, derived = self._parse(stored)
+        except ValueError:
+            return False
+        return hmac.compare_digest(self._derive(password, salt, iterations), derived)
+    
+    def needs_update(self, stored):
+        try:
+            return self._parse(stored)[0] < self.iterations
+        except ValueError:
+            return True
+
+class PasslibHasher:
+    """bcrypt / argon2 through passlib (argon2 also needs argon2-cffi installed)"""
+    
+    def __init__(self, name, prefixes, **settings):
+        self.name = name
+        self.prefixes = prefixes
+        self.settings = settings
+        self._handler = None
+    
+    @property
+    def handler(self):
+        if self._handler is None:
+            from passlib import hash as passlib_hash
+            self._handler = getattr(passlib_hash, self.name).using(**self.settings)
+        return self._handler
+    
+    def identify(self, stored):
+        return stored.startswith(self.prefixes)
+    
+    def hash(self, password):
+        return self.handler.hash(password)
+    
+    def verify(self, password, stored):
+        return self.handler.verify(password, stored)
+    
+    def needs_update(self, stored):
+        return self.handler.needs_update(stored)
+
+def _b64(raw):
+    return base64.b64encode(raw).decode().rstrip('=')
+
+def _unb64(text):
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+PASSWORD_HASHERS = {
+    'pbkdf2-sha256': Pbkdf2Hasher(),
+    'bcrypt': PasslibHasher('bcrypt', ('$2a$', '$2b$', '$2y$'), rounds=BCRYPT_ROUNDS),
+    'argon2': PasslibHasher('argon2', ('$argon2',)),
+    'sha256-legacy': Sha256LegacyHasher()
+}
+
+class PasswordHashingEngine:
+    """
+    Hashes and verifies passwords on a bounded worker pool.
+    
+    At most `workers` hashes run at once and at most `max_pending` may be
+    queued; beyond that PasswordHasherBusy is raised instead of piling up
+    request threads. verify() also reports whether the stored hash should be
+    upgraded to the current scheme/cost.
+    """
+    
+    def __init__(self, scheme=PASSWORD_HASH_SCHEME, workers=PASSWORD_HASH_WORKERS,
+                 max_pending=PASSWORD_HASH_MAX_PENDING, timeout=PASSWORD_HASH_TIMEOUT):
+        if scheme not in PASSWORD_HASHERS or scheme == 'sha256-legacy':
+            raise ValueError(f"Unsupported password hash scheme: {scheme}")
+        self.scheme = scheme
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self._slots = threading.BoundedSemaphore(max_pending)
+    
+    def _run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            raise PasswordHasherBusy("Too many password hashing requests in progress")
+        try:
+            future = self._executor.submit(func, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()  # still queued: give its slot back instead of hashing for nobody
+            raise PasswordHasherBusy(f"Password hashing did not finish within {self.timeout}s")
+    
+    def identify(self, stored):
+        """Return the hasher that produced a stored hash, or None"""
+        for hasher in PASSWORD_HASHERS.values():
+            if hasher.identify(stored):
+                return hasher
+        return None
+    
+    def hash(self, password):
+        return self._run(PASSWORD_HASHERS[self.scheme].hash, password)
+    
+    def verify(self, password, stored):
+        """Return (is_valid, needs_rehash)"""
+        hasher = self.identify(stored or '')
+        if hasher is None:
+            return False, False
+        
+        if not self._run(hasher.verify, password, stored):
+            return False, False
+        return True, hasher.name != self.scheme or hasher.needs_update(stored)
+
+password_engine = PasswordHashingEngine()
+
+def hash_password(password):
+    """Hash a password with the configured scheme"""
+    return password_engine.hash(password)
+
+def verify_password(password, stored):
+    """Verify a password; returns (is_valid, needs_rehash)"""
+    return password_engine.verify(password, stored)
+
 # ============ VALIDATION DECORATORS ============
 
 def validate_json_input(required_fields=None, optional_fields=None):
@@ -387,10 +1055,229 @@ def set_db_engine(engine):
     """Set the database engine for security logging"""
     global db_engine
     db_engine = engine
+    
+    if RATE_LIMIT_BACKEND == 'database':
+        set_rate_limiter(create_rate_limiter('database', engine))
+
+# ============ SECURITY EVENT PIPELINE ============
+
+# Events are queued in memory and written by a background thread in batches,
+# so API requests don't pay for an extra INSERT + commit each.
+SECURITY_EVENT_QUEUE_SIZE = int(os.getenv('SECURITY_EVENT_QUEUE_SIZE', '10000'))
+SECURITY_EVENT_BATCH_SIZE = int(os.getenv('SECURITY_EVENT_BATCH_SIZE', '500'))
+SECURITY_EVENT_FLUSH_INTERVAL = float(os.getenv('SECURITY_EVENT_FLUSH_INTERVAL', '1.0'))  # seconds
+SECURITY_EVENT_MAX_RETRIES = int(os.getenv('SECURITY_EVENT_MAX_RETRIES', '3'))  # per batch, for connection-level errors
+
+# Lowest severity is evicted first when the queue is full; CRITICAL is never dropped
+SEVERITY_LEVELS = ['INFO', 'WARNING', 'ERROR', 'CRITICAL']
+
+SECURITY_EVENT_COLUMNS = [
+    'id', 'event_type', 'description', 'user_id', 'ip_address',
+    'user_agent', 'severity', 'request_path', 'request_method', 'created_at'
+]
+
+class SecurityEventWriter:
+    """
+    Bounded in-process queue with a writer thread that flushes security events
+    to the database using multi-row INSERTs.
+    
+    Overflow policy: when the queue is full the oldest event of the lowest
+    severity (INFO first) is dropped to make room, as long as it is not more
+    severe than the incoming event. CRITICAL events are never dropped, even if
+    that means temporarily exceeding max_size.
+    
+    Write failures: a batch that fails for a connection-level reason is
+    retried with backoff up to max_retries times, then counted as failed.
+    A batch that a row rejects (integrity or data error, e.g. a user_id
+    deleted meanwhile) is split in halves until the bad rows are isolated,
+    so only those are lost; they are counted as invalid.
+    """
+    
+    def __init__(self, max_size=SECURITY_EVENT_QUEUE_SIZE, batch_size=SECURITY_EVENT_BATCH_SIZE,
+                 flush_interval=SECURITY_EVENT_FLUSH_INTERVAL, max_retries=SECURITY_EVENT_MAX_RETRIES):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self._lanes = {level: deque() for level in SEVERITY_LEVELS}
+        self._size = 0
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stopping = False
+        self.stats = {'queued': 0, 'flushed': 0, 'dropped': 0, 'failed': 0, 'invalid': 0,
+                      'retries': 0, 'batches': 0}
+    
+    def start(self):
+        """Start the writer thread (idempotent)"""
+        with self._cond:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name='security-event-writer', daemon=True)
+            self._thread.start()
+    
+    def enqueue(self, log_entry):
+        """Queue an event for writing. Returns False if the event was dropped."""
+        severity = log_entry.get('severity')
+        if severity not in self._lanes:
+            severity = 'INFO'
+        
+        with self._cond:
+            if self._size >= self.max_size and severity != 'CRITICAL':
+                if not self._evict(up_to=severity):
+                    self.stats['dropped'] += 1
+                    return False
+            elif self._size >= self.max_size:
+                # CRITICAL: make room if possible, otherwise grow past the bound
+                self._evict(up_to='ERROR')
+            
+            self._lanes[severity].append(log_entry)
+            self._size += 1
+            self.stats['queued'] += 1
+            
+            if self._size >= self.batch_size:
+                self._cond.notify()
+        
+        if self._thread is None or not self._thread.is_alive():
+            self.start()
+        return True
+    
+    def _evict(self, up_to):
+        """Drop the oldest event of the lowest severity <= up_to (caller holds the lock)"""
+        for level in SEVERITY_LEVELS[:SEVERITY_LEVELS.index(up_to) + 1]:
+            if self._lanes[level]:
+                self._lanes[level].popleft()
+                self._size -= 1
+                self.stats['dropped'] += 1
+                return True
+        return False
+    
+    def _take_batch(self):
+        """Pop up to batch_size events, most severe first (caller holds the lock)"""
+        batch = []
+        for level in reversed(SEVERITY_LEVELS):
+            lane = self._lanes[level]
+            while lane and len(batch) < self.batch_size:
+                batch.append(lane.popleft())
+        self._size -= len(batch)
+        return batch
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._size < self.batch_size and not self._stopping:
+                    self._cond.wait(self.flush_interval)
+                batch = self._take_batch()
+                stopping = self._stopping
+            
+            if batch:
+                self._write(batch)
+            elif stopping:
+                return
+    
+    def _write(self, batch):
+        """Write a batch, retrying connection errors and isolating rows the database rejects"""
+        from sqlalchemy.exc import IntegrityError, DataError
+        
+        if not db_engine:
+            with self._cond:
+                self.stats['failed'] += len(batch)
+            return
+        
+        for attempt in range(self.max_retries + 1):
+            try:
+                self._insert(batch)
+            except (IntegrityError, DataError) as e:
+                if len(batch) == 1:
+                    with self._cond:
+                        self.stats['invalid'] += 1
+                    print(f"Dropped invalid security event {batch[0].get('id')}: {e}", flush=True)
+                    return
+                middle = len(batch) // 2
+                self._write(batch[:middle])
+                self._write(batch[middle:])
+                return
+            except Exception as e:
+                print(f"Failed to write {len(batch)} security events to database "
+                      f"(attempt {attempt + 1}): {e}", flush=True)
+                if attempt == self.max_retries or self._stopping:
+                    break
+                with self._cond:
+                    self.stats['retries'] += 1
+                time.sleep(min(0.1 * 2 ** attempt, 5.0))
+                continue
+            
+            with self._cond:
+                self.stats['flushed'] += len(batch)
+                self.stats['batches'] += 1
+            return
+        
+        with self._cond:
+            self.stats['failed'] += len(batch)
+    
+    def _insert(self, batch):
+        """
+        One multi-row INSERT for the batch.
+        
+        created_at is written in database time: the event's age on this host
+        is subtracted from statement_timestamp(), so it lines up with the
+        NOW()-based rollup watermark even if this host's timezone differs.
+        """
+        from sqlalchemy import text
+        
+        now = datetime.now()
+        params = {}
+        rows = []
+        for i, entry in enumerate(batch):
+            values = []
+            for col in SECURITY_EVENT_COLUMNS:
+                if col == 'created_at':
+                    values.append(f"statement_timestamp()::timestamp - make_interval(secs => :age_{i})")
+                    params[f"age_{i}"] = max((now - (entry.get(col) or now)).total_seconds(), 0.0)
+                else:
+                    values.append(f":{col}_{i}")
+                    params[f"{col}_{i}"] = entry.get(col)
+            rows.append("(" + ", ".join(values) + ")")
+        
+        with db_engine.begin() as conn:
+            conn.execute(text(
+                f"INSERT INTO security_events ({', '.join(SECURITY_EVENT_COLUMNS)}) VALUES "
+                + ", ".join(rows)
+            ), params)
+    
+    def flush(self, timeout=5.0):
+        """Wait until everything queued so far has been handed to the writer"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            with self._cond:
+                if self._size == 0:
+                    return True
+                self._cond.notify()
+            time.sleep(0.01)
+        return False
+    
+    def stop(self, timeout=5.0):
+        """Flush remaining events and stop the writer thread"""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout)
+    
+    def get_stats(self):
+        """Counters for queued, flushed, dropped, failed and invalid events plus current depth"""
+        with self._cond:
+            return dict(self.stats, pending=self._size, max_size=self.max_size)
+
+security_event_writer = SecurityEventWriter()
+atexit.register(security_event_writer.stop)
+
+def get_event_pipeline_stats():
+    """Get security event pipeline counters"""
+    return security_event_writer.get_stats()
 
 def log_security_event(event_type, description, user_id=None, ip_address=None, severity='INFO'):
-    """Enhanced security event logging to database"""
-    from sqlalchemy import text
+    """Enhanced security event logging to database (written asynchronously in batches)"""
     import uuid
     
     timestamp = datetime.now()
@@ -412,18 +1299,9 @@ def log_security_event(event_type, description, user_id=None, ip_address=None, s
         'created_at': timestamp
     }
     
-    # Store in database if engine is available
+    # Queue for the background writer if engine is available
     if db_engine:
-        try:
-            with db_engine.begin() as conn:
-                conn.execute(text("""
-                    INSERT INTO security_events (id, event_type, description, user_id, ip_address, 
-                                               user_agent, severity, request_path, request_method, created_at)
-                    VALUES (:id, :event_type, :description, :user_id, :ip_address, :user_agent, 
-                           :severity, :request_path, :request_method, :created_at)
-                """), log_entry)
-        except Exception as e:
-            print(f"Failed to log security event to database: {e}", flush=True)
+        security_event_writer.enqueue(log_entry)
     
     # Check for suspicious patterns
     check_suspicious_activity(log_entry)
@@ -440,111 +1318,364 @@ def log_security_event(event_type, description, user_id=None, ip_address=None, s
     
     return log_entry
 
+# ============ SUSPICIOUS ACTIVITY DETECTION ============
+
+# Same thresholds as before, evaluated over a sliding 5 minute window
+SUSPICIOUS_WINDOW_SECONDS = 300
+SUSPICIOUS_BUCKET_SECONDS = 10
+SUSPICIOUS_MAX_TRACKED_IPS = int(os.getenv('SUSPICIOUS_MAX_TRACKED_IPS', '50000'))
+SUSPICIOUS_THRESHOLDS = {
+    'LOGIN_FAILURE': 5,
+    'REGISTRATION_FAILURE': 3,
+    '*': 20  # all events from the IP
+}
+
+class _IpWindow:
+    """Per-IP ring buffers of event counts, one slot per time bucket"""
+    __slots__ = ('last_epoch', 'counts', 'totals')
+    
+    def __init__(self, num_buckets, epoch):
+        self.last_epoch = epoch
+        self.counts = {key: [0] * num_buckets for key in SUSPICIOUS_THRESHOLDS}
+        self.totals = {key: 0 for key in SUSPICIOUS_THRESHOLDS}
+
+class SuspiciousActivityDetector:
+    """
+    Streaming detector that keeps per-IP, per-event-type counters in
+    time-bucketed ring buffers. Each event costs O(1): advancing the window
+    clears at most num_buckets slots, and only threshold crossings touch the
+    database. A pattern is reported once per IP per window, not on every
+    subsequent event.
+    
+    Counters are per process; with several workers each one sees its own share.
+    """
+    
+    def __init__(self, window_seconds=SUSPICIOUS_WINDOW_SECONDS, bucket_seconds=SUSPICIOUS_BUCKET_SECONDS,
+                 thresholds=None, max_ips=SUSPICIOUS_MAX_TRACKED_IPS):
+        self.bucket_seconds = bucket_seconds
+        self.num_buckets = max(1, window_seconds // bucket_seconds)
+        self.window_seconds = self.num_buckets * bucket_seconds
+        self.thresholds = thresholds or SUSPICIOUS_THRESHOLDS
+        self.max_ips = max_ips
+        self._windows = OrderedDict()  # ip -> _IpWindow, least recently seen first
+        self._reported = {}  # (ip, key) -> time the pattern was last reported
+        self._lock = threading.Lock()
+    
+    def _advance(self, window, epoch):
+        """Expire buckets that fell out of the window since the last event"""
+        steps = min(epoch - window.last_epoch, self.num_buckets)
+        for e in range(epoch - steps + 1, epoch + 1):
+            idx = e % self.num_buckets
+            for key, ring in window.counts.items():
+                window.totals[key] -= ring[idx]
+                ring[idx] = 0
+        window.last_epoch = max(window.last_epoch, epoch)
+    
+    def record(self, ip, event_type, now=None):
+        """
+        Count an event and return the newly crossed patterns as a list of
+        (key, count, total) tuples. Already-reported patterns are suppressed
+        until the window has passed.
+        """
+        now = now if now is not None else time.time()
+        epoch = int(now // self.bucket_seconds)
+        idx = epoch % self.num_buckets
+        detected = []
+        
+        with self._lock:
+            window = self._windows.get(ip)
+            if window is None:
+                window = _IpWindow(self.num_buckets, epoch)
+                self._windows[ip] = window
+                if len(self._windows) > self.max_ips:
+                    old_ip, _ = self._windows.popitem(last=False)
+                    for key in self.thresholds:
+                        self._reported.pop((old_ip, key), None)
+            else:
+                self._windows.move_to_end(ip)
+                if epoch > window.last_epoch:
+                    self._advance(window, epoch)
+            
+            for key in (event_type, '*'):
+                if key in window.counts:
+                    window.counts[key][idx] += 1
+                    window.totals[key] += 1
+            
+            total = window.totals['*']
+            for key in (event_type, '*'):
+                threshold = self.thresholds.get(key)
+                if threshold is None or window.totals[key] < threshold:
+                    continue
+                last = self._reported.get((ip, key))
+                if last is not None and now - last < self.window_seconds:
+                    continue
+                self._reported[(ip, key)] = now
+                detected.append((key, window.totals[key], total))
+        
+        return detected
+    
+    def tracked_ips(self):
+        with self._lock:
+            return len(self._windows)
+
+suspicious_activity_detector = SuspiciousActivityDetector()
+
+def _describe_pattern(key, count, ip):
+    if key == 'LOGIN_FAILURE':
+        return f"Multiple failed logins ({count}) from IP {ip}"
+    if key == 'REGISTRATION_FAILURE':
+        return f"Multiple registration failures ({count}) from IP {ip}"
+    return f"High request frequency ({count} requests in 5 minutes) from IP {ip}"
+
 def check_suspicious_activity(log_entry):
-    """Detect suspicious activity patterns using database"""
+    """Detect suspicious activity patterns in memory; only detections are written to the database"""
     from sqlalchemy import text
     import uuid
     
-    if not db_engine:
+    ip = log_entry['ip_address']
+    detected = suspicious_activity_detector.record(ip, log_entry['event_type'])
+    
+    if not detected or not db_engine:
         return
     
-    ip = log_entry['ip_address']
-    event_type = log_entry['event_type']
+    try:
+        with db_engine.begin() as conn:
+            for key, count, total in detected:
+                pattern = _describe_pattern(key, count, ip)
+                suspicious_activity = {
+                    'id': str(uuid.uuid4()),
+                    'pattern': pattern,
+                    'ip_address': ip,
+                    'event_count': total,
+                    'severity': 'HIGH',
+                    'description': f"Suspicious activity detected: {pattern}"
+                }
+                
+                conn.execute(text("""
+                    INSERT INTO suspicious_activities (id, pattern, ip_address, event_count, severity, description, created_at)
+                    VALUES (:id, :pattern, :ip_address, :event_count, :severity, :description, NOW())
+                """), suspicious_activity)
+                
+                print(f"🚨 SUSPICIOUS ACTIVITY DETECTED: {pattern}", flush=True)
+                
+    except Exception as e:
+        print(f"Failed to record suspicious activity: {e}", flush=True)
+
+# ============ SECURITY METRICS ============
+
+SECURITY_METRICS_ROLLUP_INTERVAL = int(os.getenv('SECURITY_METRICS_ROLLUP_INTERVAL', '60'))  # seconds
+# Must stay above SECURITY_EVENT_FLUSH_INTERVAL so queued events are not skipped
+SECURITY_METRICS_ROLLUP_LAG = int(os.getenv('SECURITY_METRICS_ROLLUP_LAG', '60'))  # seconds
+
+def rollup_security_metrics():
+    """Fold new security_events rows into the hourly/daily security_metrics buckets"""
+    from sqlalchemy import text
+    
+    if not db_engine:
+        return 0
     
     try:
         with db_engine.begin() as conn:
-            # Count recent events from same IP (last 5 minutes)
-            recent_events_result = conn.execute(text("""
-                SELECT event_type, COUNT(*) as count
-                FROM security_events 
-                WHERE ip_address = :ip AND created_at > NOW() - INTERVAL '5 minutes'
-                GROUP BY event_type
-            """), {"ip": ip}).fetchall()
-            
-            # Count total recent events
-            total_events_result = conn.execute(text("""
-                SELECT COUNT(*) as total
-                FROM security_events 
-                WHERE ip_address = :ip AND created_at > NOW() - INTERVAL '5 minutes'
-            """), {"ip": ip}).fetchone()
-            
-            total_recent_events = total_events_result.total if total_events_result else 0
-            
-            # Detect suspicious patterns
-            suspicious_patterns = []
-            
-            # Check for specific event types
-            for row in recent_events_result:
-                if row.event_type == 'LOGIN_FAILURE' and row.count >= 5:
-                    suspicious_patterns.append(f"Multiple failed logins ({row.count}) from IP {ip}")
-                elif row.event_type == 'REGISTRATION_FAILURE' and row.count >= 3:
-                    suspicious_patterns.append(f"Multiple registration failures ({row.count}) from IP {ip}")
-            
-            # High frequency of requests
-            if total_recent_events >= 20:
-                suspicious_patterns.append(f"High request frequency ({total_recent_events} requests in 5 minutes) from IP {ip}")
-            
-            # Log suspicious activities to database
-            if suspicious_patterns:
-                for pattern in suspicious_patterns:
-                    suspicious_activity = {
-                        'id': str(uuid.uuid4()),
-                        'pattern': pattern,
-                        'ip_address': ip,
-                        'event_count': total_recent_events,
-                        'severity': 'HIGH',
-                        'description': f"Suspicious activity detected: {pattern}",
-                        'created_at': datetime.now()
-                    }
-                    
-                    conn.execute(text("""
-                        INSERT INTO suspicious_activities (id, pattern, ip_address, event_count, severity, description, created_at)
-                        VALUES (:id, :pattern, :ip_address, :event_count, :severity, :description, :created_at)
-                    """), suspicious_activity)
-                    
-                    print(f"🚨 SUSPICIOUS ACTIVITY DETECTED: {pattern}", flush=True)
-                    
+            return conn.execute(text(
+                "SELECT rollup_security_events(make_interval(secs => :lag))"
+            ), {"lag": SECURITY_METRICS_ROLLUP_LAG}).scalar() or 0
     except Exception as e:
-        print(f"Failed to check suspicious activity: {e}", flush=True)
+        print(f"Failed to roll up security metrics: {e}", flush=True)
+        return 0
+
+_background_jobs = {}
+
+def start_background_job(name, func, interval):
+    """Run func every `interval` seconds in a daemon thread (one thread per name)"""
+    job = _background_jobs.get(name)
+    if job and job.is_alive():
+        return
+    
+    def run():
+        while True:
+            try:
+                func()
+            except Exception as e:
+                print(f"Background job {name} failed: {e}", flush=True)
+            time.sleep(interval)
+    
+    job = threading.Thread(target=run, name=name, daemon=True)
+    _background_jobs[name] = job
+    job.start()
+
+def start_metrics_rollup(interval=SECURITY_METRICS_ROLLUP_INTERVAL):
+    """Roll up security metrics every `interval` seconds in the background"""
+    start_background_job('security-metrics-rollup', rollup_security_metrics, interval)
+
+def _add_counts(target, counts, weight=1.0):
+    for key, value in (counts or {}).items():
+        target[key] = target.get(key, 0) + value * weight
+
+def _top(counts, limit):
+    return sorted(((k, round(v)) for k, v in counts.items()), key=lambda x: x[1], reverse=True)[:limit]
 
 def get_security_metrics():
-    """Get security metrics for monitoring"""
-    now = datetime.now()
-    last_hour = now - timedelta(hours=1)
-    last_day = now - timedelta(days=1)
+    """
+    Get security metrics for monitoring.
     
-    recent_events = [e for e in security_events if datetime.fromisoformat(e['timestamp']) > last_hour]
-    daily_events = [e for e in security_events if datetime.fromisoformat(e['timestamp']) > last_day]
+    Answers from the hourly/daily rollups in security_metrics plus a live
+    tail of security_events newer than the rollup watermark, so the cost does
+    not depend on the size of security_events. The oldest hourly bucket in a
+    window is prorated by how much of it falls inside the window.
+    """
+    from sqlalchemy import text
     
     metrics = {
-        'total_events': len(security_events),
-        'events_last_hour': len(recent_events),
-        'events_last_day': len(daily_events),
-        'suspicious_activities': len(suspicious_activities),
-        'recent_suspicious': len([a for a in suspicious_activities if datetime.fromisoformat(a['timestamp']) > last_hour]),
-        'top_ips': get_top_ips(recent_events),
-        'event_types': get_event_type_counts(recent_events)
+        'total_events': 0,
+        'events_last_hour': 0,
+        'events_last_day': 0,
+        'suspicious_activities': 0,
+        'recent_suspicious': 0,
+        'top_ips': [],
+        'event_types': {},
+        'severity': {},
+        'rolled_up_to': None
     }
     
+    if not db_engine:
+        return metrics
+    
+    with db_engine.connect() as conn:
+        now = conn.execute(text("SELECT NOW()::timestamp")).scalar()
+        watermark = conn.execute(text("""
+            SELECT last_processed FROM security_metrics_watermark WHERE name = 'security_events'
+        """)).scalar()
+        
+        hours = conn.execute(text("""
+            SELECT period_start, metric_value, metadata
+            FROM security_metrics
+            WHERE metric_type = 'security_events' AND time_period = 'hour'
+              AND period_start > :since
+        """), {"since": now - timedelta(hours=25)}).fetchall()
+        
+        rolled_up_total = conn.execute(text("""
+            SELECT COALESCE(SUM(metric_value), 0)
+            FROM security_metrics
+            WHERE metric_type = 'security_events' AND time_period = 'day'
+        """)).scalar()
+        
+        # Events not rolled up yet (at most a couple of rollup intervals' worth)
+        tail = conn.execute(text("""
+            SELECT event_type, COALESCE(severity, 'INFO') AS severity,
+                   COALESCE(ip_address, 'unknown') AS ip_address, COUNT(*) AS count
+            FROM security_events
+            WHERE created_at >= :since
+            GROUP BY 1, 2, 3
+        """), {"since": watermark or now - timedelta(days=1)}).fetchall()
+        
+        suspicious = conn.execute(text("""
+            SELECT COUNT(*) AS total,
+                   COUNT(*) FILTER (WHERE created_at > NOW() - INTERVAL '1 hour') AS recent
+            FROM suspicious_activities
+        """)).fetchone()
+    
+    hour_start = now - timedelta(hours=1)
+    day_start = now - timedelta(days=1)
+    events_last_hour = 0.0
+    events_last_day = 0.0
+    event_types, severity, ip_counts = {}, {}, {}
+    
+    for bucket in hours:
+        bucket_end = bucket.period_start + timedelta(hours=1)
+        day_weight = min(1.0, max(0.0, (bucket_end - day_start) / timedelta(hours=1)))
+        hour_weight = min(1.0, max(0.0, (bucket_end - hour_start) / timedelta(hours=1)))
+        events_last_day += bucket.metric_value * day_weight
+        if hour_weight > 0:
+            events_last_hour += bucket.metric_value * hour_weight
+            metadata = bucket.metadata or {}
+            _add_counts(event_types, metadata.get('event_types'), hour_weight)
+            _add_counts(severity, metadata.get('severity'), hour_weight)
+            _add_counts(ip_counts, metadata.get('top_ips'), hour_weight)
+    
+    tail_total = 0
+    for row in tail:
+        tail_total += row.count
+        _add_counts(event_types, {row.event_type: row.count})
+        _add_counts(severity, {row.severity: row.count})
+        _add_counts(ip_counts, {row.ip_address: row.count})
+    
+    metrics.update({
+        'total_events': int(rolled_up_total) + tail_total,
+        'events_last_hour': round(events_last_hour) + tail_total,
+        'events_last_day': round(events_last_day) + tail_total,
+        'suspicious_activities': suspicious.total,
+        'recent_suspicious': suspicious.recent,
+        'top_ips': _top(ip_counts, 10),
+        'event_types': {k: round(v) for k, v in event_types.items()},
+        'severity': {k: round(v) for k, v in severity.items()},
+        'rolled_up_to': watermark.isoformat() if watermark else None
+    })
+    
     return metrics
 
-def get_top_ips(events, limit=10):
-    """Get top IP addresses by event count"""
-    ip_counts = {}
-    for event in events:
-        ip = event['ip_address']
-        ip_counts[ip] = ip_counts.get(ip, 0) + 1
+# ============ LOG PARTITION MAINTENANCE ============
+
+LOG_PARTITION_MAINTENANCE_INTERVAL = int(os.getenv('LOG_PARTITION_MAINTENANCE_INTERVAL', '3600'))  # seconds
+
+def maintain_log_partitions():
+    """Create upcoming security_events/audit_log partitions and drop expired ones"""
+    from sqlalchemy import text
     
-    return sorted(ip_counts.items(), key=lambda x: x[1], reverse=True)[:limit]
+    if not db_engine:
+        return 0
+    
+    try:
+        with db_engine.begin() as conn:
+            return conn.execute(text("SELECT maintain_log_partitions()")).scalar() or 0
+    except Exception as e:
+        print(f"Failed to maintain log partitions: {e}", flush=True)
+        return 0
 
-def get_event_type_counts(events):
-    """Get event type counts"""
-    type_counts = {}
-    for event in events:
-        event_type = event['event_type']
-        type_counts[event_type] = type_counts.get(event_type, 0) + 1
+def start_partition_maintenance(interval=LOG_PARTITION_MAINTENANCE_INTERVAL):
+    """Maintain log partitions every `interval` seconds in the background"""
+    start_background_job('log-partition-maintenance', maintain_log_partitions, interval)
+
+def get_security_events(hours=1, event_type=None, ip_address=None, limit=100):
+    """
+    Get recent security events, newest first.
+    
+    The query is always bounded on created_at so only the partitions covering
+    the requested time range are scanned.
+    """
+    from sqlalchemy import text
+    
+    if not db_engine:
+        return []
+    
+    query = """
+        SELECT id, event_type, description, user_id, ip_address, severity,
+               request_path, request_method, created_at
+        FROM security_events
+        WHERE created_at >= NOW()::timestamp - make_interval(hours => :hours)
+    """
+    params = {"hours": hours, "limit": limit}
+    if event_type:
+        query += " AND event_type = :event_type"
+        params["event_type"] = event_type
+    if ip_address:
+        query += " AND ip_address = :ip_address"
+        params["ip_address"] = ip_address
+    query += " ORDER BY created_at DESC LIMIT :limit"
     
-    return type_counts
+    with db_engine.connect() as conn:
+        rows = conn.execute(text(query), params).fetchall()
+    
+    return [{
+        'id': row.id,
+        'event_type': row.event_type,
+        'description': row.description,
+        'user_id': row.user_id,
+        'ip_address': row.ip_address,
+        'severity': row.severity,
+        'request_path': row.request_path,
+        'request_method': row.request_method,
+        'created_at': row.created_at.isoformat() if row.created_at else None
+    } for row in rows]
 
 def log_api_request():
     """Log API request for monitoring"""
@@ -557,91 +1688,197 @@ def log_api_request():
 
 # ============ SESSION MANAGEMENT ============
 
-def create_session(user_id, user_type, email):
-    """Create a new session in database"""
-    from sqlalchemy import text
+SESSION_CACHE_TTL = float(os.getenv('SESSION_CACHE_TTL', '30'))  # seconds a cached session row is trusted
+SESSION_ACTIVITY_FLUSH_INTERVAL = float(os.getenv('SESSION_ACTIVITY_FLUSH_INTERVAL', '5'))  # max last_activity staleness
+SESSION_CACHE_MAX_SIZE = int(os.getenv('SESSION_CACHE_MAX_SIZE', '10000'))
+
+def _new_session(user_id, user_type, email):
+    """Column values for a new active_sessions row (written by login_attempt())"""
     import uuid
     
-    session_id = str(uuid.uuid4())
     created_at = datetime.now()
-    expires_at = created_at + timedelta(hours=24)  # 24 hour session
-    ip_address = request.remote_addr if request else 'unknown'
-    user_agent = request.headers.get('User-Agent', 'unknown') if request else 'unknown'
+    return {
+        'id': str(uuid.uuid4()),
+        'user_id': user_id,
+        'user_type': user_type,
+        'email': email,
+        'ip_address': request.remote_addr if request else 'unknown',
+        'user_agent': request.headers.get('User-Agent', 'unknown') if request else 'unknown',
+        'created_at': created_at,
+        'last_activity': created_at,
+        'expires_at': created_at + timedelta(hours=24)  # 24 hour session
+    }
+
+def record_login_attempt(conn, user_id, email, success, user_type=None, new_hash=None):
+    """
+    Record a login attempt with one login_attempt() call (db/init/020).
     
-    if db_engine:
+    On success this also creates the session and returns its id; pass an
+    autocommit connection so the whole login write is one round trip. The
+    caller logs SESSION_CREATED once the statement has committed.
+    """
+    from sqlalchemy import text
+    
+    session = _new_session(user_id, user_type, email) if success else {}
+    return conn.execute(text("""
+        SELECT login_attempt(:user_id, :email, :success, :session_id, :user_type, :new_hash,
+                             :ip_address, :user_agent, :created_at, :expires_at)
+    """), {
+        'user_id': user_id,
+        'email': email,
+        'success': success,
+        'session_id': session.get('id'),
+        'user_type': user_type,
+        'new_hash': new_hash,
+        'ip_address': session.get('ip_address'),
+        'user_agent': session.get('user_agent'),
+        'created_at': session.get('created_at'),
+        'expires_at': session.get('expires_at')
+    }).scalar()
+
+class SessionActivityTracker:
+    """
+    Short-lived cache of active_sessions rows plus write-behind last_activity.
+    
+    Validated sessions are served from memory for up to cache_ttl seconds.
+    Activity timestamps are coalesced per session and written in bulk with a
+    single UPDATE ... FROM (VALUES ...) every flush_interval seconds, which is
+    also the staleness bound for last_activity. Destroyed sessions are evicted
+    immediately in this process; other workers stop trusting their cached copy
+    within cache_ttl.
+    """
+    
+    def __init__(self, cache_ttl=SESSION_CACHE_TTL, flush_interval=SESSION_ACTIVITY_FLUSH_INTERVAL,
+                 max_size=SESSION_CACHE_MAX_SIZE):
+        self.cache_ttl = cache_ttl
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        self._cache = OrderedDict()  # session_id -> (session, cached_at)
+        self._destroyed = OrderedDict()  # session_id -> destroyed_at, blocks re-caching by in-flight lookups
+        self._pending = {}  # session_id -> latest activity not yet written
+        self._lock = threading.Lock()
+        self._started = False
+    
+    def get(self, session_id):
+        now = time.time()
+        with self._lock:
+            entry = self._cache.get(session_id)
+            if entry is None:
+                return None
+            session, cached_at = entry
+            if now - cached_at > self.cache_ttl or session['expires_at'] <= datetime.now():
+                del self._cache[session_id]
+                return None
+            self._cache.move_to_end(session_id)
+            return session
+    
+    def put(self, session_id, session):
+        now = time.time()
+        with self._lock:
+            destroyed_at = self._destroyed.get(session_id)
+            if destroyed_at is not None and now - destroyed_at < self.cache_ttl:
+                return
+            self._cache[session_id] = (session, now)
+            self._cache.move_to_end(session_id)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+    
+    def touch(self, session_id):
+        with self._lock:
+            self._pending[session_id] = datetime.now()
+        if not self._started:
+            self._started = True
+            start_background_job('session-activity-flush', self.flush, self.flush_interval)
+    
+    def invalidate(self, session_id):
+        now = time.time()
+        with self._lock:
+            self._cache.pop(session_id, None)
+            self._pending.pop(session_id, None)
+            self._destroyed[session_id] = now
+            while self._destroyed and now - next(iter(self._destroyed.values())) > self.cache_ttl:
+                self._destroyed.popitem(last=False)
+    
+    def flush(self):
+        """Write all pending last_activity values in one statement"""
+        from sqlalchemy import text
+        
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        
+        if not pending or not db_engine:
+            return 0
+        
+        params = {}
+        values = []
+        for i, (session_id, last_activity) in enumerate(pending.items()):
+            values.append(f"(:id_{i}, CAST(:ts_{i} AS TIMESTAMP))")
+            params[f"id_{i}"] = session_id
+            params[f"ts_{i}"] = last_activity
+        
         try:
             with db_engine.begin() as conn:
-                conn.execute(text("""
-                    INSERT INTO active_sessions (id, user_id, user_type, email, ip_address, user_agent, created_at, last_activity, expires_at)
-                    VALUES (:id, :user_id, :user_type, :email, :ip_address, :user_agent, :created_at, :last_activity, :expires_at)
-                """), {
-                    'id': session_id,
-                    'user_id': user_id,
-                    'user_type': user_type,
-                    'email': email,
-                    'ip_address': ip_address,
-                    'user_agent': user_agent,
-                    'created_at': created_at,
-                    'last_activity': created_at,
-                    'expires_at': expires_at
-                })
+                conn.execute(text(f"""
+                    UPDATE active_sessions AS s
+                    SET last_activity = v.last_activity
+                    FROM (VALUES {", ".join(values)}) AS v(id, last_activity)
+                    WHERE s.id = v.id AND (s.last_activity IS NULL OR s.last_activity < v.last_activity)
+                """), params)
+            return len(pending)
         except Exception as e:
-            print(f"Failed to create session in database: {e}", flush=True)
-            return None
-    
-    # Log session creation
-    log_security_event(
-        'SESSION_CREATED',
-        f"New session created for user {email}",
-        user_id=user_id,
-        severity='INFO'
-    )
-    
-    return session_id
+            print(f"Failed to flush session activity: {e}", flush=True)
+            # Put the values back unless newer ones arrived meanwhile
+            with self._lock:
+                for session_id, last_activity in pending.items():
+                    self._pending.setdefault(session_id, last_activity)
+            return 0
+
+session_tracker = SessionActivityTracker()
+atexit.register(session_tracker.flush)
 
 def validate_session(session_id):
-    """Validate session and update last activity in database"""
+    """Validate session and record activity (cached; last_activity is written behind in bulk)"""
     from sqlalchemy import text
     
     if not db_engine:
         return None
     
-    try:
-        with db_engine.begin() as conn:
-            # Get session from database
-            session_result = conn.execute(text("""
-                SELECT id, user_id, user_type, email, created_at, expires_at
-                FROM active_sessions 
-                WHERE id = :session_id AND expires_at > NOW()
-            """), {"session_id": session_id}).fetchone()
-            
-            if not session_result:
-                return None
-            
-            # Update last activity
-            conn.execute(text("""
-                UPDATE active_sessions 
-                SET last_activity = NOW() 
-                WHERE id = :session_id
-            """), {"session_id": session_id})
-            
-            return {
-                'id': session_result.id,
-                'user_id': session_result.user_id,
-                'user_type': session_result.user_type,
-                'email': session_result.email,
-                'created_at': session_result.created_at,
-                'expires_at': session_result.expires_at
-            }
-            
-    except Exception as e:
-        print(f"Failed to validate session: {e}", flush=True)
-        return None
+    session = session_tracker.get(session_id)
+    if session is None:
+        try:
+            with db_engine.connect() as conn:
+                session_result = conn.execute(text("""
+                    SELECT id, user_id, user_type, email, created_at, expires_at
+                    FROM active_sessions 
+                    WHERE id = :session_id AND expires_at > NOW()
+                """), {"session_id": session_id}).fetchone()
+        except Exception as e:
+            print(f"Failed to validate session: {e}", flush=True)
+            return None
+        
+        if not session_result:
+            return None
+        
+        session = {
+            'id': session_result.id,
+            'user_id': session_result.user_id,
+            'user_type': session_result.user_type,
+            'email': session_result.email,
+            'created_at': session_result.created_at,
+            'expires_at': session_result.expires_at
+        }
+        session_tracker.put(session_id, session)
+    
+    session_tracker.touch(session_id)
+    return session
 
 def destroy_session(session_id):
     """Destroy a session in database"""
     from sqlalchemy import text
     
+    # Stop serving the session from cache right away, even if the delete fails
+    session_tracker.invalidate(session_id)
+    
     if not db_engine:
         return
     
@@ -708,3 +1945,75 @@ def get_active_sessions_count():
     except Exception as e:
         print(f"Failed to get active sessions count: {e}", flush=True)
         return 0
+
+# ============ CONVERSATION MEMBERSHIP ============
+
+CONVERSATION_MEMBERSHIP_CACHE_TTL = float(os.getenv('CONVERSATION_MEMBERSHIP_CACHE_TTL', '300'))  # max staleness seen by other workers
+CONVERSATION_MEMBERSHIP_CACHE_MAX_SIZE = int(os.getenv('CONVERSATION_MEMBERSHIP_CACHE_MAX_SIZE', '10000'))
+
+class ConversationMembershipCache:
+    """
+    LRU cache of conversation id -> (user_id, provider_user_id), the two
+    users allowed to read and post in a conversation. Participants are fixed
+    when the conversation is created and nothing changes them afterwards, so
+    entries only leave by TTL or LRU eviction. Unknown conversations are not
+    cached.
+    """
+    
+    def __init__(self, ttl=CONVERSATION_MEMBERSHIP_CACHE_TTL, max_size=CONVERSATION_MEMBERSHIP_CACHE_MAX_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()  # conversation_id -> (members, expires_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, conversation_id, conn=None):
+        """Return the members pair, loading it through conn (or db_engine) on a miss"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(conversation_id)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(conversation_id)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        
+        members = self._load(conversation_id, conn)
+        if members is not None and self.max_size > 0:
+            with self._lock:
+                self._entries[conversation_id] = (members, now + self.ttl)
+                self._entries.move_to_end(conversation_id)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+        return members
+    
+    def _load(self, conversation_id, conn):
+        from sqlalchemy import text
+        
+        query = text("""
+            SELECT c.user_id, sp.user_id as provider_user_id
+            FROM conversations c
+            LEFT JOIN service_providers sp ON c.provider_id = sp.id
+            WHERE c.id = :conv_id
+        """)
+        if conn is None:
+            with db_engine.begin() as conn:
+                row = conn.execute(query, {"conv_id": conversation_id}).fetchone()
+        else:
+            row = conn.execute(query, {"conv_id": conversation_id}).fetchone()
+        return (row.user_id, row.provider_user_id) if row else None
+    
+    def get_stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries), 'max_size': self.max_size}
+
+conversation_members = ConversationMembershipCache()
+
+def get_conversation_members(conversation_id, conn=None):
+    """(user_id, provider_user_id) for a conversation, or None if it does not exist"""
+    return conversation_members.get(conversation_id, conn)
+
+def get_conversation_members_stats():
+    """Get conversation membership cache hit/miss counters"""
+    return conversation_members.get_stats()
@@ -11,10 +11,13 @@ DELETE FROM active_sessions;
 DELETE FROM jwt_tokens;
 DELETE FROM rate_limits;
 DELETE FROM security_metrics;
+DELETE FROM security_metrics_watermark;
 
 -- 2. Delete messaging data
+DELETE FROM conversation_reads;
 DELETE FROM messages;
 DELETE FROM conversations;
+DELETE FROM socketio_fanout;
 
 -- 3. Delete service-related data
 DELETE FROM service_requests;
@@ -48,6 +51,8 @@ SELECT 'rate_limits', COUNT(*) FROM rate_limits
 UNION ALL
 SELECT 'security_metrics', COUNT(*) FROM security_metrics
 UNION ALL
+SELECT 'conversation_reads', COUNT(*) FROM conversation_reads
+UNION ALL
 SELECT 'messages', COUNT(*) FROM messages
 UNION ALL
 SELECT 'conversations', COUNT(*) FROM conversations
@@ -0,0 +1,7 @@
+-- ============ SHARED RATE LIMITING ============
+-- Lets every backend worker share rate limit counters through rate_limits
+-- (RATE_LIMIT_BACKEND=database). One row per identifier/endpoint/window,
+-- incremented with INSERT ... ON CONFLICT.
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_rate_limits_window
+  ON rate_limits(identifier, endpoint, window_start);
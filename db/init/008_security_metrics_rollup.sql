@@ -0,0 +1,105 @@
+-- ============ SECURITY METRICS ROLLUPS ============
+-- security_events is aggregated incrementally into hourly and daily buckets in
+-- security_metrics (metric_type = 'security_events'). Each bucket row holds the
+-- event total in metric_value and per event type / severity / top IP counts
+-- in metadata. Only rows newer than the stored watermark are read on each run.
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_security_metrics_bucket
+  ON security_metrics(metric_type, time_period, period_start);
+
+CREATE TABLE IF NOT EXISTS security_metrics_watermark (
+  name              VARCHAR(100) PRIMARY KEY,
+  last_processed    TIMESTAMP NOT NULL,
+  updated_at        TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Add up two {"key": count} objects, optionally keeping only the top p_limit keys
+CREATE OR REPLACE FUNCTION jsonb_sum_counts(a JSONB, b JSONB, p_limit INTEGER DEFAULT NULL)
+RETURNS JSONB AS $$
+  SELECT COALESCE(jsonb_object_agg(key, total), '{}'::jsonb)
+  FROM (
+    SELECT key, SUM(value::BIGINT) AS total
+    FROM (
+      SELECT * FROM jsonb_each_text(COALESCE(a, '{}'::jsonb))
+      UNION ALL
+      SELECT * FROM jsonb_each_text(COALESCE(b, '{}'::jsonb))
+    ) kv
+    GROUP BY key
+    ORDER BY total DESC, key
+    LIMIT p_limit
+  ) merged
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Fold security_events rows in [watermark, NOW() - p_lag) into the hour/day buckets.
+-- p_lag leaves room for events still sitting in the application's write queue.
+-- Returns the number of buckets updated.
+CREATE OR REPLACE FUNCTION rollup_security_events(p_lag INTERVAL DEFAULT INTERVAL '1 minute', p_top_ips INTEGER DEFAULT 100)
+RETURNS INTEGER AS $$
+DECLARE
+    v_from    TIMESTAMP;
+    v_to      TIMESTAMP := NOW() - p_lag;
+    v_buckets INTEGER;
+BEGIN
+    INSERT INTO security_metrics_watermark (name, last_processed)
+    SELECT 'security_events', COALESCE(MIN(created_at), v_to) FROM security_events
+    ON CONFLICT (name) DO NOTHING;
+
+    -- Row lock keeps concurrent runs (one per worker) from double counting
+    SELECT last_processed INTO v_from
+    FROM security_metrics_watermark
+    WHERE name = 'security_events'
+    FOR UPDATE;
+
+    IF v_to <= v_from THEN
+        RETURN 0;
+    END IF;
+
+    WITH new_events AS (
+        SELECT p.period,
+               date_trunc(p.period, e.created_at) AS period_start,
+               e.event_type,
+               COALESCE(e.severity, 'INFO') AS severity,
+               COALESCE(e.ip_address, 'unknown') AS ip_address
+        FROM security_events e
+        CROSS JOIN (VALUES ('hour'), ('day')) AS p(period)
+        WHERE e.created_at >= v_from AND e.created_at < v_to
+    ), counts AS (
+        SELECT period, period_start, event_type, severity, ip_address, COUNT(*) AS n,
+               GROUPING(event_type) AS no_type, GROUPING(severity) AS no_severity, GROUPING(ip_address) AS no_ip
+        FROM new_events
+        GROUP BY GROUPING SETS (
+            (period, period_start, event_type),
+            (period, period_start, severity),
+            (period, period_start, ip_address)
+        )
+    ), deltas AS (
+        SELECT period, period_start,
+               SUM(n) FILTER (WHERE no_type = 0) AS total,
+               jsonb_object_agg(event_type, n) FILTER (WHERE no_type = 0) AS event_types,
+               jsonb_object_agg(severity, n) FILTER (WHERE no_severity = 0) AS severity,
+               jsonb_sum_counts(jsonb_object_agg(ip_address, n) FILTER (WHERE no_ip = 0), NULL, p_top_ips) AS top_ips
+        FROM counts
+        GROUP BY period, period_start
+    )
+    INSERT INTO security_metrics (id, metric_type, metric_value, time_period, period_start, period_end, metadata)
+    SELECT gen_random_uuid()::text, 'security_events', total, period, period_start,
+           period_start + ('1 ' || period)::INTERVAL,
+           jsonb_build_object('event_types', event_types, 'severity', severity, 'top_ips', top_ips)
+    FROM deltas
+    ON CONFLICT (metric_type, time_period, period_start) DO UPDATE
+    SET metric_value = security_metrics.metric_value + EXCLUDED.metric_value,
+        metadata = jsonb_build_object(
+            'event_types', jsonb_sum_counts(security_metrics.metadata->'event_types', EXCLUDED.metadata->'event_types'),
+            'severity', jsonb_sum_counts(security_metrics.metadata->'severity', EXCLUDED.metadata->'severity'),
+            'top_ips', jsonb_sum_counts(security_metrics.metadata->'top_ips', EXCLUDED.metadata->'top_ips', p_top_ips)
+        );
+
+    GET DIAGNOSTICS v_buckets = ROW_COUNT;
+
+    UPDATE security_metrics_watermark
+    SET last_processed = v_to, updated_at = NOW()
+    WHERE name = 'security_events';
+
+    RETURN v_buckets;
+END;
+$$ LANGUAGE plpgsql;
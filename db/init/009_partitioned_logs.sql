@@ -0,0 +1,173 @@
+-- ============ TIME-PARTITIONED LOG TABLES ============
+-- security_events (daily) and audit_log (weekly) become range-partitioned on
+-- created_at. Retention drops whole partitions instead of row-by-row DELETEs.
+-- Existing rows are kept: the old table is attached as a single partition
+-- covering everything up to the end of the current period, and is dropped by
+-- retention once that whole range has aged out.
+
+-- Partitions of a table with the upper bound of their range
+CREATE OR REPLACE FUNCTION time_partitions(p_table TEXT)
+RETURNS TABLE(partition_name TEXT, range_end TIMESTAMP) AS $$
+  SELECT c.relname::TEXT,
+         substring(pg_get_expr(c.relpartbound, c.oid) FROM 'TO \(''([^'']+)''\)')::TIMESTAMP
+  FROM pg_inherits i
+  JOIN pg_class c ON c.oid = i.inhrelid
+  WHERE i.inhparent = p_table::regclass
+$$ LANGUAGE sql STABLE;
+
+-- Make sure partitions exist from the current period through p_ahead periods from now
+CREATE OR REPLACE FUNCTION create_time_partitions(p_table TEXT, p_period TEXT, p_ahead INTEGER)
+RETURNS INTEGER AS $$
+DECLARE
+    v_base    TIMESTAMP := date_trunc(p_period, NOW()::TIMESTAMP);
+    v_step    INTERVAL := ('1 ' || p_period)::INTERVAL;
+    v_covered TIMESTAMP;
+    v_start   TIMESTAMP;
+    v_name    TEXT;
+    v_created INTEGER := 0;
+BEGIN
+    SELECT MAX(range_end) INTO v_covered FROM time_partitions(p_table);
+
+    FOR i IN 0..p_ahead LOOP
+        v_start := v_base + v_step * i;
+        CONTINUE WHEN v_covered IS NOT NULL AND v_start < v_covered;
+
+        v_name := format('%s_p%s', p_table, to_char(v_start, 'YYYYMMDD'));
+        EXECUTE format('CREATE TABLE IF NOT EXISTS %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                       v_name, p_table, v_start, v_start + v_step);
+        v_created := v_created + 1;
+    END LOOP;
+
+    RETURN v_created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Detach and drop partitions whose whole range is older than p_retention
+CREATE OR REPLACE FUNCTION drop_time_partitions(p_table TEXT, p_retention INTERVAL)
+RETURNS INTEGER AS $$
+DECLARE
+    r         RECORD;
+    v_dropped INTEGER := 0;
+BEGIN
+    FOR r IN
+        SELECT partition_name FROM time_partitions(p_table)
+        WHERE range_end <= NOW() - p_retention
+    LOOP
+        EXECUTE format('ALTER TABLE %I DETACH PARTITION %I', p_table, r.partition_name);
+        EXECUTE format('DROP TABLE %I', r.partition_name);
+        v_dropped := v_dropped + 1;
+    END LOOP;
+
+    RETURN v_dropped;
+END;
+$$ LANGUAGE plpgsql;
+
+-- ============ SECURITY EVENTS ============
+DO $$
+DECLARE
+    v_bound TIMESTAMP := date_trunc('day', NOW()::TIMESTAMP) + INTERVAL '1 day';
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'security_events'::regclass) = 'r' THEN
+        ALTER TABLE security_events RENAME TO security_events_legacy;
+        ALTER INDEX security_events_pkey RENAME TO security_events_legacy_pkey;
+        ALTER INDEX IF EXISTS idx_security_events_type RENAME TO idx_security_events_legacy_type;
+        ALTER INDEX IF EXISTS idx_security_events_user_id RENAME TO idx_security_events_legacy_user_id;
+        ALTER INDEX IF EXISTS idx_security_events_ip RENAME TO idx_security_events_legacy_ip;
+        ALTER INDEX IF EXISTS idx_security_events_created_at RENAME TO idx_security_events_legacy_created_at;
+        ALTER INDEX IF EXISTS idx_security_events_severity RENAME TO idx_security_events_legacy_severity;
+
+        UPDATE security_events_legacy SET created_at = '1970-01-01' WHERE created_at IS NULL;
+        ALTER TABLE security_events_legacy ALTER COLUMN created_at SET NOT NULL;
+
+        CREATE TABLE security_events (
+          id                VARCHAR(36) NOT NULL,
+          event_type        VARCHAR(100) NOT NULL,
+          description       TEXT NOT NULL,
+          user_id           VARCHAR(36) REFERENCES users_login(id) ON DELETE SET NULL,
+          ip_address        VARCHAR(45), -- IPv6 compatible
+          user_agent        TEXT,
+          severity          VARCHAR(20) DEFAULT 'INFO', -- 'INFO', 'WARNING', 'ERROR', 'CRITICAL'
+          request_path      VARCHAR(500),
+          request_method    VARCHAR(10),
+          created_at        TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+          PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at);
+
+        EXECUTE format('ALTER TABLE security_events ATTACH PARTITION security_events_legacy FOR VALUES FROM (MINVALUE) TO (%L)', v_bound);
+    END IF;
+END $$;
+
+-- Defined on the parent, so every partition gets its own copy
+CREATE INDEX IF NOT EXISTS idx_security_events_type ON security_events(event_type);
+CREATE INDEX IF NOT EXISTS idx_security_events_user_id ON security_events(user_id);
+CREATE INDEX IF NOT EXISTS idx_security_events_ip ON security_events(ip_address);
+CREATE INDEX IF NOT EXISTS idx_security_events_created_at ON security_events(created_at);
+CREATE INDEX IF NOT EXISTS idx_security_events_severity ON security_events(severity);
+
+-- ============ AUDIT LOG ============
+DO $$
+DECLARE
+    v_bound TIMESTAMP := date_trunc('week', NOW()::TIMESTAMP) + INTERVAL '1 week';
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = 'audit_log'::regclass) = 'r' THEN
+        ALTER TABLE audit_log RENAME TO audit_log_legacy;
+        ALTER INDEX audit_log_pkey RENAME TO audit_log_legacy_pkey;
+        -- Keep the id sequence alive when the legacy partition is eventually dropped
+        ALTER SEQUENCE audit_log_id_seq OWNED BY NONE;
+
+        UPDATE audit_log_legacy SET created_at = '1970-01-01' WHERE created_at IS NULL;
+        ALTER TABLE audit_log_legacy ALTER COLUMN created_at SET NOT NULL;
+
+        CREATE TABLE audit_log (
+          id           BIGINT NOT NULL DEFAULT nextval('audit_log_id_seq'),
+          action_type  VARCHAR(50) NOT NULL,     -- SIGNUP | LOGIN_SUCCESS | LOGIN_FAILURE | LOGOUT | VERIFY_EMAIL | UPDATE_PROFILE | etc.
+          description  TEXT,
+          created_by   VARCHAR(36),              -- user_id if known
+          created_at   TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+          ip_address   INET,
+          user_agent   TEXT,
+          PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at);
+
+        ALTER SEQUENCE audit_log_id_seq OWNED BY audit_log.id;
+
+        EXECUTE format('ALTER TABLE audit_log ATTACH PARTITION audit_log_legacy FOR VALUES FROM (MINVALUE) TO (%L)', v_bound);
+    END IF;
+END $$;
+
+CREATE INDEX IF NOT EXISTS idx_audit_log_created_at ON audit_log(created_at);
+CREATE INDEX IF NOT EXISTS idx_audit_log_created_by ON audit_log(created_by);
+
+-- ============ RETENTION ============
+
+-- Function to clean up old security events (keep last 30 days); now returns partitions dropped
+CREATE OR REPLACE FUNCTION cleanup_old_security_events()
+RETURNS INTEGER AS $$
+BEGIN
+    RETURN drop_time_partitions('security_events', INTERVAL '30 days');
+END;
+$$ LANGUAGE plpgsql;
+
+-- Function to clean up old audit log entries (keep last year); returns partitions dropped
+CREATE OR REPLACE FUNCTION cleanup_old_audit_log()
+RETURNS INTEGER AS $$
+BEGIN
+    RETURN drop_time_partitions('audit_log', INTERVAL '365 days');
+END;
+$$ LANGUAGE plpgsql;
+
+-- Create upcoming partitions and drop expired ones; run periodically by the backend
+CREATE OR REPLACE FUNCTION maintain_log_partitions()
+RETURNS INTEGER AS $$
+DECLARE
+    v_changed INTEGER := 0;
+BEGIN
+    v_changed := v_changed + create_time_partitions('security_events', 'day', 14);
+    v_changed := v_changed + create_time_partitions('audit_log', 'week', 4);
+    v_changed := v_changed + cleanup_old_security_events();
+    v_changed := v_changed + cleanup_old_audit_log();
+    RETURN v_changed;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT maintain_log_partitions();
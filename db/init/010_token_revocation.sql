@@ -0,0 +1,24 @@
+-- ============ TOKEN REVOCATION ============
+-- jwt_tokens doubles as the revocation list: logout records the token digests
+-- there and every backend worker pulls new rows by revoked_at into an
+-- in-memory set.
+
+ALTER TABLE jwt_tokens ADD COLUMN IF NOT EXISTS revoked_at TIMESTAMP;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_jwt_tokens_token_hash ON jwt_tokens(token_hash);
+CREATE INDEX IF NOT EXISTS idx_jwt_tokens_revoked_at ON jwt_tokens(revoked_at) WHERE is_revoked = TRUE;
+
+-- Function to clean up expired JWT tokens
+-- Revoked tokens must stay listed until they expire, otherwise they become valid again
+CREATE OR REPLACE FUNCTION cleanup_expired_tokens()
+RETURNS INTEGER AS $$
+DECLARE
+    deleted_count INTEGER;
+BEGIN
+    DELETE FROM jwt_tokens 
+    WHERE expires_at < NOW();
+    
+    GET DIAGNOSTICS deleted_count = ROW_COUNT;
+    RETURN deleted_count;
+END;
+$$ LANGUAGE plpgsql;
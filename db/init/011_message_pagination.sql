@@ -0,0 +1,9 @@
+-- ============ MESSAGE HISTORY PAGINATION ============
+-- GET /api/conversations/<id>/messages pages by (created_date, id) cursors.
+-- This index serves both directions of the keyset scan and also covers
+-- lookups by conversation_id alone, so the single-column index is redundant.
+
+CREATE INDEX IF NOT EXISTS idx_messages_conversation_keyset
+  ON messages(conversation_id, created_date, id);
+
+DROP INDEX IF EXISTS idx_messages_conversation_id;
@@ -0,0 +1,90 @@
+-- ============ CONVERSATION READ WATERMARKS ============
+-- Each participant has one row holding the newest message (by the same
+-- (created_date, id) order used for paging) they have read. Everything at
+-- or before the watermark is read, so marking a whole page read is a single
+-- upsert and unread counts are a keyset range count.
+
+CREATE TABLE IF NOT EXISTS conversation_reads (
+  conversation_id       VARCHAR(36) NOT NULL REFERENCES conversations(id) ON DELETE CASCADE,
+  user_id               VARCHAR(36) NOT NULL REFERENCES users_login(id) ON DELETE CASCADE,
+  last_read_at          TIMESTAMP NOT NULL,
+  last_read_message_id  VARCHAR(36) NOT NULL,
+  updated_date          TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (conversation_id, user_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_conversation_reads_user_id ON conversation_reads(user_id);
+
+-- Seed watermarks from the per-message is_read flags already recorded
+INSERT INTO conversation_reads (conversation_id, user_id, last_read_at, last_read_message_id)
+SELECT DISTINCT ON (c.id, p.user_id) c.id, p.user_id, m.created_date, m.id
+FROM conversations c
+JOIN service_providers sp ON sp.id = c.provider_id
+CROSS JOIN LATERAL (VALUES (c.user_id), (sp.user_id)) AS p(user_id)
+JOIN messages m ON m.conversation_id = c.id AND m.sender_id <> p.user_id AND m.is_read
+WHERE m.created_date IS NOT NULL
+ORDER BY c.id, p.user_id, m.created_date DESC, m.id DESC
+ON CONFLICT (conversation_id, user_id) DO NOTHING;
+
+-- Messages from the other participant newer than the reader's watermark
+CREATE OR REPLACE FUNCTION conversation_unread_count(p_conversation_id VARCHAR, p_user_id VARCHAR)
+RETURNS INTEGER AS $$
+    SELECT COUNT(*)::INTEGER
+    FROM messages m
+    LEFT JOIN conversation_reads cr
+      ON cr.conversation_id = m.conversation_id AND cr.user_id = p_user_id
+    WHERE m.conversation_id = p_conversation_id
+      AND m.sender_id <> p_user_id
+      AND (cr.user_id IS NULL OR (m.created_date, m.id) > (cr.last_read_at, cr.last_read_message_id));
+$$ LANGUAGE sql STABLE;
+
+-- Advance a reader's watermark to (p_read_at, p_message_id), or to the newest
+-- message when no position is given. Watermarks never move backwards.
+-- messages.is_read is kept in step for clients that still read the flag.
+-- Returns the reader's remaining unread count.
+CREATE OR REPLACE FUNCTION mark_conversation_read(
+    p_conversation_id VARCHAR,
+    p_user_id VARCHAR,
+    p_read_at TIMESTAMP DEFAULT NULL,
+    p_message_id VARCHAR DEFAULT NULL
+)
+RETURNS INTEGER AS $$
+DECLARE
+    v_read_at TIMESTAMP;
+    v_message_id VARCHAR;
+BEGIN
+    IF p_read_at IS NULL THEN
+        SELECT created_date, id INTO p_read_at, p_message_id
+        FROM messages
+        WHERE conversation_id = p_conversation_id
+        ORDER BY created_date DESC, id DESC
+        LIMIT 1;
+        
+        IF NOT FOUND THEN
+            RETURN 0;
+        END IF;
+    END IF;
+    
+    INSERT INTO conversation_reads (conversation_id, user_id, last_read_at, last_read_message_id, updated_date)
+    VALUES (p_conversation_id, p_user_id, p_read_at, p_message_id, NOW())
+    ON CONFLICT (conversation_id, user_id) DO UPDATE
+    SET last_read_at = EXCLUDED.last_read_at,
+        last_read_message_id = EXCLUDED.last_read_message_id,
+        updated_date = NOW()
+    WHERE (conversation_reads.last_read_at, conversation_reads.last_read_message_id)
+        < (EXCLUDED.last_read_at, EXCLUDED.last_read_message_id);
+    
+    SELECT last_read_at, last_read_message_id INTO v_read_at, v_message_id
+    FROM conversation_reads
+    WHERE conversation_id = p_conversation_id AND user_id = p_user_id;
+    
+    UPDATE messages
+    SET is_read = TRUE
+    WHERE conversation_id = p_conversation_id
+      AND sender_id <> p_user_id
+      AND NOT is_read
+      AND (created_date, id) <= (v_read_at, v_message_id);
+    
+    RETURN conversation_unread_count(p_conversation_id, p_user_id);
+END;
+$$ LANGUAGE plpgsql;
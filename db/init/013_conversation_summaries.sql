@@ -0,0 +1,171 @@
+-- ============ CONVERSATION LIST SUMMARIES ============
+-- Inbox rows need the last message and a per-participant unread count.
+-- Both are maintained on message insert, so listing conversations is one
+-- indexed query no matter how many conversations or messages there are:
+--   conversations.last_message_*      newest message preview
+--   conversation_reads.unread_count   messages past the reader's watermark
+
+ALTER TABLE conversations ADD COLUMN IF NOT EXISTS last_message_id   VARCHAR(36);
+ALTER TABLE conversations ADD COLUMN IF NOT EXISTS last_message_text VARCHAR(200);
+ALTER TABLE conversations ADD COLUMN IF NOT EXISTS last_message_at   TIMESTAMP;
+ALTER TABLE conversations ADD COLUMN IF NOT EXISTS last_sender_type  VARCHAR(20);
+
+-- A participant who has never read anything still has an unread counter
+ALTER TABLE conversation_reads ADD COLUMN IF NOT EXISTS unread_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE conversation_reads ALTER COLUMN last_read_at DROP NOT NULL;
+ALTER TABLE conversation_reads ALTER COLUMN last_read_message_id DROP NOT NULL;
+
+-- ============ TRIGGERS ============
+-- Replaces the 003 trigger body: besides bumping updated_date, record the
+-- preview and count the message as unread for the other participant
+CREATE OR REPLACE FUNCTION trg_update_conversation_timestamp()
+RETURNS TRIGGER AS $$
+DECLARE
+    v_client_id VARCHAR(36);
+    v_provider_id VARCHAR(36);
+    v_recipient_id VARCHAR(36);
+BEGIN
+    UPDATE conversations
+    SET updated_date = NOW(),
+        last_message_id = NEW.id,
+        last_message_text = LEFT(NEW.message_text, 200),
+        last_message_at = NEW.created_date,
+        last_sender_type = NEW.sender_type
+    WHERE id = NEW.conversation_id
+      AND (last_message_at IS NULL OR (last_message_at, last_message_id) <= (NEW.created_date, NEW.id))
+    RETURNING user_id, provider_id INTO v_client_id, v_provider_id;
+    
+    -- Older than the current preview (e.g. a late insert): only touch the timestamp
+    IF NOT FOUND THEN
+        UPDATE conversations
+        SET updated_date = NOW()
+        WHERE id = NEW.conversation_id
+        RETURNING user_id, provider_id INTO v_client_id, v_provider_id;
+    END IF;
+    
+    IF NEW.sender_id = v_client_id THEN
+        SELECT user_id INTO v_recipient_id FROM service_providers WHERE id = v_provider_id;
+    ELSE
+        v_recipient_id := v_client_id;
+    END IF;
+    
+    IF v_recipient_id IS NOT NULL THEN
+        INSERT INTO conversation_reads (conversation_id, user_id, unread_count)
+        VALUES (NEW.conversation_id, v_recipient_id, 1)
+        ON CONFLICT (conversation_id, user_id) DO UPDATE
+        SET unread_count = conversation_reads.unread_count + 1;
+    END IF;
+    
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+-- ============ FUNCTIONS ============
+-- Redefined for watermark rows that have not read anything yet
+CREATE OR REPLACE FUNCTION conversation_unread_count(p_conversation_id VARCHAR, p_user_id VARCHAR)
+RETURNS INTEGER AS $$
+    SELECT COUNT(*)::INTEGER
+    FROM messages m
+    LEFT JOIN conversation_reads cr
+      ON cr.conversation_id = m.conversation_id AND cr.user_id = p_user_id
+    WHERE m.conversation_id = p_conversation_id
+      AND m.sender_id <> p_user_id
+      AND (cr.last_read_at IS NULL OR (m.created_date, m.id) > (cr.last_read_at, cr.last_read_message_id));
+$$ LANGUAGE sql STABLE;
+
+-- Same contract as in 012; the counter is reset from the new watermark.
+-- The upsert locks the reader's row first, so a concurrent message insert
+-- either lands in the recount or increments after it.
+CREATE OR REPLACE FUNCTION mark_conversation_read(
+    p_conversation_id VARCHAR,
+    p_user_id VARCHAR,
+    p_read_at TIMESTAMP DEFAULT NULL,
+    p_message_id VARCHAR DEFAULT NULL
+)
+RETURNS INTEGER AS $$
+DECLARE
+    v_read_at TIMESTAMP;
+    v_message_id VARCHAR;
+    v_unread INTEGER;
+BEGIN
+    IF p_read_at IS NULL THEN
+        SELECT created_date, id INTO p_read_at, p_message_id
+        FROM messages
+        WHERE conversation_id = p_conversation_id
+        ORDER BY created_date DESC, id DESC
+        LIMIT 1;
+        
+        IF NOT FOUND THEN
+            RETURN 0;
+        END IF;
+    END IF;
+    
+    INSERT INTO conversation_reads (conversation_id, user_id, last_read_at, last_read_message_id, updated_date)
+    VALUES (p_conversation_id, p_user_id, p_read_at, p_message_id, NOW())
+    ON CONFLICT (conversation_id, user_id) DO UPDATE
+    SET last_read_at = EXCLUDED.last_read_at,
+        last_read_message_id = EXCLUDED.last_read_message_id,
+        updated_date = NOW()
+    WHERE conversation_reads.last_read_at IS NULL
+       OR (conversation_reads.last_read_at, conversation_reads.last_read_message_id)
+        < (EXCLUDED.last_read_at, EXCLUDED.last_read_message_id);
+    
+    SELECT last_read_at, last_read_message_id INTO v_read_at, v_message_id
+    FROM conversation_reads
+    WHERE conversation_id = p_conversation_id AND user_id = p_user_id
+    FOR UPDATE;
+    
+    UPDATE messages
+    SET is_read = TRUE
+    WHERE conversation_id = p_conversation_id
+      AND sender_id <> p_user_id
+      AND NOT is_read
+      AND (created_date, id) <= (v_read_at, v_message_id);
+    
+    v_unread := conversation_unread_count(p_conversation_id, p_user_id);
+    
+    UPDATE conversation_reads
+    SET unread_count = v_unread
+    WHERE conversation_id = p_conversation_id AND user_id = p_user_id;
+    
+    RETURN v_unread;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Recompute every preview and counter from messages; used to backfill
+-- below and safe to re-run if the denormalized columns are ever suspect
+CREATE OR REPLACE FUNCTION refresh_conversation_summaries()
+RETURNS INTEGER AS $$
+DECLARE
+    refreshed_count INTEGER;
+BEGIN
+    UPDATE conversations c
+    SET last_message_id = m.id,
+        last_message_text = LEFT(m.message_text, 200),
+        last_message_at = m.created_date,
+        last_sender_type = m.sender_type
+    FROM (
+        SELECT DISTINCT ON (conversation_id) conversation_id, id, message_text, created_date, sender_type
+        FROM messages
+        ORDER BY conversation_id, created_date DESC, id DESC
+    ) m
+    WHERE m.conversation_id = c.id;
+    
+    INSERT INTO conversation_reads (conversation_id, user_id, unread_count)
+    SELECT c.id, p.user_id, conversation_unread_count(c.id, p.user_id)
+    FROM conversations c
+    JOIN service_providers sp ON sp.id = c.provider_id
+    CROSS JOIN LATERAL (VALUES (c.user_id), (sp.user_id)) AS p(user_id)
+    ON CONFLICT (conversation_id, user_id) DO UPDATE
+    SET unread_count = EXCLUDED.unread_count;
+    
+    GET DIAGNOSTICS refreshed_count = ROW_COUNT;
+    RETURN refreshed_count;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT refresh_conversation_summaries();
+
+-- Inbox ordering
+CREATE INDEX IF NOT EXISTS idx_conversations_user_updated ON conversations(user_id, updated_date DESC);
+CREATE INDEX IF NOT EXISTS idx_conversations_provider_updated ON conversations(provider_id, updated_date DESC);
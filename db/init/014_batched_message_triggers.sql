@@ -0,0 +1,55 @@
+-- ============ STATEMENT-LEVEL MESSAGE TRIGGER ============
+-- Chat messages are written in multi-row batches. The per-row trigger from
+-- 003/013 updated the conversation row once per message, so a batch of N
+-- messages in one conversation locked and rewrote that row N times. This
+-- version runs once per INSERT statement over the transition table and
+-- touches each conversation and each reader's counter once.
+
+DROP TRIGGER IF EXISTS trg_messages_update_conversation ON messages;
+
+CREATE OR REPLACE FUNCTION trg_update_conversation_summaries()
+RETURNS TRIGGER AS $$
+BEGIN
+    -- One coalesced bump per conversation; the newest message of the
+    -- statement becomes the preview unless a newer one is already recorded
+    UPDATE conversations c
+    SET updated_date = NOW(),
+        last_message_id   = CASE WHEN newer THEN n.id ELSE c.last_message_id END,
+        last_message_text = CASE WHEN newer THEN LEFT(n.message_text, 200) ELSE c.last_message_text END,
+        last_message_at   = CASE WHEN newer THEN n.created_date ELSE c.last_message_at END,
+        last_sender_type  = CASE WHEN newer THEN n.sender_type ELSE c.last_sender_type END
+    FROM (
+        SELECT DISTINCT ON (nm.conversation_id)
+               nm.conversation_id, nm.id, nm.message_text, nm.created_date, nm.sender_type,
+               (cc.last_message_at IS NULL
+                OR (cc.last_message_at, cc.last_message_id) <= (nm.created_date, nm.id)) AS newer
+        FROM new_messages nm
+        JOIN conversations cc ON cc.id = nm.conversation_id
+        ORDER BY nm.conversation_id, nm.created_date DESC, nm.id DESC
+    ) n
+    WHERE c.id = n.conversation_id;
+    
+    -- Each message is unread for the participant who did not send it, unless
+    -- it arrived already behind their watermark (inserted with is_read set)
+    INSERT INTO conversation_reads (conversation_id, user_id, unread_count)
+    SELECT nm.conversation_id,
+           CASE WHEN nm.sender_id = c.user_id THEN sp.user_id ELSE c.user_id END,
+           COUNT(*)
+    FROM new_messages nm
+    JOIN conversations c ON c.id = nm.conversation_id
+    JOIN service_providers sp ON sp.id = c.provider_id
+    WHERE NOT COALESCE(nm.is_read, FALSE)
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+    ON CONFLICT (conversation_id, user_id) DO UPDATE
+    SET unread_count = conversation_reads.unread_count + EXCLUDED.unread_count;
+    
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER trg_messages_update_conversation
+  AFTER INSERT ON messages
+  REFERENCING NEW TABLE AS new_messages
+  FOR EACH STATEMENT
+  EXECUTE FUNCTION trg_update_conversation_summaries();
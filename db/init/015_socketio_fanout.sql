@@ -0,0 +1,13 @@
+-- ============ SOCKET.IO FAN-OUT ============
+-- With SOCKETIO_MESSAGE_QUEUE=postgresql://... workers relay broadcasts to
+-- each other with NOTIFY. Payloads over the 8000 byte NOTIFY limit are
+-- parked here and only the row id is notified; publishers delete rows older
+-- than a minute, by which time every listener has read them.
+
+CREATE TABLE IF NOT EXISTS socketio_fanout (
+  id          BIGSERIAL PRIMARY KEY,
+  payload     TEXT NOT NULL,
+  created_at  TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_socketio_fanout_created_at ON socketio_fanout(created_at);
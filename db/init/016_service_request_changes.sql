@@ -0,0 +1,48 @@
+-- ============ SERVICE REQUEST CHANGE FEED ============
+-- Dashboards get service request changes pushed over Socket.IO and, after a
+-- reconnect, fetch what they missed with GET /api/service-requests/changes
+-- ?since=<change_seq>. Every insert or update stamps the row with the next
+-- change_seq, so "changes since N" is an index range scan.
+--
+-- For the cursor to be safe, a row with a lower change_seq must never become
+-- visible after one with a higher change_seq. The trigger takes a
+-- transaction-level advisory lock before drawing the number, so writers to
+-- service_requests commit in change_seq order. Writes to this table are
+-- infrequent (create / accept / complete / confirm), so serialising them is
+-- cheap.
+
+CREATE SEQUENCE IF NOT EXISTS service_request_change_seq;
+
+ALTER TABLE service_requests
+  ADD COLUMN IF NOT EXISTS change_seq BIGINT;
+
+UPDATE service_requests
+SET change_seq = nextval('service_request_change_seq')
+WHERE change_seq IS NULL;
+
+ALTER TABLE service_requests
+  ALTER COLUMN change_seq SET DEFAULT nextval('service_request_change_seq'),
+  ALTER COLUMN change_seq SET NOT NULL;
+
+CREATE OR REPLACE FUNCTION trg_stamp_service_request_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('service_request_change_seq'));
+    NEW.change_seq := nextval('service_request_change_seq');
+    NEW.updated_date := CURRENT_TIMESTAMP;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS stamp_service_request_change ON service_requests;
+CREATE TRIGGER stamp_service_request_change
+BEFORE INSERT OR UPDATE ON service_requests
+FOR EACH ROW EXECUTE FUNCTION trg_stamp_service_request_change();
+
+-- Changes for one dashboard, in cursor order
+CREATE INDEX IF NOT EXISTS idx_service_requests_provider_change ON service_requests(provider_id, change_seq);
+CREATE INDEX IF NOT EXISTS idx_service_requests_user_change ON service_requests(user_id, change_seq);
+
+-- Both are prefixes of the indexes above
+DROP INDEX IF EXISTS idx_service_requests_user_id;
+DROP INDEX IF EXISTS idx_service_requests_provider_id;
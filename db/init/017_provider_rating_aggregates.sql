@@ -0,0 +1,101 @@
+-- ============ INCREMENTAL PROVIDER RATINGS ============
+-- Each confirmed service request gets one service_reviews row. A trigger on
+-- service_reviews keeps a running rating_sum / total_reviews per provider and
+-- derives rating from them in the same UPDATE, so the three never disagree
+-- and no confirmation rescans the provider's history.
+--
+-- rebuild_provider_ratings() recomputes every provider from service_reviews
+-- in one pass, for backfills and consistency checks:
+--   SELECT * FROM rebuild_provider_ratings(dry_run => TRUE);  -- report drift only
+--   SELECT * FROM rebuild_provider_ratings();                 -- report and fix
+
+ALTER TABLE service_providers
+  ADD COLUMN IF NOT EXISTS rating_sum BIGINT NOT NULL DEFAULT 0;
+
+-- One review per service request
+CREATE UNIQUE INDEX IF NOT EXISTS idx_service_reviews_request ON service_reviews(service_request_id);
+CREATE INDEX IF NOT EXISTS idx_service_reviews_provider ON service_reviews(provider_id);
+
+-- Reviews for requests confirmed before service_reviews was written to
+INSERT INTO service_reviews (id, service_request_id, user_id, provider_id, rating, created_date)
+SELECT gen_random_uuid()::text, sr.id, sr.user_id, sr.provider_id, sr.client_rating,
+       COALESCE(sr.confirmed_date, sr.updated_date)
+FROM service_requests sr
+WHERE sr.client_rating IS NOT NULL
+ON CONFLICT (service_request_id) DO NOTHING;
+
+-- Apply a review insert, rating change or delete (including cascades) to
+-- the provider's aggregates. Column references on the right of SET see the
+-- row before this UPDATE, so rating is derived from the new sum and count.
+CREATE OR REPLACE FUNCTION trg_apply_service_review()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE service_providers
+        SET rating_sum = rating_sum - OLD.rating,
+            total_reviews = total_reviews - 1,
+            rating = COALESCE(ROUND((rating_sum - OLD.rating)::numeric / NULLIF(total_reviews - 1, 0), 2), 0)
+        WHERE id = OLD.provider_id;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        UPDATE service_providers
+        SET rating_sum = rating_sum + NEW.rating,
+            total_reviews = total_reviews + 1,
+            rating = ROUND((rating_sum + NEW.rating)::numeric / (total_reviews + 1), 2)
+        WHERE id = NEW.provider_id;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS apply_service_review ON service_reviews;
+CREATE TRIGGER apply_service_review
+AFTER INSERT OR DELETE OR UPDATE OF rating, provider_id ON service_reviews
+FOR EACH ROW EXECUTE FUNCTION trg_apply_service_review();
+
+-- Recompute every provider's aggregates from service_reviews. Returns the
+-- providers whose stored values were wrong (before and after); with
+-- dry_run nothing is changed.
+CREATE OR REPLACE FUNCTION rebuild_provider_ratings(dry_run BOOLEAN DEFAULT FALSE)
+RETURNS TABLE (
+    provider_id VARCHAR(36),
+    old_rating DECIMAL(3,2),
+    new_rating DECIMAL(3,2),
+    old_total_reviews INTEGER,
+    new_total_reviews INTEGER
+) AS $$
+    WITH totals AS (
+        SELECT sp.id,
+               COALESCE(SUM(r.rating), 0) AS rating_sum,
+               COUNT(r.id)::INTEGER AS total_reviews
+        FROM service_providers sp
+        LEFT JOIN service_reviews r ON r.provider_id = sp.id
+        GROUP BY sp.id
+    ),
+    drift AS (
+        SELECT sp.id, sp.rating AS old_rating, sp.total_reviews AS old_total_reviews,
+               t.rating_sum, t.total_reviews,
+               COALESCE(ROUND(t.rating_sum::numeric / NULLIF(t.total_reviews, 0), 2), 0) AS rating
+        FROM service_providers sp
+        JOIN totals t ON t.id = sp.id
+        WHERE sp.rating_sum <> t.rating_sum
+           OR sp.total_reviews IS DISTINCT FROM t.total_reviews
+           OR sp.rating IS DISTINCT FROM COALESCE(ROUND(t.rating_sum::numeric / NULLIF(t.total_reviews, 0), 2), 0)
+    ),
+    fixed AS (
+        UPDATE service_providers sp
+        SET rating_sum = d.rating_sum,
+            total_reviews = d.total_reviews,
+            rating = d.rating
+        FROM drift d
+        WHERE sp.id = d.id AND NOT dry_run
+        RETURNING sp.id
+    )
+    SELECT d.id, d.old_rating, d.rating, d.old_total_reviews, d.total_reviews
+    FROM drift d
+    ORDER BY d.id;
+$$ LANGUAGE sql;
+
+SELECT COUNT(*) AS providers_rebuilt FROM rebuild_provider_ratings();
@@ -0,0 +1,41 @@
+-- ============ PROVIDER DIRECTORY CACHE VERSION ============
+-- Backend workers cache serialized GET /api/service-providers responses and
+-- poll cache_versions to learn when to drop them. Any statement that writes
+-- service_providers (registration, rating triggers, activation changes,
+-- manual fixes through psql) bumps the provider_directory version.
+
+CREATE TABLE IF NOT EXISTS cache_versions (
+  name        VARCHAR(100) PRIMARY KEY,
+  version     BIGINT NOT NULL DEFAULT 1,
+  updated_at  TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO cache_versions (name) VALUES ('provider_directory')
+ON CONFLICT (name) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION trg_bump_provider_directory_version()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE cache_versions
+    SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+    WHERE name = 'provider_directory';
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS bump_provider_directory_version ON service_providers;
+CREATE TRIGGER bump_provider_directory_version
+AFTER INSERT OR UPDATE OR DELETE ON service_providers
+FOR EACH STATEMENT EXECUTE FUNCTION trg_bump_provider_directory_version();
+
+-- ============ DIRECTORY PAGINATION ============
+-- Pages are ordered by (rating DESC, name, id) and continued with a keyset
+-- cursor, which needs a non-null rating
+
+UPDATE service_providers SET rating = 0 WHERE rating IS NULL;
+ALTER TABLE service_providers ALTER COLUMN rating SET NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_service_providers_directory
+  ON service_providers(rating DESC, name, id) WHERE is_active;
+CREATE INDEX IF NOT EXISTS idx_service_providers_directory_type
+  ON service_providers(service_type, rating DESC, name, id) WHERE is_active;
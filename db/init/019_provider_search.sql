@@ -0,0 +1,16 @@
+-- ============ PROVIDER FULL-TEXT SEARCH ============
+-- GET /api/service-providers/search matches websearch-style queries against
+-- a stored tsvector of name (weight A), description (B) and address (C).
+-- The column is generated, so every write keeps it current without a
+-- trigger, and the partial GIN index only covers providers that are listed.
+
+ALTER TABLE service_providers
+  ADD COLUMN IF NOT EXISTS search_vector tsvector
+  GENERATED ALWAYS AS (
+    setweight(to_tsvector('english', COALESCE(name, '')), 'A') ||
+    setweight(to_tsvector('english', COALESCE(description, '')), 'B') ||
+    setweight(to_tsvector('english', COALESCE(address, '')), 'C')
+  ) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_service_providers_search
+  ON service_providers USING GIN (search_vector) WHERE is_active;
@@ -0,0 +1,60 @@
+-- ============ SINGLE-STATEMENT LOGIN ============
+-- The password is checked in the application, so a login needs one lookup
+-- of the user row. Everything after that is one call to login_attempt():
+-- it updates the login counters, writes the audit_log row and, on success,
+-- creates the active_sessions row. Run on an autocommit connection, that is
+-- one round trip and one commit instead of two explicit transactions.
+--
+--   SELECT login_attempt(user_id, email, TRUE, session_id, ...);  -- success
+--   SELECT login_attempt(user_id, email, FALSE);                  -- wrong password
+--   SELECT login_attempt(NULL, email, FALSE);                     -- unknown email
+
+CREATE OR REPLACE FUNCTION login_attempt(
+    p_user_id VARCHAR(36),
+    p_email VARCHAR(255),
+    p_success BOOLEAN,
+    p_session_id VARCHAR(36) DEFAULT NULL,
+    p_user_type VARCHAR(50) DEFAULT NULL,
+    p_new_hash VARCHAR(255) DEFAULT NULL,     -- replaces password_hash when the scheme or cost changed
+    p_ip_address VARCHAR(45) DEFAULT NULL,
+    p_user_agent TEXT DEFAULT NULL,
+    p_created_at TIMESTAMP DEFAULT NULL,      -- session times come from the app (_new_session())
+    p_expires_at TIMESTAMP DEFAULT NULL
+)
+RETURNS VARCHAR(36) AS $$
+BEGIN
+    IF p_user_id IS NULL THEN
+        INSERT INTO audit_log (action_type, description, created_at)
+        VALUES ('LOGIN_FAILURE', 'User not found: ' || p_email, NOW());
+        RETURN NULL;
+    END IF;
+
+    IF NOT p_success THEN
+        UPDATE users_login
+        SET login_attempts = login_attempts + 1,
+            attempt_time = NOW()
+        WHERE id = p_user_id;
+
+        INSERT INTO audit_log (action_type, description, created_by, created_at)
+        VALUES ('LOGIN_FAILURE', 'Invalid password attempt', p_user_id, NOW());
+        RETURN NULL;
+    END IF;
+
+    UPDATE users_login
+    SET login_attempts = 0,
+        last_login = NOW(),
+        login_status = 'SUCCESS',
+        password_hash = COALESCE(p_new_hash, password_hash)
+    WHERE id = p_user_id;
+
+    INSERT INTO audit_log (action_type, description, created_by, created_at)
+    VALUES ('LOGIN_SUCCESS', 'User logged in successfully', p_user_id, NOW());
+
+    INSERT INTO active_sessions (id, user_id, user_type, email, ip_address, user_agent,
+                                 created_at, last_activity, expires_at)
+    VALUES (p_session_id, p_user_id, p_user_type, p_email, p_ip_address, p_user_agent,
+            p_created_at, p_created_at, p_expires_at);
+
+    RETURN p_session_id;
+END;
+$$ LANGUAGE plpgsql;
@@ -13,7 +13,13 @@ export default function Conversation({ user }) {
   const [sending, setSending] = useState(false);
   const [error, setError] = useState("");
   const [socket, setSocket] = useState(null);
+  const [olderCursor, setOlderCursor] = useState(null);
+  const [loadingOlder, setLoadingOlder] = useState(false);
   const messagesEndRef = useRef(null);
+  const skipScrollRef = useRef(false);
+  // Sent messages the server has not yet confirmed as stored: id -> payload
+  const pendingRef = useRef(new Map());
+  const [pendingIds, setPendingIds] = useState(new Set());
   const navigate = useNavigate();
 
   useEffect(() => {
@@ -23,8 +29,13 @@ export default function Conversation({ user }) {
     }
     loadConversation();
     
-    // Initialize WebSocket connection
-    const newSocket = io(API);
+    // Initialize WebSocket connection, authenticated once with the access token
+    const newSocket = io(API, {
+      auth: { token: localStorage.getItem("access_token") }
+    });
+    newSocket.on('connect_error', () => {
+      setError("Could not connect to chat. Please log in again.");
+    });
     setSocket(newSocket);
     
     return () => {
@@ -35,6 +46,11 @@ export default function Conversation({ user }) {
   }, [user, requestId, navigate]);
 
   useEffect(() => {
+    // Prepending older history should keep the reader where they are
+    if (skipScrollRef.current) {
+      skipScrollRef.current = false;
+      return;
+    }
     scrollToBottom();
   }, [messages]);
 
@@ -42,21 +58,55 @@ export default function Conversation({ user }) {
   useEffect(() => {
     if (!socket || !conversation) return;
 
-    // Join conversation room when conversation is loaded
-    socket.emit('join_conversation', {
-      conversation_id: conversation.id,
-      user_id: user.id
-    });
+    // Join conversation room when conversation is loaded, and again after
+    // reconnecting; unconfirmed messages are resent with their original ids
+    const joinAndResend = () => {
+      socket.emit('join_conversation', {
+        conversation_id: conversation.id
+      });
+      for (const payload of pendingRef.current.values()) {
+        socket.emit('send_message', { ...payload, resend: true });
+      }
+    };
+    joinAndResend();
+    socket.on('connect', joinAndResend);
 
-    // Listen for new messages
+    // Listen for new messages (a resent message may arrive twice)
     socket.on('new_message', (message) => {
-      setMessages(prev => [...prev, message]);
-      // Mark message as read if it's not from current user
+      setMessages(prev => prev.some(m => m.id === message.id) ? prev : [...prev, message]);
+      // Move our read watermark up to the message if it's not from current user
       if (message.sender_id !== user.id) {
-        markMessageAsRead(message.id);
+        socket.emit('mark_read', {
+          conversation_id: conversation.id,
+          cursor: message.cursor
+        });
       }
     });
 
+    // Our own watermark moved: everything from the other side is now read
+    socket.on('messages_read', (data) => {
+      if (data.user_id === user.id) {
+        markOthersMessagesRead();
+      }
+    });
+
+    // Durable ack: the server has stored these messages
+    socket.on('message_persisted', (data) => {
+      data.ids.forEach(id => pendingRef.current.delete(id));
+      setPendingIds(new Set(pendingRef.current.keys()));
+    });
+
+    // Not stored; keep them pending and try again shortly
+    socket.on('message_failed', (data) => {
+      setError("Some messages could not be saved yet. Retrying...");
+      setTimeout(() => {
+        data.ids.forEach(id => {
+          const payload = pendingRef.current.get(id);
+          if (payload) socket.emit('send_message', { ...payload, resend: true });
+        });
+      }, 3000);
+    });
+
     // Listen for errors
     socket.on('error', (error) => {
       setError(error.message);
@@ -73,7 +123,11 @@ export default function Conversation({ user }) {
           conversation_id: conversation.id
         });
       }
+      socket.off('connect', joinAndResend);
       socket.off('new_message');
+      socket.off('messages_read');
+      socket.off('message_persisted');
+      socket.off('message_failed');
       socket.off('error');
       socket.off('joined_conversation');
     };
@@ -99,19 +153,23 @@ export default function Conversation({ user }) {
         const messagesData = await messagesRes.json();
         if (messagesData.ok) {
           setMessages(messagesData.messages);
+          setOlderCursor(messagesData.has_older ? messagesData.prev_cursor : null);
           
-          // Mark unread messages as read
-          const unreadMessages = messagesData.messages.filter(msg => 
+          // Mark everything up to the newest loaded message as read in one request
+          const hasUnread = messagesData.messages.some(msg =>
             !msg.is_read && msg.sender_id !== user.id
           );
-          
-          for (const message of unreadMessages) {
+
+          if (hasUnread) {
             try {
-              await fetch(`${API}/api/conversations/${conversationData.conversation.id}/messages/${message.id}/read`, {
-                method: "PUT"
+              await fetch(`${API}/api/conversations/${conversationData.conversation.id}/read`, {
+                method: "PUT",
+                headers: { "Content-Type": "application/json" },
+                body: JSON.stringify({ user_id: user.id, cursor: messagesData.next_cursor })
               });
+              markOthersMessagesRead();
             } catch (err) {
-              console.warn("Failed to mark message as read:", err);
+              console.warn("Failed to mark conversation as read:", err);
             }
           }
         } else {
@@ -127,19 +185,48 @@ export default function Conversation({ user }) {
     }
   }
 
+  function markOthersMessagesRead() {
+    setMessages(prev => prev.map(msg =>
+      msg.sender_id !== user.id && !msg.is_read ? { ...msg, is_read: true } : msg
+    ));
+  }
+
+  async function loadOlderMessages() {
+    if (!olderCursor || !conversation) return;
+
+    try {
+      setLoadingOlder(true);
+      const res = await fetch(`${API}/api/conversations/${conversation.id}/messages?before=${encodeURIComponent(olderCursor)}`);
+      const data = await res.json();
+      if (data.ok) {
+        skipScrollRef.current = true;
+        setMessages(prev => [...data.messages, ...prev]);
+        setOlderCursor(data.has_older ? data.prev_cursor : null);
+      } else {
+        setError("Failed to load earlier messages");
+      }
+    } catch (err) {
+      setError(`Failed to load earlier messages: ${String(err)}`);
+    } finally {
+      setLoadingOlder(false);
+    }
+  }
+
   async function sendMessage() {
     if (!newMessage.trim() || !conversation || !socket) return;
 
     try {
       setSending(true);
       
-      // Send message via WebSocket
-      socket.emit('send_message', {
+      // Send message via WebSocket; it stays pending until message_persisted
+      const payload = {
+        id: crypto.randomUUID(),
         conversation_id: conversation.id,
-        sender_id: user.id,
-        sender_type: user.user_type === "ServiceProvider" ? "PROVIDER" : "CLIENT",
         message_text: newMessage.trim()
-      });
+      };
+      pendingRef.current.set(payload.id, payload);
+      setPendingIds(new Set(pendingRef.current.keys()));
+      socket.emit('send_message', payload);
       
       setNewMessage("");
     } catch (err) {
@@ -198,6 +285,17 @@ export default function Conversation({ user }) {
 
         {/* Messages */}
         <div className="flex-1 overflow-y-auto p-4 space-y-4">
+          {olderCursor && (
+            <div className="text-center">
+              <button
+                onClick={loadOlderMessages}
+                disabled={loadingOlder}
+                className="text-sm text-indigo-600 hover:text-indigo-800 disabled:opacity-50"
+              >
+                {loadingOlder ? "Loading..." : "Load earlier messages"}
+              </button>
+            </div>
+          )}
           {messages.length > 0 ? (
             messages.map((message) => (
               <div
@@ -216,6 +314,9 @@ export default function Conversation({ user }) {
                     message.sender_id === user.id ? 'text-indigo-200' : 'text-gray-500'
                   }`}>
                     {new Date(message.created_date).toLocaleString()}
+                    {pendingIds.has(message.id) && (
+                      <span className="ml-2">Sending...</span>
+                    )}
                     {!message.is_read && message.sender_id !== user.id && (
                       <span className="ml-2 text-blue-500">●</span>
                     )}
@@ -3,6 +3,9 @@ import { useNavigate } from "react-router-dom";
 
 const API = import.meta.env.VITE_API_URL || "http://localhost:5001";
 
+// Provider fields the directory cards use
+const PROVIDER_CARD_FIELDS = "name,description,service_type,rating";
+
 // Helper function to get auth headers
 function getAuthHeaders() {
   const token = localStorage.getItem("access_token");
@@ -16,6 +19,13 @@ export default function Dashboard({ user, onLogout }) {
   const [profile, setProfile] = useState(null);
   const [serviceRequests, setServiceRequests] = useState([]);
   const [serviceProviders, setServiceProviders] = useState([]);
+  const [providersCursor, setProvidersCursor] = useState(null);
+  const [searchQuery, setSearchQuery] = useState("");
+  const [searchType, setSearchType] = useState("");
+  const [minRating, setMinRating] = useState("0");
+  const [searchResults, setSearchResults] = useState(null); // null: showing the directory
+  const [searchFacets, setSearchFacets] = useState({});
+  const [searchCursor, setSearchCursor] = useState(null);
   const [showServiceRequestForm, setShowServiceRequestForm] = useState(false);
   const [selectedProvider, setSelectedProvider] = useState(null);
   const [requestForm, setRequestForm] = useState({
@@ -29,6 +39,7 @@ export default function Dashboard({ user, onLogout }) {
   const [selectedRequest, setSelectedRequest] = useState(null);
   const [rating, setRating] = useState(0);
   const [hoverRating, setHoverRating] = useState(0);
+  const [reviewComment, setReviewComment] = useState("");
   const navigate = useNavigate();
 
   useEffect(() => {
@@ -61,13 +72,13 @@ export default function Dashboard({ user, onLogout }) {
         setServiceRequests(requestsData.requests);
       }
 
-      // Load service providers
-      const providersRes = await fetch(`${API}/api/service-providers`, {
-        headers: getAuthHeaders()
-      });
+      // Load the first page of service providers (the directory is public
+      // and revalidated by ETag, so refreshes are usually a 304)
+      const providersRes = await fetch(providerDirectoryUrl());
       const providersData = await providersRes.json();
       if (providersData.ok) {
         setServiceProviders(providersData.providers);
+        setProvidersCursor(providersData.next_cursor);
       }
     } catch (err) {
       setError(`Failed to load dashboard data: ${String(err)}`);
@@ -76,6 +87,74 @@ export default function Dashboard({ user, onLogout }) {
     }
   }
 
+  function providerDirectoryUrl(cursor) {
+    const params = new URLSearchParams({ fields: PROVIDER_CARD_FIELDS });
+    if (cursor) params.set("cursor", cursor);
+    return `${API}/api/service-providers?${params}`;
+  }
+
+  async function loadMoreProviders() {
+    try {
+      const res = await fetch(providerDirectoryUrl(providersCursor));
+      const data = await res.json();
+      if (data.ok) {
+        setServiceProviders(prev => [...prev, ...data.providers]);
+        setProvidersCursor(data.next_cursor);
+      }
+    } catch (err) {
+      setError(`Failed to load more providers: ${String(err)}`);
+    }
+  }
+
+  function providerSearchUrl(type, cursor) {
+    const params = new URLSearchParams({ q: searchQuery.trim(), fields: PROVIDER_CARD_FIELDS, min_rating: minRating });
+    if (type) params.set("service_type", type);
+    if (cursor) params.set("cursor", cursor);
+    return `${API}/api/service-providers/search?${params}`;
+  }
+
+  async function searchProviders(type = searchType) {
+    if (!searchQuery.trim()) {
+      setSearchResults(null);
+      return;
+    }
+    try {
+      setSearchType(type);
+      const res = await fetch(providerSearchUrl(type));
+      const data = await res.json();
+      if (data.ok) {
+        setSearchResults(data.providers);
+        setSearchFacets(data.facets || {});
+        setSearchCursor(data.next_cursor);
+      } else {
+        setError(data.msg || "Search failed");
+      }
+    } catch (err) {
+      setError(`Search failed: ${String(err)}`);
+    }
+  }
+
+  async function loadMoreSearchResults() {
+    try {
+      const res = await fetch(providerSearchUrl(searchType, searchCursor));
+      const data = await res.json();
+      if (data.ok) {
+        setSearchResults(prev => [...prev, ...data.providers]);
+        setSearchCursor(data.next_cursor);
+      }
+    } catch (err) {
+      setError(`Search failed: ${String(err)}`);
+    }
+  }
+
+  function clearSearch() {
+    setSearchQuery("");
+    setSearchType("");
+    setSearchResults(null);
+    setSearchFacets({});
+    setSearchCursor(null);
+  }
+
   async function handleServiceRequest(e) {
     e.preventDefault();
     if (!selectedProvider) return;
@@ -124,7 +203,8 @@ export default function Dashboard({ user, onLogout }) {
         headers: getAuthHeaders(),
         body: JSON.stringify({
           user_id: user.id,
-          rating: rating
+          rating: rating,
+          comment: reviewComment
         })
       });
 
@@ -137,6 +217,7 @@ export default function Dashboard({ user, onLogout }) {
         setSelectedRequest(null);
         setRating(0);
         setHoverRating(0);
+        setReviewComment("");
         loadDashboardData(); // Refresh data
         alert("Thank you for confirming! Your rating has been recorded.");
       } else {
@@ -149,6 +230,18 @@ export default function Dashboard({ user, onLogout }) {
   }
 
   function handleLogout() {
+    // Revoke tokens server-side; don't block the UI on it
+    const accessToken = localStorage.getItem("access_token");
+    if (accessToken) {
+      fetch(`${API}/api/auth/logout`, {
+        method: "POST",
+        headers: {
+          "Content-Type": "application/json",
+          "Authorization": `Bearer ${accessToken}`
+        },
+        body: JSON.stringify({ refresh_token: localStorage.getItem("refresh_token") })
+      }).catch(err => console.error("Logout request failed:", err));
+    }
     localStorage.removeItem("user");
     localStorage.removeItem("isAuthenticated");
     localStorage.removeItem("access_token");
@@ -325,8 +418,59 @@ export default function Dashboard({ user, onLogout }) {
             {/* Available Services */}
             <div className="bg-white rounded-lg shadow p-6">
               <h2 className="text-lg font-semibold text-gray-900 mb-4">Available Service Providers</h2>
+              <form
+                onSubmit={(e) => {
+                  e.preventDefault();
+                  searchProviders("");
+                }}
+                className="flex flex-wrap gap-2 mb-3"
+              >
+                <input
+                  type="search"
+                  value={searchQuery}
+                  onChange={(e) => setSearchQuery(e.target.value)}
+                  placeholder="Search providers, e.g. immigration lawyer Toronto"
+                  className="flex-1 border border-gray-300 rounded-lg px-3 py-2 text-sm focus:ring-2 focus:ring-indigo-500 focus:border-indigo-500"
+                />
+                <select
+                  value={minRating}
+                  onChange={(e) => setMinRating(e.target.value)}
+                  className="border border-gray-300 rounded-lg px-2 py-2 text-sm"
+                >
+                  <option value="0">Any rating</option>
+                  <option value="3">3★ and up</option>
+                  <option value="4">4★ and up</option>
+                  <option value="4.5">4.5★ and up</option>
+                </select>
+                <button type="submit" className="bg-indigo-600 text-white px-4 py-2 rounded-lg text-sm hover:bg-indigo-700">
+                  Search
+                </button>
+                {searchResults && (
+                  <button type="button" onClick={clearSearch} className="text-sm text-gray-600 px-2 hover:text-gray-900">
+                    Clear
+                  </button>
+                )}
+              </form>
+              {searchResults && (
+                <div className="flex flex-wrap gap-2 mb-4">
+                  {Object.entries(searchFacets).map(([type, count]) => (
+                    <button
+                      key={type}
+                      onClick={() => searchProviders(searchType === type ? "" : type)}
+                      className={`px-3 py-1 rounded-full text-xs font-medium ${
+                        searchType === type ? 'bg-indigo-600 text-white' : 'bg-indigo-50 text-indigo-700 hover:bg-indigo-100'
+                      }`}
+                    >
+                      {type} ({count})
+                    </button>
+                  ))}
+                  {searchResults.length === 0 && (
+                    <p className="text-gray-500 text-sm">No providers match your search.</p>
+                  )}
+                </div>
+              )}
               <div className="grid grid-cols-1 md:grid-cols-2 gap-4">
-                {serviceProviders.map((provider) => (
+                {(searchResults ?? serviceProviders).map((provider) => (
                   <div key={provider.id} className="border rounded-lg p-4 hover:shadow-md transition-shadow">
                     <h3 className="font-medium text-gray-900 mb-2">{provider.name}</h3>
                     <p className="text-sm text-gray-600 mb-2">{provider.description}</p>
@@ -349,6 +493,14 @@ export default function Dashboard({ user, onLogout }) {
                   </div>
                 ))}
               </div>
+              {(searchResults ? searchCursor : providersCursor) && (
+                <button
+                  onClick={searchResults ? loadMoreSearchResults : loadMoreProviders}
+                  className="mt-4 w-full border border-indigo-600 text-indigo-600 py-2 px-3 rounded text-sm hover:bg-indigo-50"
+                >
+                  Show more providers
+                </button>
+              )}
             </div>
           </div>
         </div>
@@ -474,6 +626,19 @@ export default function Dashboard({ user, onLogout }) {
               </div>
             </div>
 
+            <div className="mb-6">
+              <label className="block text-sm font-medium text-gray-700 mb-2">
+                Review (optional)
+              </label>
+              <textarea
+                value={reviewComment}
+                onChange={(e) => setReviewComment(e.target.value)}
+                className="w-full border border-gray-300 rounded-lg px-3 py-2 focus:ring-2 focus:ring-indigo-500 focus:border-indigo-500"
+                rows="3"
+                placeholder="Tell others about your experience..."
+              />
+            </div>
+
             <div className="flex space-x-3">
               <button
                 onClick={() => {
@@ -481,6 +646,7 @@ export default function Dashboard({ user, onLogout }) {
                   setSelectedRequest(null);
                   setRating(0);
                   setHoverRating(0);
+                  setReviewComment("");
                   setError(""); // Clear error when closing modal
                 }}
                 className="flex-1 bg-gray-300 text-gray-700 py-2 px-4 rounded-lg hover:bg-gray-400"
@@ -1,5 +1,6 @@
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef } from "react";
 import { useNavigate } from "react-router-dom";
+import { io } from "socket.io-client";
 
 const API = import.meta.env.VITE_API_URL || "http://localhost:5001";
 
@@ -25,6 +26,8 @@ export default function ServiceProviderDashboard({ user, onLogout }) {
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState("");
   const navigate = useNavigate();
+  // Newest service request change_seq applied; null until the first load
+  const cursorRef = useRef(null);
 
   useEffect(() => {
     if (!user || user.user_type !== "ServiceProvider") {
@@ -34,6 +37,36 @@ export default function ServiceProviderDashboard({ user, onLogout }) {
     loadDashboardData();
   }, [user, navigate]);
 
+  // After the first load, the server pushes changes instead of us refetching
+  useEffect(() => {
+    if (!providerProfile) return;
+
+    const socket = io(API, {
+      auth: { token: localStorage.getItem("access_token") }
+    });
+    let reconnecting = false;
+    socket.on('connect', () => {
+      // Catch up on anything pushed before we joined our rooms or while
+      // disconnected; inbox previews are cheap to reload after a gap
+      syncChanges();
+      if (reconnecting) {
+        loadConversations(providerProfile.id);
+      }
+      reconnecting = true;
+    });
+    socket.on('connect_error', () => {
+      setError("Live updates unavailable. Please log in again.");
+    });
+    socket.on('service_request_changed', (change) => {
+      applyRequestChanges([change]);
+    });
+    socket.on('conversation_updated', applyConversationUpdate);
+
+    return () => {
+      socket.disconnect();
+    };
+  }, [providerProfile]);
+
   async function loadDashboardData() {
     try {
       setLoading(true);
@@ -44,25 +77,19 @@ export default function ServiceProviderDashboard({ user, onLogout }) {
       });
       const profileData = await profileRes.json();
       if (profileData.ok) {
-        setProviderProfile(profileData.provider);
-
-        // Load service requests using the actual provider ID
-        const requestsRes = await fetch(`${API}/api/service-providers/${profileData.provider.id}/requests`, {
-          headers: getAuthHeaders()
-        });
+        // Requests and conversations only need the provider ID
+        const [requestsRes] = await Promise.all([
+          fetch(`${API}/api/service-providers/${profileData.provider.id}/requests`, {
+            headers: getAuthHeaders()
+          }),
+          loadConversations(profileData.provider.id)
+        ]);
         const requestsData = await requestsRes.json();
         if (requestsData.ok) {
           setServiceRequests(requestsData.requests);
+          cursorRef.current = requestsData.cursor;
         }
-
-        // Load conversations using the actual provider ID
-        const conversationsRes = await fetch(`${API}/api/service-providers/${profileData.provider.id}/conversations`, {
-          headers: getAuthHeaders()
-        });
-        const conversationsData = await conversationsRes.json();
-        if (conversationsData.ok) {
-          setConversations(conversationsData.conversations);
-        }
+        setProviderProfile(profileData.provider);
       } else {
         setError("Provider profile not found. Please contact support.");
       }
@@ -73,6 +100,78 @@ export default function ServiceProviderDashboard({ user, onLogout }) {
     }
   }
 
+  async function loadConversations(providerId) {
+    const res = await fetch(`${API}/api/service-providers/${providerId}/conversations`, {
+      headers: getAuthHeaders()
+    });
+    const data = await res.json();
+    if (data.ok) {
+      setConversations(data.conversations);
+    }
+  }
+
+  // Fetch every change after our cursor (pushes may have been missed)
+  async function syncChanges() {
+    try {
+      let hasMore = true;
+      while (hasMore && cursorRef.current !== null) {
+        const res = await fetch(`${API}/api/service-requests/changes?since=${cursorRef.current}`, {
+          headers: getAuthHeaders()
+        });
+        const data = await res.json();
+        if (!data.ok) return;
+        applyRequestChanges(data.changes);
+        hasMore = data.has_more;
+      }
+    } catch (err) {
+      console.error("Failed to sync service request changes:", err);
+    }
+  }
+
+  function applyRequestChanges(changes) {
+    // A change can arrive both pushed and from syncChanges, in either order;
+    // each carries the full row, so only an older copy is ever skipped
+    for (const change of changes) {
+      cursorRef.current = Math.max(cursorRef.current ?? 0, change.change_seq);
+    }
+    setServiceRequests(prev => {
+      let next = prev;
+      for (const change of changes) {
+        const existing = next.find(r => r.id === change.id);
+        if (existing && existing.change_seq >= change.change_seq) continue;
+        next = next.filter(r => r.id !== change.id);
+        if (change.status !== 'CONFIRMED') {
+          next = [change, ...next];
+        }
+      }
+      return next.sort((a, b) => new Date(b.requested_date) - new Date(a.requested_date));
+    });
+    setConversations(prev => prev.map(c => {
+      const change = changes.find(ch => ch.conversation_id === c.id);
+      return change ? { ...c, request_status: change.status } : c;
+    }));
+    // Accepting a request opens a new conversation
+    if (providerProfile && changes.some(ch => ch.status === 'ACCEPTED')) {
+      loadConversations(providerProfile.id);
+    }
+  }
+
+  function applyConversationUpdate(update) {
+    setConversations(prev => {
+      const current = prev.find(c => c.id === update.conversation_id);
+      if (!current) return prev;
+      const { conversation_id, sender_id, ...fields } = update;
+      const merged = { ...current, ...fields };
+      if (update.last_message_at) {
+        merged.updated_date = update.last_message_at;
+        if (sender_id !== user.id) {
+          merged.unread_count = (current.unread_count || 0) + 1;
+        }
+      }
+      return [merged, ...prev.filter(c => c.id !== conversation_id)];
+    });
+  }
+
   async function handleAcceptRequest(requestId) {
     try {
       const res = await fetch(`${API}/api/service-requests/${requestId}/accept`, {
@@ -89,7 +188,7 @@ export default function ServiceProviderDashboard({ user, onLogout }) {
         setShowAcceptModal(false);
         setSelectedRequest(null);
         setAcceptNotes("");
-        loadDashboardData(); // Refresh data
+        syncChanges();
         alert("Service request accepted! A conversation has been created for messaging.");
       } else {
         setError(data.msg || "Failed to accept request");
@@ -115,7 +214,7 @@ export default function ServiceProviderDashboard({ user, onLogout }) {
         setShowCompleteModal(false);
         setSelectedRequest(null);
         setCompletionNotes("");
-        loadDashboardData(); // Refresh data
+        syncChanges();
         alert("Service marked as completed! The client has been notified.");
       } else {
         setError(data.msg || "Failed to complete service");
@@ -126,6 +225,18 @@ export default function ServiceProviderDashboard({ user, onLogout }) {
   }
 
   function handleLogout() {
+    // Revoke tokens server-side; don't block the UI on it
+    const accessToken = localStorage.getItem("access_token");
+    if (accessToken) {
+      fetch(`${API}/api/auth/logout`, {
+        method: "POST",
+        headers: {
+          "Content-Type": "application/json",
+          "Authorization": `Bearer ${accessToken}`
+        },
+        body: JSON.stringify({ refresh_token: localStorage.getItem("refresh_token") })
+      }).catch(err => console.error("Logout request failed:", err));
+    }
     localStorage.removeItem("user");
     localStorage.removeItem("isAuthenticated");
     localStorage.removeItem("access_token");
@@ -290,8 +401,20 @@ export default function ServiceProviderDashboard({ user, onLogout }) {
                   {conversations.map((conversation) => (
                     <div key={conversation.id} className="border rounded-lg p-3 hover:shadow-md transition-shadow cursor-pointer"
                          onClick={() => navigate(`/conversation/${conversation.service_request_id}`)}>
-                      <h4 className="font-medium text-gray-900 text-sm">{conversation.request_title}</h4>
+                      <div className="flex justify-between items-center">
+                        <h4 className="font-medium text-gray-900 text-sm">{conversation.request_title}</h4>
+                        {conversation.unread_count > 0 && (
+                          <span className="bg-indigo-600 text-white text-xs rounded-full px-2 py-0.5">
+                            {conversation.unread_count}
+                          </span>
+                        )}
+                      </div>
                       <p className="text-gray-600 text-xs mb-1">Client: {conversation.client.name}</p>
+                      {conversation.last_message_text && (
+                        <p className="text-gray-500 text-xs mb-1 truncate">
+                          {conversation.last_sender_type === "PROVIDER" ? "You: " : ""}{conversation.last_message_text}
+                        </p>
+                      )}
                       <div className="flex justify-between items-center text-xs text-gray-500">
                         <span className={`px-2 py-1 rounded-full ${getStatusColor(conversation.request_status)}`}>
                           {conversation.request_status}
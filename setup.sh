@@ -82,6 +82,20 @@ docker exec -i immican_db psql -U appuser -d appdb < db/init/003_messaging.sql
 docker exec -i immican_db psql -U appuser -d appdb < db/init/004_rating_system.sql
 docker exec -i immican_db psql -U appuser -d appdb < db/init/005_advanced_security.sql
 docker exec -i immican_db psql -U appuser -d appdb < db/init/006_email_verification.sql
+docker exec -i immican_db psql -U appuser -d appdb < db/init/007_shared_rate_limits.sql
+docker exec -i immican_db psql -U appuser -d appdb < db/init/008_security_metrics_rollup.sql
+docker exec -i immican_db psql -U appuser -d appdb < db/init/009_partitioned_logs.sql
+docker exec -i immican_db psql -U appuser -d appdb < db/init/010_token_revocation.sql
+docker exec -i immican_db psql -U appuser -d appdb < db/init/011_message_pagination.sql
+docker exec -i immican_db psql -U appuser -d appdb < db/init/012_conversation_reads.sql
+docker exec -i immican_db psql -U appuser -d appdb < db/init/013_conversation_summaries.sql
+docker exec -i immican_db psql -U appuser -d appdb < db/init/014_batched_message_triggers.sql
+docker exec -i immican_db psql -U appuser -d appdb < db/init/015_socketio_fanout.sql
+docker exec -i immican_db psql -U appuser -d appdb < db/init/016_service_request_changes.sql
+docker exec -i immican_db psql -U appuser -d appdb < db/init/017_provider_rating_aggregates.sql
+docker exec -i immican_db psql -U appuser -d appdb < db/init/018_provider_directory_cache.sql
+docker exec -i immican_db psql -U appuser -d appdb < db/init/019_provider_search.sql
+docker exec -i immican_db psql -U appuser -d appdb < db/init/020_login_attempt.sql
 
 print_success "Database schema initialized"
 